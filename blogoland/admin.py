@@ -3,8 +3,15 @@
 from django_summernote.admin import SummernoteModelAdmin
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import BooleanField, Case, Prefetch, Value, When
 
-from blogoland.models import Post, PostImage, Category
+from blogoland.models import Post, PostImage, Category, TODAY
+from blogoland.paginators import EstimatedCountPaginator
+
+
+# Columns shown, filtered or ordered on by the Post changelist.
+CHANGELIST_FIELDS = ('pk', 'title', 'slug', 'publication_date', 'creation_date', 'is_visible')
 
 
 class PostImageInline(admin.TabularInline):
@@ -15,6 +22,34 @@ class PostImageInline(admin.TabularInline):
     extra = 1
 
 
+class PostChangeList(ChangeList):
+    """
+    Post changelist that loads its page with a constant number of queries:
+    only the shown columns, the public status computed in SQL and the
+    categories of the page prefetched in one query.
+    """
+    def get_queryset(self, request):
+        queryset = super(PostChangeList, self).get_queryset(request)
+        return queryset.only(*CHANGELIST_FIELDS).annotate(
+            public=Case(
+                When(is_visible=True, publication_date__lte=TODAY(), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+        ).prefetch_related(Prefetch('category', queryset=Category.objects.only('pk', 'title')))
+
+    def get_ordering(self, request, queryset):
+        """
+        Drops the pk added to the default ordering, which already ends with
+        the unique slug, so the page is read in blogoland_post_ordering_idx
+        order.
+        """
+        ordering = super(PostChangeList, self).get_ordering(request, queryset)
+        if ordering == list(Post._meta.ordering) + ['-pk']:
+            ordering = ordering[:-1]
+        return ordering
+
+
 @admin.register(Post)
 class PostAdmin(SummernoteModelAdmin):
     """
@@ -49,7 +84,7 @@ class PostAdmin(SummernoteModelAdmin):
             'title',
             'slug',
             'publication_date',
-            'is_public',
+            'get_is_public',
             'is_visible',
             'get_post_categories'
             )
@@ -61,6 +96,13 @@ class PostAdmin(SummernoteModelAdmin):
         'creation_date',
         )
     search_fields = ['title', 'pk']
+    # Large tables are paginated from an estimated count, and the count
+    # without the filters is not shown.
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return PostChangeList
 
     def get_post_categories(self, post):
         """
@@ -68,6 +110,15 @@ class PostAdmin(SummernoteModelAdmin):
         """
         return ", ".join([cat.title for cat in post.category.all()])
 
+    def get_is_public(self, post):
+        """
+        Returns the public status computed by the changelist query.
+        """
+        return post.public
+    get_is_public.boolean = True
+    get_is_public.short_description = 'Is public'
+    get_is_public.admin_order_field = 'public'
+
 
 @admin.register(Category)
 class CategoryAdmin(SummernoteModelAdmin):
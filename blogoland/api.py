@@ -0,0 +1,332 @@
+# -*- coding:utf8 -*-
+"""
+Read-only JSON API of posts, categories and post images.
+
+The endpoints keep the public/staff split of the HTML views and answer
+conditional GET requests from the same validators. Clients pick the fields
+they need with ``?fields=a,b``: only the columns of those fields are loaded,
+and categories and images are only prefetched when asked for, in one query
+per chunk of posts. Post lists are paginated by cursor (``?cursor=`` and
+``?limit=``) and streamed in chunks, like the category list.
+"""
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Prefetch, prefetch_related_objects
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views.generic import View
+
+from blogoland import cache
+from blogoland.confs import DEFAULT_API_MAX_LIMIT
+from blogoland.instrumentation import InstrumentedViewMixin
+from blogoland.models import Post, PostImage, Category
+from blogoland.paginators import CursorPaginator, InvalidCursor
+from blogoland.views import ConditionalViewMixin, PAGINATION
+
+
+API_MAX_LIMIT = getattr(settings, 'BLOGOLAND_API_MAX_LIMIT', DEFAULT_API_MAX_LIMIT)
+
+CHUNK_SIZE = 100
+
+CONTENT_TYPE = 'application/json'
+
+
+def absolute_url(request, path):
+    return request.build_absolute_uri(path)
+
+
+def serialize_image(img, request):
+    derivatives = img.get_derivatives()
+    storage = img.image.storage
+    return OrderedDict([
+        ('id', img.pk),
+        ('title', img.title),
+        ('img_type', img.img_type),
+        ('url', absolute_url(request, img.image.url)),
+        ('width', derivatives.get('width')),
+        ('height', derivatives.get('height')),
+        ('derivatives', [OrderedDict([
+            ('url', absolute_url(request, storage.url(derivative['name']))),
+            ('width', derivative['width']),
+            ('height', derivative['height']),
+            ('format', derivative['format']),
+        ]) for derivative in derivatives.get('derivatives', [])]),
+    ])
+
+
+def serialize_category_link(category, request):
+    return OrderedDict([
+        ('slug', category.slug),
+        ('title', category.title),
+        ('url', absolute_url(request, category.get_absolute_url())),
+    ])
+
+
+# Field name: (columns to load, value getter). Categories and images are
+# prefetched instead.
+POST_FIELDS = OrderedDict([
+    ('id', ((), lambda post, request: post.pk)),
+    ('slug', (('slug',), lambda post, request: post.slug)),
+    ('title', (('title',), lambda post, request: post.title)),
+    ('url', (('slug',), lambda post, request: absolute_url(request, post.get_absolute_url()))),
+    ('publication_date', (('publication_date',), lambda post, request: post.publication_date)),
+    ('modification_date', (('modification_date',), lambda post, request: post.modification_date)),
+    ('seo_title', (('seo_title',), lambda post, request: post.seo_title)),
+    ('seo_description', (('seo_description',), lambda post, request: post.seo_description)),
+    ('seo_keywords', (('seo_keywords',), lambda post, request: post.seo_keywords)),
+    ('excerpt', (('excerpt',), lambda post, request: post.excerpt)),
+    ('content', (('rendered_content',), lambda post, request: post.rendered_content)),
+    ('categories', ((), lambda post, request: [
+        serialize_category_link(category, request) for category in post.category.all()])),
+    ('images', ((), lambda post, request: [serialize_image(img, request) for img in post.image_set.all()])),
+])
+POST_LIST_FIELDS = ('id', 'slug', 'title', 'url', 'publication_date', 'excerpt')
+
+CATEGORY_FIELDS = OrderedDict([
+    ('id', ((), lambda category, request: category.pk)),
+    ('slug', (('slug',), lambda category, request: category.slug)),
+    ('title', (('title',), lambda category, request: category.title)),
+    ('url', (('slug',), lambda category, request: absolute_url(request, category.get_absolute_url()))),
+    ('modification_date', (('modification_date',), lambda category, request: category.modification_date)),
+    ('seo_title', (('seo_title',), lambda category, request: category.seo_title)),
+    ('seo_description', (('seo_description',), lambda category, request: category.seo_description)),
+    ('seo_keywords', (('seo_keywords',), lambda category, request: category.seo_keywords)),
+    ('post_count', (('post_count', 'public_post_count'), lambda category, request: (
+        category.post_count if request.user.is_staff else category.public_post_count))),
+])
+
+
+class InvalidParameter(ValueError):
+    pass
+
+
+def to_json(value):
+    return json.dumps(value, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+class ApiViewMixin(InstrumentedViewMixin, ConditionalViewMixin):
+    """
+    Parses the fields parameter and serializes objects with it.
+    """
+    fields = POST_FIELDS
+    default_fields = None
+    fields_kwarg = 'fields'
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super(ApiViewMixin, self).dispatch(request, *args, **kwargs)
+        except InvalidParameter as error:
+            return JsonResponse({'error': str(error)}, status=400)
+
+    def get_fields(self):
+        """
+        Returns the requested field names, or the default ones.
+        """
+        value = self.request.GET.get(self.fields_kwarg)
+        if not value:
+            return list(self.default_fields or self.fields)
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise InvalidParameter('Unknown fields: %s.' % ', '.join(unknown))
+        return names
+
+    def get_columns(self, fields):
+        columns = set(['pk'])
+        for name in fields:
+            columns.update(self.fields[name][0])
+        return columns
+
+    def serialize(self, obj, fields):
+        return OrderedDict((name, self.fields[name][1](obj, self.request)) for name in fields)
+
+
+class PostApiMixin(ApiViewMixin):
+    """
+    Loads the posts with the columns and relations of the requested fields.
+    """
+    def get_base_queryset(self):
+        if self.request.user.is_staff:
+            return Post.objects.all()
+        return Post.objects.get_public_posts()
+
+    def get_prefetches(self, fields):
+        prefetches = []
+        if 'categories' in fields:
+            prefetches.append(Prefetch('category', queryset=Category.objects.only('pk', 'slug', 'title')))
+        if 'images' in fields:
+            prefetches.append(Prefetch('image_set', queryset=PostImage.objects.order_by('pk')))
+        return prefetches
+
+
+class PostApiListView(PostApiMixin, View):
+    """
+    Streams a page of posts, paginated by cursor.
+    """
+    default_fields = POST_LIST_FIELDS
+    cursor_kwarg = 'cursor'
+    limit_kwarg = 'limit'
+
+    def get_queryset(self):
+        queryset = self.get_base_queryset()
+        category_slug = self.request.GET.get('category')
+        if category_slug:
+            queryset = queryset.filter(category__slug=category_slug)
+        return queryset
+
+    def get_validators(self):
+        self.get_fields()
+        return self.get_version_validators([cache.LIST_VERSION])
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.GET.get(self.limit_kwarg, PAGINATION))
+        except ValueError:
+            raise InvalidParameter('Invalid limit.')
+        return max(1, min(limit, API_MAX_LIMIT))
+
+    def get(self, request, *args, **kwargs):
+        fields = self.get_fields()
+        queryset = self.get_queryset()
+        paginator = CursorPaginator(queryset, self.get_limit())
+        # The ordering fields are needed to build the cursors.
+        columns = self.get_columns(fields) | set(name.lstrip('-') for name in paginator.ordering)
+        paginator.queryset = queryset.only(*columns)
+        try:
+            page = paginator.page(request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise InvalidParameter('Invalid cursor.')
+        return StreamingHttpResponse(self.stream(page, fields), content_type=CONTENT_TYPE)
+
+    def get_page_url(self, cursor):
+        if cursor is None:
+            return None
+        params = self.request.GET.copy()
+        params[self.cursor_kwarg] = cursor
+        return absolute_url(self.request, '%s?%s' % (self.request.path, params.urlencode()))
+
+    def stream(self, page, fields):
+        """
+        Yields the JSON of the page, prefetching the relations of each chunk
+        of posts.
+        """
+        yield '{"results":['
+        prefetches = self.get_prefetches(fields)
+        posts = list(page.object_list)
+        for start in range(0, len(posts), CHUNK_SIZE):
+            chunk = posts[start:start + CHUNK_SIZE]
+            if prefetches:
+                prefetch_related_objects(chunk, *prefetches)
+            items = ','.join(to_json(self.serialize(post, fields)) for post in chunk)
+            yield (',' if start else '') + items
+        yield '],"next":%s,"previous":%s}' % (
+            to_json(self.get_page_url(page.next_cursor)), to_json(self.get_page_url(page.previous_cursor)))
+
+
+class PostApiDetailView(PostApiMixin, View):
+    """
+    Returns one post, with every field by default.
+    """
+    def get_validators(self):
+        self.get_fields()
+        aggregate = self.get_base_queryset().filter(slug=self.kwargs.get('post_slug')).aggregate(
+            modified=Max('modification_date'),
+            category_modified=Max('category__modification_date'),
+        )
+        if aggregate['modified'] is None:
+            return {}
+        aggregate['staff'] = self.request.user.is_staff
+        aggregate['query'] = self.request.GET.urlencode()
+        return aggregate
+
+    def get(self, request, *args, **kwargs):
+        fields = self.get_fields()
+        queryset = self.get_base_queryset().only(*self.get_columns(fields)).prefetch_related(
+            *self.get_prefetches(fields))
+        try:
+            post = queryset.get(slug=self.kwargs.get('post_slug'))
+        except Post.DoesNotExist:
+            raise Http404()
+        return JsonResponse(self.serialize(post, fields))
+
+
+class PostImageApiListView(PostApiDetailView):
+    """
+    Returns the images of one post.
+    """
+    fields_kwarg = None
+
+    def get_fields(self):
+        return ['images']
+
+    def get(self, request, *args, **kwargs):
+        post = self.get_base_queryset().filter(slug=self.kwargs.get('post_slug')).only('pk').first()
+        if post is None:
+            raise Http404()
+        images = PostImage.objects.filter(post=post).order_by('pk')
+        return JsonResponse({'results': [serialize_image(img, request) for img in images]})
+
+
+class CategoryApiMixin(ApiViewMixin):
+    fields = CATEGORY_FIELDS
+
+    def get_validators(self):
+        self.get_fields()
+        aggregate = self.get_queryset().aggregate(modified=Max('modification_date'))
+        # The post counts change with the posts.
+        aggregate['posts'] = cache.get_versions([cache.LIST_VERSION])[0]
+        aggregate['staff'] = self.request.user.is_staff
+        aggregate['query'] = self.request.GET.urlencode()
+        return aggregate
+
+    def refresh_counts(self, queryset, fields):
+        """
+        Stores the post counts of the categories not counted today, before
+        they are read.
+        """
+        if 'post_count' in fields:
+            queryset.refresh_post_counts()
+
+
+class CategoryApiListView(CategoryApiMixin, View):
+    """
+    Streams every category.
+    """
+    def get_queryset(self):
+        return Category.objects.order_by('title', 'pk')
+
+    def get(self, request, *args, **kwargs):
+        fields = self.get_fields()
+        queryset = self.get_queryset()
+        self.refresh_counts(queryset, fields)
+        return StreamingHttpResponse(
+            self.stream(queryset.only(*self.get_columns(fields)), fields), content_type=CONTENT_TYPE)
+
+    def stream(self, queryset, fields):
+        yield '{"results":['
+        for number, category in enumerate(queryset.iterator()):
+            yield (',' if number else '') + to_json(self.serialize(category, fields))
+        yield ']}'
+
+
+class CategoryApiDetailView(CategoryApiMixin, View):
+    """
+    Returns one category.
+    """
+    def get_queryset(self):
+        return Category.objects.filter(slug=self.kwargs.get('category_slug'))
+
+    def get_validators(self):
+        validators = super(CategoryApiDetailView, self).get_validators()
+        return validators if validators['modified'] is not None else {}
+
+    def get(self, request, *args, **kwargs):
+        fields = self.get_fields()
+        queryset = self.get_queryset()
+        self.refresh_counts(queryset, fields)
+        category = queryset.only(*self.get_columns(fields)).first()
+        if category is None:
+            raise Http404()
+        return JsonResponse(self.serialize(category, fields))
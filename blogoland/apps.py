@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class BlogolandConfig(AppConfig):
     name = 'blogoland'
+
+    def ready(self):
+        from blogoland import signals  # noqa: F401
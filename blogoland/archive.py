@@ -0,0 +1,137 @@
+# -*- coding:utf8 -*-
+"""
+Precomputed index of the post archive.
+
+The number of posts published in each month, overall and by category, is
+kept in the ArchiveMonth table. The signal handlers recount the months of a
+post when it is saved or deleted or its categories change, so the archive
+views and the archive_list tag never aggregate over the posts. As with the
+category counts, the public counts are stamped with the day they were
+computed. The months that may hold scheduled posts get their public posts
+counted again when read on another day, without storing them, until
+``blogoland_archive_index --stale`` recounts them.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Case, Count, When
+
+from blogoland.models import ArchiveMonth, Post, TODAY
+
+
+def month_range(year, month):
+    """
+    Returns the first day of the month and the first day of the next one.
+    """
+    start = datetime.date(year, month, 1)
+    if month == 12:
+        return start, datetime.date(year + 1, 1, 1)
+    return start, datetime.date(year, month + 1, 1)
+
+
+def get_post_months(queryset):
+    """
+    Returns the (year, month) of the posts of the given QuerySet.
+    """
+    return set((date.year, date.month) for date in queryset.dates('publication_date', 'month'))
+
+
+@transaction.atomic
+def recount(months):
+    """
+    Rebuilds the rows of the given (year, month) pairs, two aggregate
+    queries per month.
+    """
+    today = TODAY()
+    public = Count(Case(When(is_visible=True, publication_date__lte=today, then=1)))
+    for year, month in set(months):
+        start, end = month_range(year, month)
+        posts = Post.objects.filter(publication_date__gte=start, publication_date__lt=end).order_by()
+        totals = posts.aggregate(total=Count('pk'), public=public)
+        rows = [(None, totals['total'], totals['public'])]
+        rows.extend(
+            (row['category'], row['total'], row['public'])
+            for row in posts.values('category').annotate(total=Count('pk'), public=public)
+            # Posts without category are only counted in the overall row.
+            if row['category'] is not None
+        )
+        ArchiveMonth.objects.filter(year=year, month=month).delete()
+        ArchiveMonth.objects.bulk_create([
+            ArchiveMonth(year=year, month=month, category_id=category, post_count=total,
+                         public_post_count=public_count, count_date=today)
+            for category, total, public_count in rows if total
+        ])
+
+
+def rebuild():
+    """
+    Rebuilds the whole index.
+    """
+    ArchiveMonth.objects.all().delete()
+    recount(get_post_months(Post.objects.all()))
+
+
+def is_stale(row, today):
+    # Past months can't get new public posts as the days go by.
+    return row.count_date != today and month_range(row.year, row.month)[1] > row.count_date
+
+
+def recount_stale():
+    """
+    Recounts the months whose public counts are outdated. Returns the
+    number of months recounted.
+    """
+    today = TODAY()
+    months = set((row.year, row.month) for row in ArchiveMonth.objects.exclude(count_date=today)
+                 if is_stale(row, today))
+    recount(months)
+    return len(months)
+
+
+def count_public_posts(months, category=None):
+    """
+    Returns a dict with the number of public posts of each given (year,
+    month), overall or in the given category, without storing it.
+    """
+    counts = {}
+    for year, month in months:
+        start, end = month_range(year, month)
+        posts = Post.objects.get_public_posts().filter(publication_date__gte=start, publication_date__lt=end)
+        if category is not None:
+            posts = posts.filter(category=category)
+        counts[(year, month)] = posts.count()
+    return counts
+
+
+def get_months(category=None, staff=False):
+    """
+    Returns a list of (first day, post count) of the months with posts,
+    newest first, overall or in the given category. Without staff only
+    public posts are counted.
+    """
+    if category is None:
+        queryset = ArchiveMonth.objects.filter(category__isnull=True)
+    else:
+        queryset = ArchiveMonth.objects.filter(category_id=category.pk)
+    rows = list(queryset)
+    counts = {}
+    if not staff:
+        today = TODAY()
+        counts = count_public_posts([(row.year, row.month) for row in rows if is_stale(row, today)], category)
+    months = []
+    for row in rows:
+        if staff:
+            count = row.post_count
+        else:
+            count = counts.get((row.year, row.month), row.public_post_count)
+        if count:
+            months.append((datetime.date(row.year, row.month, 1), count))
+    return months
+
+
+def get_post_count(year, month=None, category=None, staff=False):
+    """
+    Returns the number of posts of the given year, or month of the year.
+    """
+    return sum(count for date, count in get_months(category, staff)
+               if date.year == year and (month is None or date.month == month))
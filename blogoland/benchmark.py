@@ -0,0 +1,273 @@
+# -*- coding:utf8 -*-
+"""
+Benchmark harness for the blogoland views, paginators and template tags.
+
+It seeds a dataset of posts, categories and images, then measures the
+latency and the number of queries of each scenario. The query counts are
+checked against BUDGETS by the test suite, so a N+1 query in a template
+or a view fails the build. The module doubles as the URLconf used while
+benchmarking.
+"""
+import datetime
+import json
+import os
+import random
+import time
+
+from django.conf.urls import include, url
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sites.models import Site
+from django.core.paginator import Paginator
+from django.db import connections
+from django.template import Context, Template
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from blogoland import archive, popular, related, search
+from blogoland.models import Post, PostImage, Category
+from blogoland.paginators import CursorPaginator, NEXT
+from blogoland.views import PostListView, PostDetailView, CategoryPostListView, PostArchiveView, PAGINATION
+
+
+urlpatterns = [
+    url(r'^', include('blogoland.urls')),
+]
+
+BENCHMARK_SETTINGS = {
+    'ROOT_URLCONF': 'blogoland.benchmark',
+    'TEMPLATES': [{
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [os.path.join(os.path.dirname(__file__), 'benchmark_templates')],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': ['django.template.context_processors.request'],
+        },
+    }],
+}
+
+# Maximum number of queries of each scenario, for anonymous users with the
+# page cache disabled. The current site is looked up once per scenario.
+BUDGETS = {
+    'view:post_list': 6,
+    'view:post_list:deep': 6,
+    'view:post_detail': 7,
+    'view:category_post_list': 6,
+    'view:category_post_list:deep': 6,
+    'view:archive_month': 6,
+    'paginator:page': 2,
+    'paginator:page:deep': 2,
+    'paginator:cursor': 1,
+    'paginator:cursor:deep': 1,
+    'tag:post_title': 0,
+    'tag:post_date': 0,
+    'tag:post_content': 0,
+    'tag:post_excerpt': 0,
+    'tag:post_detail_image': 1,
+    'tag:post_thumbnail_image': 1,
+    'tag:get_post_gallery_images': 1,
+    'tag:get_latest_posts': 1,
+    'tag:get_category_list': 1,
+    'tag:get_category_list_with_counts': 1,
+    'tag:social_media_image_url': 2,
+    'tag:social_media_post_url': 1,
+    'tag:post_social_meta': 2,
+    'tag:paginator': 0,
+    'tag:archive_list': 1,
+    'tag:get_related_posts': 1,
+    'tag:get_popular_posts': 1,
+}
+
+IMG_TYPES = ('thumbnail', 'detail', 'gallery')
+
+TAGS = {
+    'tag:post_title': '{% post_title %}',
+    'tag:post_date': '{% post_date %}',
+    'tag:post_content': '{% post_content %}',
+    'tag:post_excerpt': '{% post_excerpt %}',
+    'tag:post_detail_image': '{% post_detail_image %}',
+    'tag:post_thumbnail_image': '{% post_thumbnail_image %}',
+    'tag:get_post_gallery_images': '{% get_post_gallery_images as images %}{% for img in images %}{{ img.title }}{% endfor %}',
+    'tag:get_latest_posts': '{% get_latest_posts 5 as posts %}{% for post in posts %}{{ post.title }}{% endfor %}',
+    'tag:get_category_list': '{% get_category_list as categories %}{% for category in categories %}{{ category.title }}{% endfor %}',
+    'tag:get_category_list_with_counts': (
+        '{% get_category_list_with_counts as categories %}'
+        '{% for category in categories %}{{ category.title }} {{ category.public_post_count }}{% endfor %}'),
+    'tag:social_media_image_url': '{% social_media_image_url %}',
+    'tag:social_media_post_url': '{% social_media_post_url %}',
+    'tag:post_social_meta': '{% post_social_meta %}',
+    'tag:archive_list': '{% archive_list %}',
+    'tag:get_related_posts': '{% get_related_posts object 5 as posts %}{% for post in posts %}{{ post.title }}{% endfor %}',
+    'tag:get_popular_posts': '{% get_popular_posts as posts %}{% for post in posts %}{{ post.title }}{% endfor %}',
+}
+
+
+def seed(posts=1000, categories=20, images_per_post=3, seed=0):
+    """
+    Fills the database with a deterministic dataset. Rows are written with
+    bulk_create, so no signal handler runs.
+    """
+    rand = random.Random(seed)
+    # Separate, so the view counts don't change the rest of the dataset.
+    view_rand = random.Random(seed + 1)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do']
+
+    Category.objects.bulk_create([
+        Category(title='Category %s' % i, slug='category-%s' % i) for i in range(categories)
+    ])
+    category_pks = list(Category.objects.values_list('pk', flat=True))
+
+    today = datetime.date.today()
+    new_posts = []
+    for i in range(posts):
+        paragraphs = ''.join(
+            '<p>%s</p>' % ' '.join(rand.choice(words) for _ in range(60)) for _ in range(5))
+        post = Post(
+            title='Post %s %s' % (i, rand.choice(words)),
+            slug='post-%s' % i,
+            content=paragraphs,
+            publication_date=today - datetime.timedelta(days=rand.randint(-10, 3650)),
+            is_visible=rand.random() > 0.05,
+            view_count=view_rand.randint(0, 10000),
+        )
+        post.fill_defaults()
+        post.search_document = search.build_document(post.title, post.plain_content, [])
+        new_posts.append(post)
+    Post.objects.bulk_create(new_posts, batch_size=500)
+    post_pks = list(Post.objects.values_list('pk', flat=True))
+
+    Through = Post.category.through
+    Through.objects.bulk_create([
+        Through(post_id=post_pk, category_id=category_pk)
+        for post_pk in post_pks
+        for category_pk in rand.sample(category_pks, min(len(category_pks), rand.randint(1, 3)))
+    ], batch_size=500)
+
+    images = []
+    for post_pk in post_pks:
+        for i in range(images_per_post):
+            img_type = IMG_TYPES[i % len(IMG_TYPES)]
+            name = 'blogoland/post/%s/image-%s.jpg' % (post_pk, i)
+            derivatives = [{'name': 'blogoland/post/%s/derivatives/image-%s-%s.%s' % (post_pk, i, width, ext),
+                            'width': width, 'height': width * 2 // 3, 'format': image_format}
+                           for width in (320, 640) for image_format, ext in (('webp', 'webp'), ('jpeg', 'jpg'))]
+            images.append(PostImage(
+                post_id=post_pk, title='Image %s' % i, img_type=img_type, image=name,
+                derivatives=json.dumps({'source': name, 'width': 640, 'height': 426, 'derivatives': derivatives}),
+            ))
+    PostImage.objects.bulk_create(images, batch_size=500)
+    search.index_documents(list(Post.objects.values_list('pk', 'search_document')))
+    Category.objects.update_post_counts()
+    archive.rebuild()
+    related.rebuild()
+    popular.rebuild()
+
+
+def get_request(path='/', **params):
+    request = RequestFactory().get(path, params)
+    request.user = AnonymousUser()
+    return request
+
+
+def render_view(view_class, params=None, **kwargs):
+    response = view_class.as_view()(get_request(**(params or {})), **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def render_tag(source, post):
+    context = Context({'object': post, 'request': get_request(post.get_absolute_url())})
+    return Template('{% load blogoland_tags %}' + source).render(context)
+
+
+def get_scenarios():
+    """
+    Returns a list of (name, callable) with every benchmarked scenario.
+    """
+    public = Post.objects.get_public_posts()
+    post = public.filter(image_set__isnull=False).first()
+    category = Category.objects.order_by('pk').first()
+    category_posts = public.filter(category=category)
+    newest = public.first().publication_date
+    last_page = max(1, Paginator(public, PAGINATION).num_pages)
+    last_category_page = max(1, Paginator(category_posts, PAGINATION).num_pages)
+
+    cursor_paginator = CursorPaginator(public, PAGINATION)
+    deep_post = public[max(0, public.count() - PAGINATION - 1)]
+    deep_cursor = cursor_paginator.encode_cursor(NEXT, deep_post)
+
+    def paginate(number):
+        return lambda: list(Paginator(public, PAGINATION).page(number).object_list)
+
+    def paginate_cursor(cursor):
+        return lambda: CursorPaginator(public, PAGINATION).page(cursor)
+
+    def render_paginator():
+        paginator = Paginator(public, PAGINATION)
+        page = paginator.page(1)
+        context = {'page_obj': page, 'paginator': paginator, 'blogoland_pagination_mode': 'page'}
+        return lambda: Template('{% load blogoland_tags %}{% paginator %}').render(Context(context))
+
+    scenarios = [
+        ('view:post_list', lambda: render_view(PostListView)),
+        ('view:post_list:deep', lambda: render_view(PostListView, {'page': last_page})),
+        ('view:post_detail', lambda: render_view(PostDetailView, post_slug=post.slug)),
+        ('view:category_post_list', lambda: render_view(CategoryPostListView, category_slug=category.slug)),
+        ('view:category_post_list:deep', lambda: render_view(
+            CategoryPostListView, {'page': last_category_page}, category_slug=category.slug)),
+        ('view:archive_month', lambda: render_view(
+            PostArchiveView, year='%04d' % newest.year, month='%02d' % newest.month)),
+        ('paginator:page', paginate(1)),
+        ('paginator:page:deep', paginate(last_page)),
+        ('paginator:cursor', paginate_cursor(None)),
+        ('paginator:cursor:deep', paginate_cursor(deep_cursor)),
+        ('tag:paginator', render_paginator()),
+    ]
+    # The tags get a post loaded without prefetching, their worst case.
+    tag_post = Post.objects.get(pk=post.pk)
+    for name in sorted(TAGS):
+        scenarios.append((name, (lambda source: lambda: render_tag(source, tag_post))(TAGS[name])))
+    return scenarios
+
+
+def measure(func, iterations=1):
+    """
+    Runs the callable the given times and returns its query count, on every
+    database, and its latency statistics in milliseconds.
+    """
+    timings = []
+    queries = 0
+    for _ in range(iterations):
+        Site.objects.clear_cache()
+        captures = [CaptureQueriesContext(connections[alias]) for alias in connections]
+        for capture in captures:
+            capture.__enter__()
+        try:
+            start = time.time()
+            func()
+            timings.append((time.time() - start) * 1000)
+        finally:
+            for capture in reversed(captures):
+                capture.__exit__(None, None, None)
+        queries = sum(len(capture.captured_queries) for capture in captures)
+    timings.sort()
+    return {
+        'queries': queries,
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(timings[len(timings) // 2], 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'max_ms': round(timings[-1], 3),
+    }
+
+
+def run(iterations=10):
+    """
+    Measures every scenario and returns the results keyed by name.
+    """
+    results = {}
+    for name, func in get_scenarios():
+        result = measure(func, iterations)
+        result['budget'] = BUDGETS.get(name)
+        result['within_budget'] = result['budget'] is None or result['queries'] <= result['budget']
+        results[name] = result
+    return results
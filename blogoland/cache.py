@@ -0,0 +1,204 @@
+# -*- coding:utf8 -*-
+"""
+Versioned cache for blogoland pages.
+
+Every cached page is stored under a key that embeds the current version of
+the content it depends on: the post list, a post or a category. The
+versions are bumped by the signal handlers in ``blogoland.signals`` so a
+change is visible right away while the rest of the cached pages survive.
+A read replica may still serve the old content for a while after a bump,
+so what is read from it then is not stored, see is_settling.
+"""
+import datetime
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+from blogoland.confs import (
+    DEFAULT_CACHE_ALIAS, DEFAULT_CACHE_ENABLED, DEFAULT_CACHE_TIMEOUT, DEFAULT_REPLICA_STICKY_SECONDS,
+)
+
+
+CACHE_ENABLED = getattr(settings, 'BLOGOLAND_CACHE_ENABLED', DEFAULT_CACHE_ENABLED)
+CACHE_ALIAS = getattr(settings, 'BLOGOLAND_CACHE_ALIAS', DEFAULT_CACHE_ALIAS)
+CACHE_TIMEOUT = getattr(settings, 'BLOGOLAND_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT)
+REPLICA_STICKY_SECONDS = getattr(settings, 'BLOGOLAND_REPLICA_STICKY_SECONDS', DEFAULT_REPLICA_STICKY_SECONDS)
+
+KEY_PREFIX = 'blogoland'
+LIST_VERSION = 'list'
+
+logger = logging.getLogger('blogoland.cache')
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def post_version(slug):
+    return 'post:%s' % slug
+
+
+def category_version(slug):
+    return 'category:%s' % slug
+
+
+def _version_key(name):
+    return '%s:version:%s' % (KEY_PREFIX, name)
+
+
+def _bumped_key(name):
+    return '%s:bumped:%s' % (KEY_PREFIX, name)
+
+
+def _new_version():
+    # Versions start from the current time, so a version key evicted from
+    # the cache never comes back with a value used by older entries.
+    return int(time.time() * 1000)
+
+
+def get_versions(names):
+    """
+    Returns a list with the current version of each given name.
+    """
+    cache = get_cache()
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = dict((key, _new_version()) for key in keys if key not in versions)
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(names):
+    """
+    Bumps the version of each given name, invalidating every cached entry
+    that depends on it.
+    """
+    cache = get_cache()
+    names = set(names)
+    for name in names:
+        key = _version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+    if names:
+        cache.set_many(dict((_bumped_key(name), 1) for name in names), REPLICA_STICKY_SECONDS)
+
+
+def is_settling(names):
+    """
+    Returns whether any of the given versions was bumped in the last
+    BLOGOLAND_REPLICA_STICKY_SECONDS, while a replica may still lag behind
+    the change.
+    """
+    return bool(get_cache().get_many([_bumped_key(name) for name in names]))
+
+
+def make_key(prefix, version_names, url):
+    """
+    Builds the cache key of a page from its versions and its absolute URL,
+    so pages served on several hosts or schemes don't share entries.
+    """
+    versions = '.'.join(str(version) for version in get_versions(version_names))
+    url_hash = hashlib.md5(force_bytes(url)).hexdigest()
+    return '%s:%s:%s:%s' % (KEY_PREFIX, prefix, versions, url_hash)
+
+
+def next_publication_key(date):
+    return '%s:next_publication:%s' % (KEY_PREFIX, date.isoformat())
+
+
+def get_timeout(next_change, timeout=None):
+    """
+    Returns the timeout in seconds for a cached entry, capped so it expires
+    exactly when the set of public posts changes at the given datetime.
+    """
+    if timeout is None:
+        timeout = CACHE_TIMEOUT
+    if next_change is None:
+        return timeout
+    seconds = int(math.ceil((next_change - datetime.datetime.now()).total_seconds()))
+    return max(1, min(timeout, seconds))
+
+
+class LocalCache(object):
+    """
+    Bounded in-process LRU cache. Each entry is stored with the version it
+    was computed for and an expiry time, and is ignored once the version
+    changes or it expires.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry_version, expires, value = entry
+            if entry_version != version or expires <= time.time():
+                del self.entries[key]
+                return None
+            # Move the key to the end, as the most recently used.
+            del self.entries[key]
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, version, value, timeout):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (version, time.time() + timeout, value)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def _stats_key(prefix, event):
+    return '%s:stats:%s:%s' % (KEY_PREFIX, prefix, event)
+
+
+def record(prefix, event):
+    """
+    Counts a cache 'hit' or 'miss' for the given page prefix.
+    """
+    cache = get_cache()
+    key = _stats_key(prefix, event)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+    logger.debug('blogoland cache %s: %s', event, prefix)
+
+
+def get_stats(prefixes):
+    """
+    Returns a dict with the hit and miss counters of each page prefix.
+    """
+    cache = get_cache()
+    keys = dict(((prefix, event), _stats_key(prefix, event))
+                for prefix in prefixes for event in ('hit', 'miss'))
+    values = cache.get_many(keys.values())
+    stats = {}
+    for (prefix, event), key in keys.items():
+        stats.setdefault(prefix, {})[event] = values.get(key, 0)
+    return stats
+
+
+def reset_stats(prefixes):
+    get_cache().delete_many([_stats_key(prefix, event)
+                             for prefix in prefixes for event in ('hit', 'miss')])
@@ -7,4 +7,47 @@ A COLLECTION OF BLOGOLAND DEFAULT SETTINGS.
 
 DEFAULT_DATE_FORMAT = '%d-%m-%Y'
 
-DEFAULT_PAGINATION = 15
\ No newline at end of file
+DEFAULT_PAGINATION = 15
+DEFAULT_PAGINATION_MODE = 'page'
+
+DEFAULT_EXCERPT_WORDS = 10
+
+DEFAULT_CACHE_ENABLED = False
+DEFAULT_CACHE_ALIAS = 'default'
+DEFAULT_CACHE_TIMEOUT = 60 * 5
+
+DEFAULT_SEARCH_CONFIG = 'simple'
+
+DEFAULT_FEED_ITEMS = 50
+
+DEFAULT_SITEMAP_CHUNK_SIZE = 10000
+
+DEFAULT_IMAGE_WIDTHS = {
+    'thumbnail': [320, 640],
+    'detail': [768, 1280, 1920],
+    'gallery': [480, 960, 1440],
+    'default': [640, 1280],
+}
+DEFAULT_IMAGE_SIZES = {
+    'thumbnail': '(max-width: 640px) 100vw, 320px',
+    'detail': '100vw',
+    'gallery': '(max-width: 960px) 100vw, 480px',
+    'default': '100vw',
+}
+DEFAULT_IMAGE_WORKERS = 2
+
+DEFAULT_INSTRUMENTATION = False
+
+DEFAULT_WIDGET_CACHE_SIZE = 128
+DEFAULT_WIDGET_CACHE_TIMEOUT = 60 * 5
+
+DEFAULT_RELATED_POSTS = 10
+
+DEFAULT_API_MAX_LIMIT = 500
+
+DEFAULT_REPLICA_DB = None
+DEFAULT_REPLICA_STICKY_SECONDS = 15
+
+DEFAULT_VIEW_COUNTS = False
+DEFAULT_VIEW_FLUSH_INTERVAL = 60
+DEFAULT_POPULAR_POSTS = 10
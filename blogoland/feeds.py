@@ -0,0 +1,173 @@
+# -*- coding:utf8 -*-
+"""
+Streaming RSS and Atom feeds of public posts.
+
+The feeds are written item by item from a QuerySet iterator. The XML of
+each item is cached under the post modification date, so an item is only
+rendered again after its post changes.
+"""
+import hashlib
+from xml.sax.saxutils import escape, quoteattr
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.contrib.sites.shortcuts import get_current_site
+from django.http import Http404, StreamingHttpResponse
+from django.utils.encoding import force_bytes
+from django.utils.feedgenerator import rfc2822_date, rfc3339_date
+from django.views.generic import View
+
+from blogoland import cache
+from blogoland.confs import DEFAULT_FEED_ITEMS
+from blogoland.models import Post, Category
+from blogoland.views import ConditionalViewMixin, start_of_day
+
+
+FEED_ITEMS = getattr(settings, 'BLOGOLAND_FEED_ITEMS', DEFAULT_FEED_ITEMS)
+
+CHUNK_SIZE = 100
+
+ITEM_FIELDS = ('pk', 'slug', 'title', 'seo_description', 'publication_date', 'modification_date')
+
+
+class PostFeedView(ConditionalViewMixin, View):
+    """
+    Streams the latest public posts as an RSS 2.0 or an Atom 1.0 feed.
+    """
+    feed_type = 'rss'
+    items = FEED_ITEMS
+
+    def get_queryset(self):
+        """
+        Returns QuerySet of Post
+        """
+        return Post.objects.get_public_posts()
+
+    def get_validators(self):
+        """
+        Returns the validators of the posts listed in the feed, read from
+        the ordering index instead of aggregating every public post.
+        """
+        rows = list(self.get_queryset().values_list('pk', 'modification_date')[:self.items])
+        return {
+            'modified': max(modified for pk, modified in rows) if rows else None,
+            'items': ','.join(str(pk) for pk, modified in rows),
+        }
+
+    def get_feed_title(self):
+        return get_current_site(self.request).name
+
+    def get_feed_link(self):
+        return self.request.build_absolute_uri(reverse('blogoland:post_list'))
+
+    def get(self, request, *args, **kwargs):
+        content_type = {
+            'rss': 'application/rss+xml; charset=utf-8',
+            'atom': 'application/atom+xml; charset=utf-8',
+        }[self.feed_type]
+        return StreamingHttpResponse(self.stream(), content_type=content_type)
+
+    def stream(self):
+        """
+        Yields the feed XML: the header, the items and the footer.
+        """
+        posts = self.get_queryset().only(*ITEM_FIELDS)[:self.items].iterator()
+        first = next(posts, None)
+        yield self.render_header(first)
+        chunk = [first] if first is not None else []
+        for post in posts:
+            chunk.append(post)
+            if len(chunk) == CHUNK_SIZE:
+                for item in self.render_items(chunk):
+                    yield item
+                chunk = []
+        for item in self.render_items(chunk):
+            yield item
+        yield '</channel></rss>' if self.feed_type == 'rss' else '</feed>'
+
+    def render_header(self, latest):
+        title = escape(self.get_feed_title())
+        link = self.get_feed_link()
+        updated = latest.modification_date if latest is not None else None
+        if self.feed_type == 'rss':
+            header = ('<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0"><channel>'
+                      '<title>%s</title><link>%s</link><description>%s</description>' % (title, escape(link), title))
+            if updated is not None:
+                header += '<lastBuildDate>%s</lastBuildDate>' % rfc2822_date(updated)
+            return header
+        header = ('<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">'
+                  '<title>%s</title><link href=%s rel="alternate"/><id>%s</id>' % (title, quoteattr(link), escape(link)))
+        if updated is not None:
+            header += '<updated>%s</updated>' % rfc3339_date(updated)
+        return header
+
+    def get_item_key(self, post):
+        host = hashlib.md5(force_bytes(self.request.build_absolute_uri('/'))).hexdigest()
+        return '%s:feed_item:%s:%s:%s:%s' % (
+            cache.KEY_PREFIX, self.feed_type, host, post.pk, post.modification_date.isoformat())
+
+    def render_items(self, posts):
+        """
+        Returns the XML of the given posts, reading the cached items with a
+        single cache request and rendering only the missing ones.
+        """
+        if not posts:
+            return []
+        keys = [self.get_item_key(post) for post in posts]
+        cached = cache.get_cache().get_many(keys)
+        missing = {}
+        items = []
+        for key, post in zip(keys, posts):
+            if key not in cached:
+                missing[key] = self.render_item(post)
+            items.append(cached.get(key) or missing[key])
+        if missing:
+            cache.get_cache().set_many(missing, cache.CACHE_TIMEOUT)
+        return items
+
+    def render_item(self, post):
+        link = self.request.build_absolute_uri(post.get_absolute_url())
+        published = start_of_day(post.publication_date)
+        if self.feed_type == 'rss':
+            return ('<item><title>%s</title><link>%s</link><guid isPermaLink="true">%s</guid>'
+                    '<pubDate>%s</pubDate><description>%s</description></item>' % (
+                        escape(post.title), escape(link), escape(link),
+                        rfc2822_date(published), escape(post.seo_description or '')))
+        return ('<entry><title>%s</title><link href=%s rel="alternate"/><id>%s</id>'
+                '<published>%s</published><updated>%s</updated><summary>%s</summary></entry>' % (
+                    escape(post.title), quoteattr(link), escape(link), rfc3339_date(published),
+                    rfc3339_date(post.modification_date), escape(post.seo_description or '')))
+
+
+class CategoryPostFeedView(PostFeedView):
+    """
+    Streams the latest public posts of a category.
+    """
+    def get_object(self):
+        """
+        Get the category by the given slug or raise 404
+        """
+        if not hasattr(self, 'category'):
+            category_slug = self.kwargs.get('category_slug', None)
+            try:
+                self.category = Category.objects.get(slug=category_slug)
+            except Category.DoesNotExist:
+                raise Http404()
+        return self.category
+
+    def get_queryset(self):
+        """
+        Return the Post QuerySet filtered by the category requested,
+        """
+        return Post.objects.get_public_posts().filter(category=self.get_object())
+
+    def get_validators(self):
+        validators = super(CategoryPostFeedView, self).get_validators()
+        validators['category_modified'] = self.get_object().modification_date
+        return validators
+
+    def get_feed_title(self):
+        return '%s - %s' % (get_current_site(self.request).name, self.get_object().title)
+
+    def get_feed_link(self):
+        return self.request.build_absolute_uri(self.get_object().get_absolute_url())
@@ -0,0 +1,208 @@
+# -*- coding:utf8 -*-
+"""
+Resized derivatives of post images.
+
+When a PostImage is saved its original upload is resized with Pillow to the
+widths configured for its type, in WebP and in a fallback format. The work
+runs on a bounded process pool; the workers only talk to the file storage
+and the metadata of the derivatives is written back to the database by the
+parent process, so no database connection is shared with the workers. The
+former derivatives are deleted once the new metadata is saved, and the
+derivatives of a deleted PostImage with it.
+"""
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import six
+from PIL import Image
+
+from blogoland.confs import DEFAULT_IMAGE_SIZES, DEFAULT_IMAGE_WIDTHS, DEFAULT_IMAGE_WORKERS
+from blogoland.models import PostImage
+
+
+IMAGE_WIDTHS = getattr(settings, 'BLOGOLAND_IMAGE_WIDTHS', DEFAULT_IMAGE_WIDTHS)
+IMAGE_SIZES = getattr(settings, 'BLOGOLAND_IMAGE_SIZES', DEFAULT_IMAGE_SIZES)
+IMAGE_WORKERS = getattr(settings, 'BLOGOLAND_IMAGE_WORKERS', DEFAULT_IMAGE_WORKERS)
+
+logger = logging.getLogger('blogoland.images')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_derivative_name(name, width, extension):
+    """
+    Returns the storage path of a derivative, next to the original image:
+    /blogoland/model_name/POST_PK/derivatives/slugified-path-WIDTH.ext
+    """
+    directory, filename = os.path.split(name)
+    return '{0}/derivatives/{1}-{2}.{3}'.format(directory, os.path.splitext(filename)[0], width, extension)
+
+
+def generate_derivatives(name, img_type, storage=None):
+    """
+    Resizes the image stored under the given name to the widths of its type
+    and returns the metadata of the original and its derivatives. It only
+    uses the file storage, so it can run in a worker process.
+    """
+    storage = storage or default_storage
+    with storage.open(name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    width, height = original.size
+    has_alpha = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+    fallback_format, fallback_extension = ('PNG', 'png') if has_alpha else ('JPEG', 'jpg')
+    if not has_alpha:
+        original = original.convert('RGB')
+
+    type_widths = IMAGE_WIDTHS.get(img_type) or IMAGE_WIDTHS.get('default', [])
+    widths = sorted(set(min(w, width) for w in type_widths))
+    derivatives = []
+    for derivative_width in widths:
+        derivative_height = int(round(height * float(derivative_width) / width))
+        resized = original.resize((derivative_width, derivative_height), Image.LANCZOS)
+        for image_format, extension in (('WEBP', 'webp'), (fallback_format, fallback_extension)):
+            buffer = io.BytesIO()
+            try:
+                resized.save(buffer, image_format, quality=85)
+            except (IOError, KeyError, OSError):
+                # Pillow built without WebP support.
+                continue
+            derivative_name = storage.save(
+                get_derivative_name(name, derivative_width, extension), ContentFile(buffer.getvalue()))
+            derivatives.append({
+                'name': derivative_name,
+                'width': derivative_width,
+                'height': derivative_height,
+                'format': image_format.lower(),
+            })
+    return {'source': name, 'width': width, 'height': height, 'derivatives': derivatives}
+
+
+def generate_in_worker(args):
+    """
+    Runs a job returned by get_job, returning the image pk, its metadata, or
+    None if it failed, and the names of its former derivatives.
+    """
+    pk, name, img_type, old_names = args
+    try:
+        return pk, generate_derivatives(name, img_type), old_names
+    except Exception:
+        logger.exception('Could not generate the derivatives of %s', name)
+        return pk, None, old_names
+
+
+def delete_derivatives(names, storage=None):
+    """
+    Deletes the given derivative files, logging the ones that can't be.
+    """
+    storage = storage or default_storage
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception:
+            logger.exception('Could not delete the derivative %s', name)
+
+
+def save_metadata(pk, metadata, old_names=(), storage=None):
+    """
+    Stores the derivatives metadata of the given PostImage and deletes its
+    former derivatives. Its save signals invalidate the cached pages showing
+    the image. The new derivatives are deleted instead when the image has
+    changed or is gone meanwhile.
+    """
+    if metadata is None:
+        return
+    new_names = [derivative['name'] for derivative in metadata['derivatives']]
+    post_image = PostImage.objects.filter(pk=pk).first()
+    if post_image is not None and post_image.image.name == metadata['source']:
+        post_image.derivatives = json.dumps(metadata)
+        post_image.save(update_fields=['derivatives'])
+        delete_derivatives(set(old_names) - set(new_names), storage)
+    else:
+        delete_derivatives(set(new_names) - set(old_names), storage)
+
+
+def _save_from_worker(result):
+    # Runs in the result handler thread of the pool, which owns its own
+    # database connection. An exception raised here would kill that thread.
+    try:
+        save_metadata(*result)
+    except Exception:
+        logger.exception('Could not save the derivatives of PostImage %s', result[0])
+    finally:
+        connection.close()
+
+
+def _log_worker_error(error):
+    # The worker function catches its own errors, so these come from the
+    # pool itself, e.g. a job that can't be pickled.
+    logger.error('Could not generate image derivatives: %r', error)
+
+
+def get_pool(processes=None):
+    """
+    Returns the process pool shared by the image saves.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.Pool(processes=processes or IMAGE_WORKERS, maxtasksperchild=100)
+    return _pool
+
+
+def get_derivative_names(post_image):
+    return [derivative['name'] for derivative in post_image.get_derivatives().get('derivatives', [])]
+
+
+def get_job(post_image):
+    """
+    Returns the arguments to generate the derivatives of a PostImage.
+    """
+    return (post_image.pk, post_image.image.name, post_image.img_type, get_derivative_names(post_image))
+
+
+def needs_derivatives(post_image):
+    """
+    Checks if the derivatives of the given PostImage are missing or were
+    generated from another file.
+    """
+    return bool(post_image.image) and post_image.get_derivatives().get('source') != post_image.image.name
+
+
+def schedule(post_image):
+    """
+    Generates the derivatives of the given PostImage once the current
+    transaction commits: on the process pool, or right away when
+    BLOGOLAND_IMAGE_WORKERS is 0.
+    """
+    job = get_job(post_image)
+
+    def run():
+        if IMAGE_WORKERS:
+            kwargs = {'callback': _save_from_worker}
+            if six.PY3:
+                kwargs['error_callback'] = _log_worker_error
+            get_pool().apply_async(generate_in_worker, (job,), **kwargs)
+        else:
+            save_metadata(*generate_in_worker(job))
+
+    transaction.on_commit(run)
+
+
+def schedule_deletion(post_image):
+    """
+    Deletes the derivatives of the given deleted PostImage once the current
+    transaction commits.
+    """
+    names = get_derivative_names(post_image)
+    if names:
+        transaction.on_commit(lambda: delete_derivatives(names))
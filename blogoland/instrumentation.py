@@ -0,0 +1,169 @@
+# -*- coding:utf8 -*-
+"""
+Optional timing of the blogoland hot paths.
+
+When BLOGOLAND_INSTRUMENTATION is on, the blogoland views time and count
+the queries of each phase (get_queryset, get_object, get_context_data and
+render) and of each template tag. The results are sent as a Server-Timing
+response header, logged on the 'blogoland.instrumentation' logger and sent
+with the request_timed signal. When it is off nothing is wrapped, so there
+is no overhead.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal
+
+from blogoland.confs import DEFAULT_INSTRUMENTATION
+
+
+ENABLED = getattr(settings, 'BLOGOLAND_INSTRUMENTATION', DEFAULT_INSTRUMENTATION)
+
+VIEW_PHASES = ('get_queryset', 'get_object', 'get_context_data')
+
+logger = logging.getLogger('blogoland.instrumentation')
+
+# Sent once per instrumented request with the list of timings.
+request_timed = Signal(providing_args=['request', 'view', 'timings'])
+
+_state = threading.local()
+
+
+def query_count():
+    return sum(len(conn.queries_log) for conn in connections.all())
+
+
+class Recorder(object):
+    """
+    Accumulates the duration and the queries of each timed block of a
+    request, by name.
+    """
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    def add(self, name, duration, queries):
+        timing = self.timings.setdefault(name, {'name': name, 'duration_ms': 0.0, 'queries': 0, 'count': 0})
+        timing['duration_ms'] += duration * 1000
+        timing['queries'] += queries
+        timing['count'] += 1
+
+    def as_list(self):
+        return list(self.timings.values())
+
+    def server_timing(self):
+        """
+        Returns the value of the Server-Timing header.
+        """
+        return ', '.join(
+            '%s;dur=%.2f;desc="%s queries, %s calls"' % (
+                timing['name'], timing['duration_ms'], timing['queries'], timing['count'])
+            for timing in self.timings.values()
+        )
+
+
+@contextmanager
+def _noop():
+    yield
+
+
+@contextmanager
+def _timer(name, recorder):
+    queries = query_count()
+    start = time.time()
+    try:
+        yield
+    finally:
+        recorder.add(name, time.time() - start, query_count() - queries)
+
+
+def timer(name):
+    """
+    Context manager that times the block under the given name, if the
+    current request is being recorded.
+    """
+    recorder = getattr(_state, 'recorder', None)
+    if recorder is None:
+        return _noop()
+    return _timer(name, recorder)
+
+
+def timed(name, func):
+    """
+    Returns the function wrapped to be timed under the given name.
+    """
+    def wrapper(*args, **kwargs):
+        with timer(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def recording():
+    """
+    Records the timed blocks of the enclosed code. The debug cursor is
+    forced meanwhile, so the queries can be counted.
+    """
+    recorder = Recorder()
+    debug_cursors = [(conn, conn.force_debug_cursor) for conn in connections.all()]
+    for conn, _ in debug_cursors:
+        conn.force_debug_cursor = True
+    _state.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _state.recorder = None
+        for conn, force_debug_cursor in debug_cursors:
+            conn.force_debug_cursor = force_debug_cursor
+
+
+def instrument_library(library):
+    """
+    Times every tag of the given template Library when instrumentation is
+    enabled.
+    """
+    if not ENABLED:
+        return
+    for name, compile_function in list(library.tags.items()):
+        library.tags[name] = _timed_compile_function('tag.%s' % name, compile_function)
+
+
+def _timed_compile_function(name, compile_function):
+    def compile_and_time(parser, token):
+        node = compile_function(parser, token)
+        node.render = timed(name, node.render)
+        return node
+    return compile_and_time
+
+
+class InstrumentedViewMixin(object):
+    """
+    Times the phases of the view and adds them to the response in a
+    Server-Timing header.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if not ENABLED:
+            return super(InstrumentedViewMixin, self).dispatch(request, *args, **kwargs)
+
+        for phase in VIEW_PHASES:
+            method = getattr(self, phase, None)
+            if method is not None:
+                setattr(self, phase, timed(phase, method))
+
+        with recording() as recorder:
+            with timer('view'):
+                response = super(InstrumentedViewMixin, self).dispatch(request, *args, **kwargs)
+                if hasattr(response, 'render') and not response.is_rendered:
+                    with timer('render'):
+                        response.render()
+
+        timings = recorder.as_list()
+        response['Server-Timing'] = recorder.server_timing()
+        logger.info('%s %s', self.__class__.__name__, request.path,
+                    extra={'view': self.__class__.__name__, 'path': request.path, 'timings': timings})
+        request_timed.send(sender=self.__class__, request=request, view=self, timings=timings)
+        return response
@@ -0,0 +1,24 @@
+# -*- coding:utf8 -*-
+from django.core.management.base import BaseCommand
+
+from blogoland import archive
+from blogoland.models import ArchiveMonth
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the archive index of the posts.
+    """
+    help = 'Rebuilds the post counts by month and category used by the archive views.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', action='store_true',
+                            help='Only recount the months whose public counts are outdated.')
+
+    def handle(self, *args, **options):
+        if options['stale']:
+            months = archive.recount_stale()
+            self.stdout.write(self.style.SUCCESS('Done. %s archive months recounted.' % months))
+            return
+        archive.rebuild()
+        self.stdout.write(self.style.SUCCESS('Done. %s archive rows built.' % ArchiveMonth.objects.count()))
@@ -0,0 +1,46 @@
+# -*- coding:utf8 -*-
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from blogoland.models import Post
+
+
+class Command(BaseCommand):
+    """
+    Fills the denormalized content fields of the existing posts.
+    """
+    help = 'Fills the plain text, excerpt, rendered content and terms of the posts in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--all', action='store_true', dest='all',
+            help='Recompute every post, not only the ones never filled.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Post.objects.order_by('pk').only('pk', 'title', 'content')
+        if not options['all']:
+            queryset = queryset.filter(Q(rendered_content__isnull=True) | Q(terms__isnull=True))
+
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                for post in batch:
+                    post.update_content_fields()
+                    Post.objects.filter(pk=post.pk).update(
+                        plain_content=post.plain_content,
+                        excerpt=post.excerpt,
+                        rendered_content=post.rendered_content,
+                        terms=post.terms,
+                    )
+            last_pk = batch[-1].pk
+            updated += len(batch)
+            self.stdout.write('%s posts updated.' % updated)
+        self.stdout.write(self.style.SUCCESS('Done. %s posts updated.' % updated))
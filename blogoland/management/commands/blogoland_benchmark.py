@@ -0,0 +1,74 @@
+# -*- coding:utf8 -*-
+import datetime
+import io
+import json
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from django.utils.encoding import force_text
+
+from blogoland import benchmark
+
+
+class Command(BaseCommand):
+    """
+    Seeds a throwaway test database and benchmarks the blogoland views,
+    paginators and template tags.
+    """
+    help = 'Measures latency and query counts of the blogoland views and tags on a seeded test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--images', type=int, default=3, help='Images per post.')
+        parser.add_argument('--iterations', type=int, default=10)
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='Print the changes against a previous JSON results file.')
+
+    def handle(self, *args, **options):
+        # The test database is created from the configured backend and
+        # destroyed afterwards; the real data is never touched.
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            with override_settings(**benchmark.BENCHMARK_SETTINGS):
+                benchmark.seed(options['posts'], options['categories'], options['images'])
+                results = benchmark.run(options['iterations'])
+        finally:
+            runner.teardown_databases(old_config)
+
+        report = {
+            'meta': {
+                'date': datetime.datetime.now().isoformat(),
+                'django': django.get_version(),
+                'vendor': connection.vendor,
+                'posts': options['posts'],
+                'categories': options['categories'],
+                'images_per_post': options['images'],
+                'iterations': options['iterations'],
+            },
+            'results': results,
+        }
+        previous = {}
+        if options['compare']:
+            with io.open(options['compare'], encoding='utf-8') as source:
+                previous = json.load(source).get('results', {})
+
+        for name in sorted(results):
+            result = results[name]
+            line = '%-32s queries=%-3s budget=%-4s median=%9.3fms mean=%9.3fms' % (
+                name, result['queries'], result['budget'], result['median_ms'], result['mean_ms'])
+            if name in previous:
+                line += '  (%+d queries, %+.3fms median)' % (
+                    result['queries'] - previous[name]['queries'],
+                    result['median_ms'] - previous[name]['median_ms'])
+            if not result['within_budget']:
+                line = self.style.ERROR(line + '  OVER BUDGET')
+            self.stdout.write(line)
+
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(force_text(json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)))
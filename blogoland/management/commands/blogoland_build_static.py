@@ -0,0 +1,30 @@
+# -*- coding:utf8 -*-
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+
+from blogoland import static_site
+
+
+class Command(BaseCommand):
+    """
+    Exports the post list, post detail and category pages as static files.
+    """
+    help = 'Renders the changed blogoland pages into a directory of static files on a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+        parser.add_argument('--scheme', default='https', choices=['http', 'https'])
+        parser.add_argument('--host', default=None, help='Host of the absolute URLs, the current Site by default.')
+        parser.add_argument(
+            '--full', action='store_true', dest='full',
+            help='Render every page, not only the ones whose inputs changed.',
+        )
+
+    def handle(self, *args, **options):
+        rendered, removed, failed = static_site.build(
+            options['output_dir'], workers=options['workers'], full=options['full'],
+            scheme=options['scheme'], host=options['host'], log=self.stdout.write)
+        style = self.style.ERROR if failed else self.style.SUCCESS
+        self.stdout.write(style('Done. %s pages rendered, %s removed, %s failed.' % (rendered, removed, failed)))
@@ -0,0 +1,28 @@
+# -*- coding:utf8 -*-
+from django.core.management.base import BaseCommand
+
+from blogoland import cache
+
+PAGE_PREFIXES = ('post_list', 'post_detail', 'category_post_list', 'post_archive')
+
+
+class Command(BaseCommand):
+    """
+    Reports the hit and miss counters of the blogoland page cache.
+    """
+    help = 'Shows the hit/miss counters of the blogoland page cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', dest='reset',
+                            help='Reset the counters after showing them.')
+
+    def handle(self, *args, **options):
+        stats = cache.get_stats(PAGE_PREFIXES)
+        for prefix in PAGE_PREFIXES:
+            hits, misses = stats[prefix]['hit'], stats[prefix]['miss']
+            total = hits + misses
+            ratio = 100.0 * hits / total if total else 0.0
+            self.stdout.write('%-20s hits=%-8s misses=%-8s hit ratio=%.1f%%' % (prefix, hits, misses, ratio))
+        if options['reset']:
+            cache.reset_stats(PAGE_PREFIXES)
+            self.stdout.write('Counters reset.')
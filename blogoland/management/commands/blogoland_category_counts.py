@@ -0,0 +1,31 @@
+# -*- coding:utf8 -*-
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blogoland.models import Category
+
+
+class Command(BaseCommand):
+    """
+    Recounts the posts stored on every category.
+    """
+    help = 'Recounts the total and public posts of every category.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Category.objects.order_by('pk').values_list('pk', flat=True)
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                Category.objects.filter(pk__in=batch).update_post_counts()
+            last_pk = batch[-1]
+            updated += len(batch)
+            self.stdout.write('%s categories counted.' % updated)
+        self.stdout.write(self.style.SUCCESS('Done. %s categories counted.' % updated))
@@ -0,0 +1,54 @@
+# -*- coding:utf8 -*-
+import io
+import json
+
+from django.core.management.base import BaseCommand
+
+from blogoland.models import Post, Category
+
+CATEGORY_FIELDS = ('slug', 'title', 'seo_title', 'seo_description', 'seo_keywords')
+POST_FIELDS = ('slug', 'title', 'content', 'seo_title', 'seo_description', 'seo_keywords', 'is_visible')
+
+
+class Command(BaseCommand):
+    """
+    Exports categories and posts as JSON lines, one object per line.
+    """
+    help = 'Exports blogoland categories and posts to a JSONL file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, '-' for stdout.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            self.write_lines(self.stdout, options['batch_size'])
+        else:
+            with io.open(options['path'], 'w', encoding='utf-8') as output:
+                self.write_lines(output, options['batch_size'])
+
+    def write_lines(self, output, batch_size):
+        for category in Category.objects.order_by('pk').iterator():
+            line = dict((field, getattr(category, field)) for field in CATEGORY_FIELDS)
+            line['model'] = 'category'
+            output.write(u'%s\n' % json.dumps(line, ensure_ascii=False))
+
+        # Posts are read in pk batches, so their categories and images are
+        # prefetched with two queries per batch and memory stays bounded.
+        last_pk = 0
+        while True:
+            batch = list(Post.objects.filter(pk__gt=last_pk).order_by('pk')
+                         .prefetch_related('category', 'image_set')[:batch_size])
+            if not batch:
+                break
+            for post in batch:
+                line = dict((field, getattr(post, field)) for field in POST_FIELDS)
+                line['model'] = 'post'
+                line['publication_date'] = post.publication_date.isoformat()
+                line['categories'] = [category.slug for category in post.category.all()]
+                line['images'] = [
+                    {'title': img.title, 'img_type': img.img_type, 'image': img.image.name}
+                    for img in post.image_set.all()
+                ]
+                output.write(u'%s\n' % json.dumps(line, ensure_ascii=False))
+            last_pk = batch[-1].pk
@@ -0,0 +1,48 @@
+# -*- coding:utf8 -*-
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from blogoland import images
+from blogoland.models import PostImage
+
+
+class Command(BaseCommand):
+    """
+    Generates the resized derivatives of the existing post images.
+    """
+    help = 'Generates the derivatives of the post images on a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--all', action='store_true', dest='all',
+            help='Regenerate every image, not only the ones without derivatives.',
+        )
+
+    def handle(self, *args, **options):
+        # The workers only use the file storage, but they must not inherit
+        # an open database connection.
+        connections.close_all()
+        pool = multiprocessing.Pool(processes=options['workers'])
+        queryset = PostImage.objects.order_by('pk')
+        last_pk = 0
+        done = 0
+        try:
+            while True:
+                batch = list(queryset.filter(pk__gt=last_pk)[:options['batch_size']])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                jobs = [images.get_job(img) for img in batch
+                        if options['all'] or images.needs_derivatives(img)]
+                for result in pool.imap_unordered(images.generate_in_worker, jobs):
+                    images.save_metadata(*result)
+                    done += 1
+                self.stdout.write('%s images processed.' % done)
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write(self.style.SUCCESS('Done. %s images processed.' % done))
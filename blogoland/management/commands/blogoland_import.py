@@ -0,0 +1,171 @@
+# -*- coding:utf8 -*-
+import io
+import json
+import sys
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from blogoland import archive, cache, related, search
+from blogoland.models import RESERVED_POST_SLUGS, Post, PostImage, Category
+from blogoland.signals import forget_next_publication
+
+CATEGORY_FIELDS = ('title', 'seo_title', 'seo_description', 'seo_keywords')
+POST_FIELDS = ('title', 'content', 'seo_title', 'seo_description', 'seo_keywords', 'publication_date',
+               'is_visible', 'plain_content', 'excerpt', 'rendered_content', 'search_document', 'terms')
+
+
+class Command(BaseCommand):
+    """
+    Imports categories and posts from JSON lines, as written by
+    blogoland_export. Rows are inserted with bulk_create and existing slugs
+    are updated.
+    """
+    help = 'Imports blogoland categories and posts from a JSONL file, upserting by slug.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Input file, '-' for stdin.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.created = self.updated = 0
+        if options['path'] == '-':
+            self.read_lines(sys.stdin)
+        else:
+            with io.open(options['path'], encoding='utf-8') as source:
+                self.read_lines(source)
+
+        # Signals are not sent by bulk writes, so the caches and the post
+        # counts are reset here.
+        Category.objects.update_post_counts()
+        archive.rebuild()
+        related.rebuild()
+        cache.bump_versions([cache.LIST_VERSION])
+        forget_next_publication()
+        self.stdout.write(self.style.SUCCESS(
+            'Done. %s created, %s updated.' % (self.created, self.updated)))
+
+    def read_lines(self, source):
+        categories, posts = [], []
+        for number, line in enumerate(source, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                raise CommandError('Invalid JSON on line %s.' % number)
+            if data.get('model') != 'category' and data.get('slug') in RESERVED_POST_SLUGS:
+                raise CommandError('Reserved post slug "%s" on line %s.' % (data['slug'], number))
+            if data.get('model') == 'category':
+                categories.append(data)
+            else:
+                # Posts may reference the categories read so far.
+                if categories:
+                    self.import_categories(categories)
+                    categories = []
+                posts.append(data)
+            if len(categories) >= self.batch_size:
+                self.import_categories(categories)
+                categories = []
+            if len(posts) >= self.batch_size:
+                self.import_posts(posts)
+                posts = []
+        if categories:
+            self.import_categories(categories)
+        if posts:
+            self.import_posts(posts)
+
+    def dedupe(self, rows):
+        """
+        Returns the rows with one row per slug, the last one read, as bulk
+        inserts of a repeated slug would fail.
+        """
+        return list(OrderedDict((row['slug'], row) for row in rows).values())
+
+    @transaction.atomic
+    def import_categories(self, rows):
+        rows = self.dedupe(rows)
+        existing = dict(Category.objects.filter(slug__in=[row['slug'] for row in rows]).values_list('slug', 'pk'))
+        new = []
+        for row in rows:
+            values = dict((field, row.get(field)) for field in CATEGORY_FIELDS)
+            if row['slug'] in existing:
+                Category.objects.filter(pk=existing[row['slug']]).update(**values)
+                self.updated += 1
+            else:
+                new.append(Category(slug=row['slug'], **values))
+        Category.objects.bulk_create(new, batch_size=self.batch_size)
+        self.created += len(new)
+        cache.bump_versions([cache.category_version(slug) for slug in existing])
+
+    @transaction.atomic
+    def import_posts(self, rows):
+        rows = self.dedupe(rows)
+        slugs = [row['slug'] for row in rows]
+        existing = dict(Post.objects.filter(slug__in=slugs).values_list('slug', 'pk'))
+        category_slugs = set(slug for row in rows for slug in row.get('categories', []))
+        categories, category_titles = {}, {}
+        for slug, pk, title in Category.objects.filter(slug__in=category_slugs).values_list('slug', 'pk', 'title'):
+            categories[slug], category_titles[slug] = pk, title
+
+        new = []
+        documents = {}
+        for row in rows:
+            post = Post(
+                slug=row['slug'],
+                title=row['title'],
+                content=row.get('content'),
+                seo_title=row.get('seo_title'),
+                seo_description=row.get('seo_description'),
+                seo_keywords=row.get('seo_keywords'),
+                is_visible=row.get('is_visible', True),
+            )
+            if row.get('publication_date'):
+                post.publication_date = parse_date(row['publication_date'])
+            # Same defaults as Post.save, applied in memory.
+            post.fill_defaults()
+            post.search_document = search.build_document(
+                post.title, post.plain_content,
+                [category_titles[slug] for slug in row.get('categories', []) if slug in category_titles])
+            documents[post.slug] = post.search_document
+            if post.slug in existing:
+                values = dict((field, getattr(post, field)) for field in POST_FIELDS)
+                values['modification_date'] = timezone.now()
+                Post.objects.filter(pk=existing[post.slug]).update(**values)
+                self.updated += 1
+            else:
+                new.append(post)
+        Post.objects.bulk_create(new, batch_size=self.batch_size)
+        self.created += len(new)
+
+        # bulk_create only returns the primary keys on some databases.
+        pks = dict(Post.objects.filter(slug__in=slugs).values_list('slug', 'pk'))
+        updated_pks = [pks[slug] for slug in existing]
+        Through = Post.category.through
+        Through.objects.filter(post_id__in=updated_pks).delete()
+        # Raw delete: the PostImage delete signals would run per image, and
+        # the caches are reset once below.
+        old_images = PostImage.objects.filter(post_id__in=updated_pks)
+        old_images._raw_delete(old_images.db)
+
+        through_rows, images = [], []
+        for row in rows:
+            post_pk = pks[row['slug']]
+            for slug in set(row.get('categories', [])):
+                if slug in categories:
+                    through_rows.append(Through(post_id=post_pk, category_id=categories[slug]))
+            for image in row.get('images', []):
+                images.append(PostImage(post_id=post_pk, title=image['title'],
+                                        img_type=image.get('img_type'), image=image['image']))
+        Through.objects.bulk_create(through_rows, batch_size=self.batch_size)
+        PostImage.objects.bulk_create(images, batch_size=self.batch_size)
+
+        search.index_documents([(pks[slug], document) for slug, document in documents.items()])
+        cache.bump_versions([cache.post_version(slug) for slug in existing] +
+                            [cache.category_version(slug) for slug in category_slugs])
+        self.stdout.write('%s rows imported.' % (self.created + self.updated))
@@ -0,0 +1,16 @@
+# -*- coding:utf8 -*-
+from django.core.management.base import BaseCommand
+
+from blogoland import popular
+from blogoland.models import PopularPost
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the popular posts lists.
+    """
+    help = 'Recomputes the most viewed posts, overall and by category, from the stored view counts.'
+
+    def handle(self, *args, **options):
+        popular.rebuild()
+        self.stdout.write(self.style.SUCCESS('Done. %s popular posts stored.' % PopularPost.objects.count()))
@@ -0,0 +1,19 @@
+# -*- coding:utf8 -*-
+from django.core.management.base import BaseCommand
+
+from blogoland import related
+from blogoland.models import RelatedPost
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the related posts of every post.
+    """
+    help = 'Recomputes the most similar posts of every post.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        related.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Done. %s related posts stored.' % RelatedPost.objects.count()))
@@ -0,0 +1,32 @@
+# -*- coding:utf8 -*-
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blogoland import search
+from blogoland.models import Post
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the full-text search index of the posts.
+    """
+    help = 'Rebuilds the search document of every post in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Post.objects.order_by('pk').values_list('pk', flat=True)
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                search.update_index(batch)
+            last_pk = batch[-1]
+            updated += len(batch)
+            self.stdout.write('%s posts indexed.' % updated)
+        self.stdout.write(self.style.SUCCESS('Done. %s posts indexed.' % updated))
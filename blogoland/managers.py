@@ -1,19 +1,153 @@
-
 import datetime
 
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from blogoland import cache
+
+# Image types resolved by the image template tags. They are fetched together
+# in a single query when the posts are loaded with ``prefetch_last_images``.
+PREFETCHED_IMG_TYPES = ('thumbnail', 'detail')
+PREFETCHED_IMAGES_ATTR = '_prefetched_last_images'
+
+
+class PostQuerySet(models.QuerySet):
+    """
+    QuerySet for Post objects.
+    """
+    def prefetch_last_images(self):
+        """
+        Prefetches the images used by the image template tags for every post
+        of the QuerySet in one query.
+        """
+        image_model = self.model._meta.get_field('image_set').related_model
+        images = image_model.objects.filter(img_type__in=PREFETCHED_IMG_TYPES).order_by('pk')
+        return self.prefetch_related(
+            models.Prefetch('image_set', queryset=images, to_attr=PREFETCHED_IMAGES_ATTR)
+        )
 
 
 class PostManager(models.Manager):
     """
     Manager for Post objects.
     """
+    def get_queryset(self):
+        return PostQuerySet(self.model, using=self._db)
+
     def get_public_posts(self, *args, **kwargs):
         """
         Returns public posts.
         """
         return self.get_queryset(*args, **kwargs).filter(is_visible=True, publication_date__lte=datetime.date.today())
 
+    def get_next_publication_change(self):
+        """
+        Returns the datetime when the public posts change next, that is the
+        start of the earliest future publication date among visible posts,
+        or None if there isn't any. The result is memoized in the blogoland
+        cache until a post is saved or deleted.
+        """
+        today = datetime.date.today()
+        key = cache.next_publication_key(today)
+        memo = cache.get_cache().get(key)
+        if memo is None:
+            publication_date = self.get_queryset().filter(
+                is_visible=True, publication_date__gt=today,
+            ).order_by('publication_date').values_list('publication_date', flat=True).first()
+            memo = (publication_date,)
+            cache.get_cache().set(key, memo, 60 * 60 * 24)
+        if memo[0] is None:
+            return None
+        return datetime.datetime.combine(memo[0], datetime.time.min)
+
+
+class CategoryQuerySet(models.QuerySet):
+    """
+    QuerySet for Category objects.
+    """
+    def count_posts(self):
+        """
+        Counts the total and public posts of every category of the QuerySet
+        in one aggregate query, without storing them. Returns a dict with a
+        (total, public) tuple by category pk.
+        """
+        pks = list(self.values_list('pk', flat=True))
+        if not pks:
+            return {}
+        today = datetime.date.today()
+        through = self.model.post_set.through
+        counts = dict((pk, (0, 0)) for pk in pks)
+        rows = through.objects.filter(category__in=pks).values('category').annotate(
+            total=models.Count('post'),
+            public=models.Count(models.Case(models.When(
+                post__is_visible=True, post__publication_date__lte=today, then=1))),
+        ).order_by()
+        for row in rows:
+            counts[row['category']] = (row['total'], row['public'])
+        return counts
+
+    def update_post_counts(self):
+        """
+        Recounts the total and public posts of every category of the
+        QuerySet and stores them with a single UPDATE, marking their posts
+        as modified. Returns the number of categories updated.
+        """
+        today = datetime.date.today()
+        through = self.model.post_set.through
+        posts = through.objects.filter(category=models.OuterRef('pk')).order_by().values('category')
+
+        def count(queryset):
+            counts = queryset.annotate(count=models.Count('post')).values('count')
+            return Coalesce(models.Subquery(counts, output_field=models.IntegerField()), 0)
+
+        return self.update(
+            post_count=count(posts),
+            public_post_count=count(posts.filter(post__is_visible=True, post__publication_date__lte=today)),
+            post_count_date=today,
+            posts_modification_date=timezone.now(),
+        )
+
+    def refresh_post_counts(self):
+        """
+        Stores the counts of the categories of the QuerySet not counted
+        today. The stale categories are looked up first, so reads of the
+        counts of the day never write. Returns the number of categories
+        updated.
+        """
+        stale = list(self.exclude(post_count_date=datetime.date.today()).values_list('pk', flat=True))
+        if not stale:
+            return 0
+        # Conditional, in case a concurrent read stored them meanwhile.
+        return self.model.objects.filter(pk__in=stale).exclude(
+            post_count_date=datetime.date.today()).update_post_counts()
+
+
+class CategoryManager(models.Manager):
+    """
+    Manager for Category objects.
+    """
+    def get_queryset(self):
+        return CategoryQuerySet(self.model, using=self._db)
+
+    def count_posts(self):
+        """
+        Counts the posts of every category, without storing them.
+        """
+        return self.get_queryset().count_posts()
+
+    def update_post_counts(self):
+        """
+        Recounts and stores the posts of every category.
+        """
+        return self.get_queryset().update_post_counts()
+
+    def refresh_post_counts(self):
+        """
+        Stores the counts of the categories not counted today.
+        """
+        return self.get_queryset().refresh_post_counts()
+
 
 class PostImageManager(models.Manager):
     """
@@ -21,6 +155,13 @@ class PostImageManager(models.Manager):
     """
     def get_last_img_type(self, img_type):
         """
-        Returns the last image added fitered by type.
+        Returns the last image added fitered by type. When used through a post
+        loaded with ``prefetch_last_images`` the prefetched images are used
+        instead of querying the database.
         """
-        return self.get_queryset().filter(img_type=img_type).last()
\ No newline at end of file
+        post = getattr(self, 'instance', None)
+        images = getattr(post, PREFETCHED_IMAGES_ATTR, None)
+        if images is not None and img_type in PREFETCHED_IMG_TYPES:
+            images = [img for img in images if img.img_type == img_type]
+            return images[-1] if images else None
+        return self.get_queryset().filter(img_type=img_type).last()
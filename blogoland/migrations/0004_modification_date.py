@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogoland', '0003_post_content_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='modification_date',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Modification Date'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='modification_date',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Modification Date'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+from blogoland.confs import DEFAULT_SEARCH_CONFIG
+
+SEARCH_CONFIG = getattr(settings, 'BLOGOLAND_SEARCH_CONFIG', DEFAULT_SEARCH_CONFIG)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX blogoland_post_search_idx ON blogoland_post "
+            "USING GIN (to_tsvector('%s'::regconfig, search_document))" % SEARCH_CONFIG
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute('CREATE VIRTUAL TABLE blogoland_post_fts USING fts5(document)')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS blogoland_post_search_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS blogoland_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogoland', '0004_modification_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_document',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name='Search Document'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
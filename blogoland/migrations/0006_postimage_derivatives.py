@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogoland', '0005_post_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postimage',
+            name='derivatives',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name='Derivatives'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogoland', '0006_postimage_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Posts'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='public_post_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Public Posts'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='post_count_date',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Post Count Date'),
+        ),
+    ]
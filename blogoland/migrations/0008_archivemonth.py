@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogoland', '0007_category_post_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField(verbose_name='Year')),
+                ('month', models.PositiveSmallIntegerField(verbose_name='Month')),
+                ('post_count', models.PositiveIntegerField(default=0, verbose_name='Posts')),
+                ('public_post_count', models.PositiveIntegerField(default=0, verbose_name='Public Posts')),
+                ('count_date', models.DateField(verbose_name='Count Date')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archive_months', to='blogoland.Category')),
+            ],
+            options={
+                'ordering': ['-year', '-month'],
+                'verbose_name': 'Archive Month',
+                'verbose_name_plural': 'Archive Months',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivemonth',
+            index=models.Index(fields=['category', '-year', '-month'], name='blogoland_archive_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogoland', '0010_post_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='view_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='View Count'),
+        ),
+        migrations.CreateModel(
+            name='PopularPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view_count', models.PositiveIntegerField(default=0, verbose_name='View Count')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='popular_posts', to='blogoland.Category')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='popular_set', to='blogoland.Post')),
+            ],
+            options={
+                'verbose_name': 'Popular Post',
+                'verbose_name_plural': 'Popular Posts',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='popularpost',
+            index=models.Index(fields=['category', '-view_count'], name='blogoland_popular_idx'),
+        ),
+    ]
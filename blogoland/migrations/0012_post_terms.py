@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogoland', '0011_popular_posts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, verbose_name='Term')),
+                ('count', models.PositiveIntegerField(verbose_name='Count')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='term_set', to='blogoland.Post')),
+            ],
+            options={
+                'verbose_name': 'Post Term',
+                'verbose_name_plural': 'Post Terms',
+            },
+        ),
+        migrations.CreateModel(
+            name='TermFrequency',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(blank=True, max_length=100, unique=True, verbose_name='Term')),
+                ('post_count', models.IntegerField(default=0, verbose_name='Post Count')),
+            ],
+            options={
+                'verbose_name': 'Term Frequency',
+                'verbose_name_plural': 'Term Frequencies',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='postterm',
+            index=models.Index(fields=['term'], name='blogoland_postterm_term_idx'),
+        ),
+    ]
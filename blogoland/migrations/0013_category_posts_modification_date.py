@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogoland', '0012_post_terms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='posts_modification_date',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Posts Modification Date'),
+        ),
+    ]
@@ -1,18 +1,33 @@
 from __future__ import unicode_literals
 
 import datetime
+import json
+import re
+from collections import Counter
 
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.core.urlresolvers import reverse
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
-from django.utils.html import strip_tags
-from django.utils.text import slugify
+from django.utils.html import format_html, strip_tags
+from django.utils.text import slugify, Truncator
 
-from blogoland.managers import PostManager, PostImageManager
+from blogoland.confs import DEFAULT_EXCERPT_WORDS
+from blogoland.managers import CategoryManager, PostManager, PostImageManager
 
 TODAY = datetime.date.today
 
+EXCERPT_WORDS = getattr(settings, 'BLOGOLAND_EXCERPT_WORDS', DEFAULT_EXCERPT_WORDS)
+
+# Taken by the one-segment blogoland URLs, which are matched before posts.
+RESERVED_POST_SLUGS = ('search',)
+
+TERM_RE = re.compile(r'\w{3,}', re.UNICODE)
+MAX_TERMS = 64
+
+
 def get_slugified_file_name(filename):
     """
     Takes a filename string and slugify the file name and append its extension.
@@ -24,6 +39,30 @@ def get_slugified_file_name(filename):
     del splitted_file_name
     return slugified_file_name
 
+
+def render_content(content):
+    """
+    Parse the given post content to HTML. Returns an empty string if the
+    content can't be parsed.
+    """
+    try:
+        return format_html(content)
+    except (IndexError, KeyError, ValueError):
+        # Stray braces are read as replacement fields.
+        return ''
+
+
+def count_terms(title, text):
+    """
+    Returns a dict with the most frequent terms of a post and their counts.
+    Title terms count twice.
+    """
+    counts = Counter(TERM_RE.findall((text or '').lower()))
+    for term in TERM_RE.findall((title or '').lower()):
+        counts[term] += 2
+    return dict(counts.most_common(MAX_TERMS))
+
+
 def get_image_path(instance, filename):
     """
     Builds a dynamic path for app images. This method takes an
@@ -67,6 +106,18 @@ class Category(BaseModelInterface, SEOInterface):
     Category model class.
     """
 
+    modification_date = models.DateTimeField('Modification Date', auto_now=True)
+
+    # Denormalized post counts, kept by the signal handlers. The public count
+    # is only valid on post_count_date, as scheduled posts become public.
+    post_count = models.PositiveIntegerField('Posts', default=0, editable=False)
+    public_post_count = models.PositiveIntegerField('Public Posts', default=0, editable=False)
+    post_count_date = models.DateField('Post Count Date', blank=True, null=True, editable=False)
+    # When the posts of the category last changed, set with the counts.
+    posts_modification_date = models.DateTimeField('Posts Modification Date', blank=True, null=True, editable=False)
+
+    objects = CategoryManager()
+
     class Meta:
         verbose_name = 'Categoty'
         verbose_name_plural = 'Categories'
@@ -74,8 +125,31 @@ class Category(BaseModelInterface, SEOInterface):
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # The counts loaded with this instance may be outdated, so they are
+        # counted again and stored with it.
+        self.post_count, self.public_post_count = (0, 0)
+        if self.pk is not None:
+            counts = Category.objects.filter(pk=self.pk).count_posts()
+            self.post_count, self.public_post_count = counts.get(self.pk, (0, 0))
+        self.post_count_date = TODAY()
+        return super(Category, self).save(*args, **kwargs)
+
+    def get_post_counts(self):
+        """
+        Returns the (total, public) post counts. The first read of a day
+        stores them again, as scheduled posts may have gone public since.
+        """
+        if self.post_count_date != TODAY():
+            categories = Category.objects.filter(pk=self.pk)
+            categories.refresh_post_counts()
+            (self.post_count, self.public_post_count, self.post_count_date,
+             self.posts_modification_date) = categories.values_list(
+                'post_count', 'public_post_count', 'post_count_date', 'posts_modification_date').get()
+        return self.post_count, self.public_post_count
+
     def get_absolute_url(self):
-        return reverse('blogoland:category_detail', kwargs={'category_slug': self.slug})
+        return reverse('blogoland:category_post_list', kwargs={'category_slug': self.slug})
 
 
 @python_2_unicode_compatible
@@ -87,26 +161,79 @@ class Post(BaseModelInterface, SEOInterface):
     category = models.ManyToManyField(Category, blank=True)
     
     creation_date = models.DateTimeField('Creation Date', auto_now_add=True)
+    modification_date = models.DateTimeField('Modification Date', auto_now=True)
     publication_date = models.DateField('Publication Date', default=TODAY)
     is_visible = models.BooleanField('Visible', default=True)
 
+    # Denormalized content, computed on save to keep the templates cheap.
+    plain_content = models.TextField('Plain Content', blank=True, null=True, editable=False)
+    excerpt = models.TextField('Excerpt', blank=True, null=True, editable=False)
+    rendered_content = models.TextField('Rendered Content', blank=True, null=True, editable=False)
+    # Text indexed for full-text search, see blogoland.search.
+    search_document = models.TextField('Search Document', blank=True, null=True, editable=False)
+    # JSON counts of the most frequent terms, see blogoland.related.
+    terms = models.TextField('Terms', blank=True, null=True, editable=False)
+    # Views of the detail page, added in batches, see blogoland.popular.
+    view_count = models.PositiveIntegerField('View Count', default=0, editable=False)
+
     objects = PostManager()
 
 
     class Meta:
         ordering = ['-publication_date', '-creation_date', 'slug']
+        indexes = [
+            # get_public_posts: equality on is_visible, range and ordering on the rest.
+            models.Index(fields=['is_visible', '-publication_date', '-creation_date', 'slug'], name='blogoland_post_public_idx'),
+            # Staff listings: plain ordering scan.
+            models.Index(fields=['-publication_date', '-creation_date', 'slug'], name='blogoland_post_ordering_idx'),
+            # Admin creation_date filter.
+            models.Index(fields=['-creation_date'], name='blogoland_post_created_idx'),
+        ]
         verbose_name = 'Post'
         verbose_name_plural = 'Posts'
 
     def __str__(self):
         return self.slug
 
+    def clean(self):
+        """
+        Rejects the slugs taken by the blogoland URLs.
+        """
+        if self.slug in RESERVED_POST_SLUGS:
+            raise ValidationError({'slug': 'The "%s" slug is reserved.' % self.slug})
+
     def save(self, *args, **kwargs):
+        self.fill_defaults()
+        return super(Post, self).save(*args, **kwargs)
+
+    def fill_defaults(self):
+        """
+        Fills the SEO defaults and the denormalized content fields. Called on
+        save, and by bulk imports that skip it.
+        """
         if not self.seo_title:
             self.seo_title = self.title
         if not self.seo_description:
             self.seo_description = strip_tags(self.content)[:160]
-        return super(Post, self).save(*args, **kwargs)
+        self.update_content_fields()
+
+    def update_content_fields(self):
+        """
+        Fills the plain text, excerpt, rendered HTML and terms fields from
+        the content of the post.
+        """
+        self.plain_content = strip_tags(self.content or '')
+        self.excerpt = Truncator(self.plain_content).words(EXCERPT_WORDS)
+        self.rendered_content = render_content(self.content or '')
+        self.terms = json.dumps(count_terms(self.title, self.plain_content), sort_keys=True)
+
+    def get_terms(self):
+        """
+        Returns the term counts as a dict.
+        """
+        if not self.terms:
+            return {}
+        return json.loads(self.terms)
 
     def get_absolute_url(self):
         return reverse('blogoland:post_detail', kwargs={'post_slug': self.slug})
@@ -136,12 +263,122 @@ class PostImage(models.Model):
     img_type =  models.CharField('Image Type', max_length=255, choices=IMG_TYPE_CHOICES, blank=True, null=True)
     image = models.ImageField(upload_to=get_image_path, max_length=255)
     post = models.ForeignKey(Post, related_name='image_set')
+    # JSON metadata of the original and its resized copies, see blogoland.images.
+    derivatives = models.TextField('Derivatives', blank=True, null=True, editable=False)
 
     objects = PostImageManager()
 
     class Meta:
+        indexes = [
+            # PostImageManager.get_last_img_type
+            models.Index(fields=['post', 'img_type', 'id'], name='blogoland_postimage_type_idx'),
+        ]
         verbose_name = 'Image'
         verbose_name_plural = 'Images'
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+    def get_derivatives(self):
+        """
+        Returns the derivatives metadata as a dict.
+        """
+        if not self.derivatives:
+            return {}
+        return json.loads(self.derivatives)
+
+
+class RelatedPost(models.Model):
+    """
+    One of the most similar posts of a post, with its similarity score. See
+    blogoland.related.
+    """
+    post = models.ForeignKey(Post, related_name='related_set', on_delete=models.CASCADE)
+    related = models.ForeignKey(Post, related_name='related_to_set', on_delete=models.CASCADE)
+    score = models.FloatField('Score')
+
+    class Meta:
+        indexes = [
+            # get_related_posts: equality on post, ordering on score.
+            models.Index(fields=['post', '-score'], name='blogoland_related_idx'),
+        ]
+        verbose_name = 'Related Post'
+        verbose_name_plural = 'Related Posts'
+
+
+class PostTerm(models.Model):
+    """
+    One of the most frequent terms of a post, with its count. The inverted
+    index of the terms, see blogoland.related.
+    """
+    post = models.ForeignKey(Post, related_name='term_set', on_delete=models.CASCADE)
+    term = models.CharField('Term', max_length=100)
+    count = models.PositiveIntegerField('Count')
+
+    class Meta:
+        indexes = [
+            # The posts holding a term.
+            models.Index(fields=['term'], name='blogoland_postterm_term_idx'),
+        ]
+        verbose_name = 'Post Term'
+        verbose_name_plural = 'Post Terms'
+
+
+class TermFrequency(models.Model):
+    """
+    Number of posts holding a term. The row with an empty term counts the
+    posts with terms. See blogoland.related.
+    """
+    term = models.CharField('Term', max_length=100, unique=True, blank=True)
+    post_count = models.IntegerField('Post Count', default=0)
+
+    class Meta:
+        verbose_name = 'Term Frequency'
+        verbose_name_plural = 'Term Frequencies'
+
+
+class PopularPost(models.Model):
+    """
+    One of the most viewed posts, overall (without category) or in a
+    category. Kept by blogoland.popular.
+    """
+    category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.CASCADE,
+                                 related_name='popular_posts')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='popular_set')
+    view_count = models.PositiveIntegerField('View Count', default=0)
+
+    class Meta:
+        indexes = [
+            # get_popular_posts: equality on category, ordering on view_count.
+            models.Index(fields=['category', '-view_count'], name='blogoland_popular_idx'),
+        ]
+        verbose_name = 'Popular Post'
+        verbose_name_plural = 'Popular Posts'
+
+
+@python_2_unicode_compatible
+class ArchiveMonth(models.Model):
+    """
+    Number of posts published in a month, overall (without category) or in
+    a category. Kept by the signal handlers, see blogoland.archive.
+    """
+    year = models.PositiveSmallIntegerField('Year')
+    month = models.PositiveSmallIntegerField('Month')
+    category = models.ForeignKey(Category, blank=True, null=True, related_name='archive_months',
+                                 on_delete=models.CASCADE)
+    post_count = models.PositiveIntegerField('Posts', default=0)
+    public_post_count = models.PositiveIntegerField('Public Posts', default=0)
+    # The public count is only valid on this date for the months that may
+    # hold scheduled posts.
+    count_date = models.DateField('Count Date')
+
+    class Meta:
+        ordering = ['-year', '-month']
+        indexes = [
+            models.Index(fields=['category', '-year', '-month'], name='blogoland_archive_idx'),
+        ]
+        verbose_name = 'Archive Month'
+        verbose_name_plural = 'Archive Months'
+
+    def __str__(self):
+        return '{0:04d}-{1:02d}'.format(self.year, self.month)
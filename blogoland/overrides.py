@@ -0,0 +1,131 @@
+# -*- coding:utf8 -*-
+"""
+Lookup of the per-slug template overrides.
+
+The detail and category views first try 'blogoland/post_<slug>.html' and
+'blogoland/category_<slug>_list.html', which almost never exist. Instead of
+a failed lookup through every loader on each request, the 'blogoland'
+folders of the template directories are listed once per process and the
+views only try the overrides found there. In DEBUG the folders are listed
+again whenever one of them changes.
+
+Loaders that don't read from directories (e.g. the locmem loader) can't be
+listed; with them every override is tried, as before.
+"""
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import engines
+
+
+OVERRIDE_RE = re.compile(r'^(post_.+|category_.+_list)\.html$')
+
+_lock = threading.Lock()
+_state = {}
+
+
+def get_loader_dirs(loaders):
+    """
+    Returns the directories of the given loaders, or None if one of them
+    doesn't read from directories.
+    """
+    dirs = []
+    for loader in loaders:
+        if hasattr(loader, 'loaders'):
+            # Cached loader.
+            loader_dirs = get_loader_dirs(loader.loaders)
+        elif hasattr(loader, 'get_dirs'):
+            loader_dirs = list(loader.get_dirs())
+        else:
+            loader_dirs = None
+        if loader_dirs is None:
+            return None
+        dirs.extend(loader_dirs)
+    return dirs
+
+
+def get_template_dirs():
+    """
+    Returns the 'blogoland' folders of every template directory, or None if
+    a template engine can't be listed.
+    """
+    dirs = []
+    for engine in engines.all():
+        loaders = getattr(getattr(engine, 'engine', None), 'template_loaders', None)
+        if loaders is None:
+            return None
+        loader_dirs = get_loader_dirs(loaders)
+        if loader_dirs is None:
+            return None
+        dirs.extend(os.path.join(directory, 'blogoland') for directory in loader_dirs)
+    return dirs
+
+
+def get_mtimes(dirs):
+    mtimes = []
+    for directory in dirs:
+        try:
+            mtimes.append(os.stat(directory).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def scan(dirs):
+    """
+    Returns the names of the override templates found in the given folders.
+    """
+    names = set()
+    for directory in dirs:
+        try:
+            filenames = os.listdir(directory)
+        except OSError:
+            continue
+        names.update('blogoland/%s' % filename for filename in filenames if OVERRIDE_RE.match(filename))
+    return frozenset(names)
+
+
+def get_overrides():
+    """
+    Returns the set of existing override template names, or None if they
+    can't be known.
+    """
+    with _lock:
+        if 'dirs' not in _state:
+            _state['dirs'] = get_template_dirs()
+            _state['mtimes'] = None
+        dirs = _state['dirs']
+        if dirs is None:
+            return None
+        if 'names' not in _state or settings.DEBUG:
+            mtimes = get_mtimes(dirs)
+            if mtimes != _state['mtimes']:
+                _state['names'] = scan(dirs)
+                _state['mtimes'] = mtimes
+        return _state['names']
+
+
+def select_templates(override, default):
+    """
+    Returns the template names to try: the override, if it may exist, and
+    the default template.
+    """
+    overrides = get_overrides()
+    if overrides is None or override in overrides:
+        return [override, default]
+    return [default]
+
+
+def reset():
+    with _lock:
+        _state.clear()
+
+
+@receiver(setting_changed)
+def reset_on_setting_changed(setting, **kwargs):
+    if setting in ('TEMPLATES', 'INSTALLED_APPS', 'DEBUG'):
+        reset()
@@ -0,0 +1,199 @@
+# -*- coding:utf8 -*-
+"""
+Paginators that avoid counting or offsetting large QuerySets.
+
+CountedPaginator takes a count the caller already has, like the post counts
+stored on a category. EstimatedCountPaginator reads the count of a whole
+table from the database statistics, see estimate_count, for the admin
+changelists.
+
+CursorPaginator is a keyset (cursor) pagination for Post QuerySets: instead
+of ``OFFSET`` the pages are fetched seeking on the ordering of the
+QuerySet, so deep pages cost the same as the first one and no ``COUNT(*)``
+is needed. Cursors are opaque tokens that encode the ordering values of the
+first or last object of the current page.
+"""
+import base64
+import json
+
+from django.core.paginator import InvalidPage, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.encoding import force_bytes, force_text
+from django.utils.functional import cached_property
+
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class CountedPaginator(Paginator):
+    """
+    Paginator that takes the total number of objects, e.g. a stored count,
+    instead of running a COUNT(*) query.
+    """
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super(CountedPaginator, self).__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            # Overrides the cached_property.
+            self.__dict__['count'] = count
+
+
+def estimate_count(model, using):
+    """
+    Returns the number of rows of the table of the model estimated from the
+    statistics of the database, or None if the database has none.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)'
+    elif connection.vendor == 'mysql':
+        sql = 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the number of objects of an unfiltered QuerySet
+    from the table statistics, instead of a COUNT(*) scan, once they
+    estimate more than min_estimate rows. Filtered QuerySets and smaller
+    tables are counted exactly.
+    """
+    min_estimate = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.min_estimate:
+                return estimate
+        return super(EstimatedCountPaginator, self).count
+
+
+class CursorPage(object):
+    """
+    A page of objects fetched by the CursorPaginator.
+    """
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Cursor page of %s objects>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator(object):
+    """
+    Paginates a QuerySet seeking on its ordering. The ordering must be total,
+    so it has to end with a unique field (``slug`` on Post).
+    """
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+    def encode_cursor(self, direction, obj):
+        """
+        Returns an opaque token with the ordering values of the given object.
+        """
+        values = [field.value_to_string(obj) for field in self.fields]
+        data = json.dumps([direction] + values, separators=(',', ':'))
+        return force_text(base64.urlsafe_b64encode(force_bytes(data))).rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        Returns the direction and the ordering values encoded in the token.
+        """
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            data = json.loads(force_text(base64.urlsafe_b64decode(force_bytes(cursor + padding))))
+            direction, values = data[0], data[1:]
+            if direction not in (NEXT, PREVIOUS) or len(values) != len(self.fields):
+                raise ValueError
+            values = [field.to_python(value) for field, value in zip(self.fields, values)]
+        except Exception:
+            raise InvalidCursor('Invalid cursor.')
+        return direction, values
+
+    def seek_filter(self, values, reverse=False):
+        """
+        Builds the lookup that selects the objects placed after the given
+        ordering values, or before them if reverse is True.
+        """
+        seek = Q()
+        equal = Q()
+        for name, value in zip(self.ordering, values):
+            descending = name.startswith('-') != reverse
+            name = name.lstrip('-')
+            lookup = '%s__%s' % (name, 'lt' if descending else 'gt')
+            seek |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return seek
+
+    def page(self, cursor=None):
+        """
+        Returns the CursorPage for the given cursor. Without cursor the first
+        page is returned.
+        """
+        if not cursor:
+            direction, queryset = NEXT, self.queryset.order_by(*self.ordering)
+        else:
+            direction, values = self.decode_cursor(cursor)
+            if direction == NEXT:
+                queryset = self.queryset.filter(self.seek_filter(values)).order_by(*self.ordering)
+            else:
+                reversed_ordering = [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+                queryset = self.queryset.filter(self.seek_filter(values, reverse=True)).order_by(*reversed_ordering)
+
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if direction == PREVIOUS:
+            object_list.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+
+        if not object_list:
+            return CursorPage(object_list, self)
+        return CursorPage(
+            object_list,
+            self,
+            next_cursor=self.encode_cursor(NEXT, object_list[-1]) if has_next else None,
+            previous_cursor=self.encode_cursor(PREVIOUS, object_list[0]) if has_previous else None,
+        )
@@ -0,0 +1,217 @@
+# -*- coding:utf8 -*-
+"""
+Post view counts and the precomputed popular posts.
+
+When BLOGOLAND_VIEW_COUNTS is on, PostDetailView counts its hits in a
+process-local buffer instead of writing on every request. The first hit
+after BLOGOLAND_VIEW_FLUSH_INTERVAL seconds flushes the buffer: the counts
+are added to Post.view_count with one F() UPDATE per distinct count, and
+the posts are merged into the popular lists, overall and of each of their
+categories. View counts only grow, so the new top of a list is always among
+its current posts and the flushed ones. The lists a post leaves when it is
+hidden or deleted are refilled from the stored counts by the signal
+handlers. The lists are stored in the PopularPost table, so the
+get_popular_posts tag runs one indexed query and never reads the counts.
+
+The hits buffered by a process that gets killed are lost.
+blogoland_popular_posts rebuilds every list from the stored counts.
+"""
+import atexit
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from blogoland import cache
+from blogoland.confs import DEFAULT_POPULAR_POSTS, DEFAULT_VIEW_COUNTS, DEFAULT_VIEW_FLUSH_INTERVAL
+from blogoland.models import Category, PopularPost, Post
+
+
+VIEW_COUNTS = getattr(settings, 'BLOGOLAND_VIEW_COUNTS', DEFAULT_VIEW_COUNTS)
+VIEW_FLUSH_INTERVAL = getattr(settings, 'BLOGOLAND_VIEW_FLUSH_INTERVAL', DEFAULT_VIEW_FLUSH_INTERVAL)
+POPULAR_POSTS = getattr(settings, 'BLOGOLAND_POPULAR_POSTS', DEFAULT_POPULAR_POSTS)
+
+# Only one process merges into the popular lists at a time.
+LOCK_KEY = '%s:popular:lock' % cache.KEY_PREFIX
+LOCK_TIMEOUT = 60
+
+BATCH_SIZE = 500
+
+logger = logging.getLogger('blogoland.popular')
+
+
+def batches(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def top(posts):
+    """
+    Returns the POPULAR_POSTS most viewed of the given {pk: view count}
+    posts as a list of (pk, view count).
+    """
+    return heapq.nlargest(POPULAR_POSTS, posts.items(), key=lambda item: (item[1], -item[0]))
+
+
+class ViewBuffer(object):
+    """
+    Process-local counts of the post views, by slug, flushed to the database
+    every `interval` seconds.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.started = time.time()
+
+    def hit(self, slug):
+        """
+        Counts a view of the post with the given slug, and flushes the buffer
+        when it is due.
+        """
+        with self.lock:
+            self.counts[slug] += 1
+            due = time.time() - self.started >= self.interval
+        if due:
+            self.flush()
+
+    def drain(self):
+        """
+        Returns the buffered counts and empties the buffer.
+        """
+        with self.lock:
+            counts, self.counts, self.started = self.counts, Counter(), time.time()
+        return counts
+
+    def flush(self):
+        """
+        Writes the buffered counts and updates the popular lists. The counts
+        are kept for the next flush if they can't be written.
+        """
+        counts = self.drain()
+        if not counts:
+            return
+        try:
+            totals = add_views(counts)
+        except Exception:
+            logger.exception('Could not flush %s post views.', sum(counts.values()))
+            with self.lock:
+                self.counts.update(counts)
+            return
+        try:
+            merge(totals)
+        except Exception:
+            logger.exception('Could not update the popular posts.')
+
+
+view_buffer = ViewBuffer(VIEW_FLUSH_INTERVAL)
+
+if VIEW_COUNTS:
+    atexit.register(view_buffer.flush)
+
+
+@transaction.atomic
+def add_views(counts):
+    """
+    Adds the given {slug: views} counts to the posts, with one UPDATE per
+    distinct count. Returns the new {pk: view count} of the public ones.
+    """
+    slugs_by_views = defaultdict(list)
+    for slug, views in counts.items():
+        slugs_by_views[views].append(slug)
+    for views, slugs in slugs_by_views.items():
+        for batch in batches(slugs):
+            Post.objects.filter(slug__in=batch).update(view_count=F('view_count') + views)
+    totals = {}
+    if POPULAR_POSTS:
+        for batch in batches(counts):
+            totals.update(Post.objects.get_public_posts().filter(slug__in=batch).values_list('pk', 'view_count'))
+    return totals
+
+
+def merge(totals):
+    """
+    Merges the given {pk: view count} posts into the overall popular list
+    and the lists of their categories. Skipped while another process
+    merges; the posts get in with their next views.
+    """
+    if not totals or not cache.get_cache().add(LOCK_KEY, 1, LOCK_TIMEOUT):
+        return
+    try:
+        with transaction.atomic():
+            post_categories = defaultdict(list)
+            through = Post.category.through.objects
+            for batch in batches(totals):
+                for post_id, category_id in through.filter(post__in=batch).values_list('post_id', 'category_id'):
+                    post_categories[post_id].append(category_id)
+            scope = Q(category__isnull=True) | Q(category__in=set(
+                category_id for category_ids in post_categories.values() for category_id in category_ids))
+
+            lists = defaultdict(dict)
+            for category_id, post_id, views in PopularPost.objects.filter(scope).values_list(
+                    'category', 'post', 'view_count'):
+                lists[category_id][post_id] = views
+            for pk, views in totals.items():
+                lists[None][pk] = views
+                for category_id in post_categories[pk]:
+                    lists[category_id][pk] = views
+
+            PopularPost.objects.filter(scope).delete()
+            PopularPost.objects.bulk_create([
+                PopularPost(category_id=category_id, post_id=pk, view_count=views)
+                for category_id, posts in lists.items()
+                for pk, views in top(posts)
+            ], batch_size=BATCH_SIZE)
+    finally:
+        cache.get_cache().delete(LOCK_KEY)
+
+
+def get_list_rows(category_id):
+    """
+    Returns the PopularPost rows of the given category, or of the overall
+    list for None, computed from the view counts of the public posts.
+    """
+    public = Post.objects.get_public_posts().filter(view_count__gt=0).order_by('-view_count', 'pk')
+    if category_id is not None:
+        public = public.filter(category=category_id)
+    return [PopularPost(category_id=category_id, post_id=pk, view_count=views)
+            for pk, views in public.values_list('pk', 'view_count')[:POPULAR_POSTS]]
+
+
+@transaction.atomic
+def rebuild():
+    """
+    Recomputes every popular list from the view counts of the public posts.
+    """
+    PopularPost.objects.all().delete()
+    if not POPULAR_POSTS:
+        return
+    rows = get_list_rows(None)
+    for category_pk in Category.objects.values_list('pk', flat=True):
+        rows.extend(get_list_rows(category_pk))
+    PopularPost.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+@transaction.atomic
+def refill(category_ids):
+    """
+    Recomputes the given popular lists, None being the overall one, after
+    one of their posts stopped being public.
+    """
+    category_ids = set(category_ids)
+    if not category_ids:
+        return
+    scope = Q(category__in=[category_id for category_id in category_ids if category_id is not None])
+    if None in category_ids:
+        scope |= Q(category__isnull=True)
+    PopularPost.objects.filter(scope).delete()
+    rows = []
+    for category_id in category_ids:
+        rows.extend(get_list_rows(category_id))
+    PopularPost.objects.bulk_create(rows, batch_size=BATCH_SIZE)
@@ -0,0 +1,406 @@
+# -*- coding:utf8 -*-
+"""
+Precomputed related posts.
+
+Each post is described by the TF-IDF weights of its most frequent terms,
+counted on Post.terms when it is saved, and by its categories. The
+similarity of two posts blends the cosine of their term vectors with the
+overlap of their categories. The term counts are copied to the PostTerm
+table, an inverted index of the terms, and the number of posts holding each
+term is kept in the TermFrequency table. The vectors are sparse, so the
+neighbours of a post are scored only visiting the posts that share a
+weighted term or a category with it. The top neighbours of each post are
+stored in the RelatedPost table, so the get_related_posts tag runs one
+indexed query.
+
+The posts saved in a transaction are updated together once it commits:
+their terms are indexed and counted, then their rows are recomputed, with
+the rows of the posts that listed them, loading only the posts found
+through their terms and categories. Scores are symmetric, so they are
+merged into the rows of the posts they now enter the top of.
+blogoland_related_posts recomputes everything.
+"""
+import heapq
+import json
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from blogoland.confs import DEFAULT_RELATED_POSTS
+from blogoland.models import Post, PostTerm, RelatedPost, TermFrequency, count_terms
+
+
+RELATED_POSTS = getattr(settings, 'BLOGOLAND_RELATED_POSTS', DEFAULT_RELATED_POSTS)
+
+# Share of the score given to the category overlap.
+CATEGORY_WEIGHT = 0.3
+# Terms found in more than this share of the posts carry no meaning, once
+# there are enough posts to tell.
+MAX_DOCUMENT_FREQUENCY = 0.5
+MIN_POSTS_FOR_MAX_FREQUENCY = 20
+# Longer terms are not indexed.
+MAX_TERM_LENGTH = 100
+# The TermFrequency row counting the posts with terms.
+TOTAL = ''
+
+BATCH_SIZE = 500
+
+# Connection attribute holding the update scheduled in its transaction.
+PENDING_ATTR = '_blogoland_related_update'
+
+
+def batches(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def top(scores):
+    """
+    Returns the RELATED_POSTS best of the given (pk, score) as a list.
+    """
+    return heapq.nlargest(RELATED_POSTS, scores, key=lambda item: (item[1], -item[0]))
+
+
+def get_terms(title, plain_content, terms):
+    """
+    Returns the {term: count} terms of a post from its JSON terms. Posts
+    saved before the terms were stored are counted here.
+    """
+    terms = json.loads(terms) if terms else count_terms(title, plain_content)
+    return dict((term, count) for term, count in terms.items() if len(term) <= MAX_TERM_LENGTH)
+
+
+def get_idf(frequencies, total):
+    """
+    Returns the inverse document frequency of the given {term: post count}
+    terms, without the terms found in every post or in too many of them.
+    """
+    total = float(total)
+    return dict(
+        (term, math.log(total / count)) for term, count in frequencies.items()
+        if 0 < count < total and (count / total <= MAX_DOCUMENT_FREQUENCY or total < MIN_POSTS_FOR_MAX_FREQUENCY)
+    )
+
+
+def get_weights(terms, idf):
+    """
+    Returns the normalized TF-IDF weights of the given {term: count} terms.
+    Terms without idf weigh 0.
+    """
+    weights = dict((term, (1 + math.log(count)) * idf.get(term, 0.0)) for term, count in terms.items())
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    if norm:
+        weights = dict((term, weight / norm) for term, weight in weights.items())
+    return weights
+
+
+def get_frequencies(terms):
+    """
+    Returns the stored {term: post count} of the given terms.
+    """
+    frequencies = {}
+    for batch in batches(terms):
+        frequencies.update(TermFrequency.objects.filter(term__in=batch).values_list('term', 'post_count'))
+    return frequencies
+
+
+def get_categories(post_ids):
+    """
+    Returns a dict with the set of category pks of each of the given posts.
+    """
+    categories = defaultdict(set)
+    through = Post.category.through.objects
+    for batch in batches(post_ids):
+        for post_id, category_id in through.filter(post__in=batch).values_list('post_id', 'category_id'):
+            categories[post_id].add(category_id)
+    return categories
+
+
+class SimilarityIndex(object):
+    """
+    Normalized TF-IDF vectors of posts and inverted indexes of their terms
+    and categories.
+    """
+    def __init__(self, postings, categories, visible):
+        """
+        Takes an iterable of (pk, term, weight), a dict with the set of
+        category pks of each post pk and the set of visible post pks.
+        """
+        self.categories = categories
+        self.visible = visible
+
+        self.vectors = defaultdict(dict)
+        self.postings = defaultdict(list)
+        for pk, term, weight in postings:
+            if weight:
+                self.vectors[pk][term] = weight
+                self.postings[term].append((pk, weight))
+
+        self.category_posts = defaultdict(list)
+        for pk, category_pks in categories.items():
+            for category_pk in category_pks:
+                self.category_posts[category_pk].append(pk)
+
+    def scores(self, pk):
+        """
+        Returns a dict with the similarity of the given post to every visible
+        post sharing a term or a category with it.
+        """
+        dot = defaultdict(float)
+        for term, weight in self.vectors.get(pk, {}).items():
+            for other, other_weight in self.postings[term]:
+                dot[other] += weight * other_weight
+
+        own_categories = self.categories.get(pk, set())
+        overlap = defaultdict(int)
+        for category_pk in own_categories:
+            for other in self.category_posts[category_pk]:
+                overlap[other] += 1
+
+        scores = {}
+        for other in set(dot) | set(overlap):
+            if other == pk or other not in self.visible:
+                continue
+            score = (1 - CATEGORY_WEIGHT) * dot.get(other, 0.0)
+            if overlap.get(other):
+                union = len(own_categories | self.categories.get(other, set()))
+                score += CATEGORY_WEIGHT * overlap[other] / float(union)
+            if score > 0:
+                scores[other] = score
+        return scores
+
+    def neighbours(self, pk):
+        """
+        Returns the RELATED_POSTS most similar posts as a list of (pk, score).
+        """
+        return top(self.scores(pk).items())
+
+
+def load_index(post_ids):
+    """
+    Builds the SimilarityIndex of the given posts, with the posts sharing
+    a weighted term or a category with them.
+    """
+    terms = defaultdict(dict)
+    for batch in batches(post_ids):
+        for pk, term, count in PostTerm.objects.filter(post__in=batch).values_list('post', 'term', 'count'):
+            terms[pk][term] = count
+    frequencies = get_frequencies(set(term for counts in terms.values() for term in counts) | set([TOTAL]))
+    total = frequencies.pop(TOTAL, 0)
+    idf = get_idf(frequencies, total)
+
+    pks = set(post_ids)
+    for batch in batches(set(term for counts in terms.values() for term in counts if term in idf)):
+        pks.update(PostTerm.objects.filter(term__in=batch).values_list('post', flat=True))
+    category_pks = set(pk for category_pks in get_categories(post_ids).values() for pk in category_pks)
+    through = Post.category.through.objects
+    for batch in batches(category_pks):
+        pks.update(through.filter(category__in=batch).values_list('post_id', flat=True))
+
+    for batch in batches(pks - set(post_ids)):
+        for pk, term, count in PostTerm.objects.filter(post__in=batch).values_list('post', 'term', 'count'):
+            terms[pk][term] = count
+    frequencies.update(get_frequencies(set(term for counts in terms.values() for term in counts) - set(frequencies)))
+    idf = get_idf(frequencies, total)
+    postings = [(pk, term, weight) for pk, counts in terms.items() for term, weight in get_weights(counts, idf).items()]
+
+    visible = set()
+    for batch in batches(pks):
+        visible.update(Post.objects.filter(pk__in=batch, is_visible=True).values_list('pk', flat=True))
+    return SimilarityIndex(postings, get_categories(pks), visible)
+
+
+def count_frequencies(changes):
+    """
+    Adds the given {term: change} to the stored post counts of the terms,
+    with one UPDATE per distinct change.
+    """
+    changes = dict((term, change) for term, change in changes.items() if change)
+    existing = set(get_frequencies(changes))
+    try:
+        with transaction.atomic():
+            TermFrequency.objects.bulk_create([
+                TermFrequency(term=term, post_count=change) for term, change in changes.items()
+                if term not in existing and change > 0
+            ], batch_size=BATCH_SIZE)
+    except IntegrityError:
+        # Another process counted some of them meanwhile.
+        existing = set(changes)
+
+    terms_by_change = defaultdict(list)
+    for term, change in changes.items():
+        if term in existing:
+            terms_by_change[change].append(term)
+    for change, terms in terms_by_change.items():
+        for batch in batches(terms):
+            TermFrequency.objects.filter(term__in=batch).update(post_count=F('post_count') + change)
+
+
+def index_terms(post_ids):
+    """
+    Copies the terms of the given posts to the PostTerm table and counts
+    their changes. Returns the pks of the posts that still exist.
+    """
+    old_terms = defaultdict(set)
+    posts = {}
+    for batch in batches(post_ids):
+        for pk, term in PostTerm.objects.filter(post__in=batch).values_list('post', 'term'):
+            old_terms[pk].add(term)
+        for pk, title, plain_content, terms in Post.objects.filter(pk__in=batch).values_list(
+                'pk', 'title', 'plain_content', 'terms'):
+            posts[pk] = get_terms(title, plain_content, terms)
+
+    changes = Counter()
+    for pk, terms in posts.items():
+        changes.update(set(terms) - old_terms[pk])
+        changes.subtract(old_terms[pk] - set(terms))
+        changes[TOTAL] += bool(terms) - bool(old_terms[pk])
+    count_frequencies(changes)
+
+    for batch in batches(posts):
+        PostTerm.objects.filter(post__in=batch).delete()
+    PostTerm.objects.bulk_create([
+        PostTerm(post_id=pk, term=term, count=count) for pk, terms in posts.items() for term, count in terms.items()
+    ], batch_size=BATCH_SIZE)
+    return set(posts)
+
+
+def forget_terms(post_ids):
+    """
+    Uncounts the terms of the given posts, before they are deleted.
+    """
+    changes = Counter()
+    posts = set()
+    for batch in batches(post_ids):
+        for pk, term in PostTerm.objects.filter(post__in=batch).values_list('post', 'term'):
+            changes[term] -= 1
+            posts.add(pk)
+    changes[TOTAL] -= len(posts)
+    count_frequencies(changes)
+
+
+def store(rows, batch_size=BATCH_SIZE):
+    """
+    Replaces the related posts of the given {pk: [(pk, score)]} rows.
+    """
+    for batch in batches(rows, batch_size):
+        RelatedPost.objects.filter(post__in=batch).delete()
+    RelatedPost.objects.bulk_create([
+        RelatedPost(post_id=pk, related_id=related_pk, score=score)
+        for pk, neighbours in rows.items()
+        for related_pk, score in neighbours
+    ], batch_size=batch_size)
+
+
+@transaction.atomic
+def rebuild(batch_size=BATCH_SIZE):
+    """
+    Indexes and counts the terms of every post, and recomputes their
+    related posts.
+    """
+    posts = {}
+    visible = set()
+    for pk, title, plain_content, terms, is_visible in Post.objects.order_by().values_list(
+            'pk', 'title', 'plain_content', 'terms', 'is_visible').iterator():
+        posts[pk] = get_terms(title, plain_content, terms)
+        if is_visible:
+            visible.add(pk)
+    frequencies = Counter(term for terms in posts.values() for term in terms)
+    frequencies[TOTAL] = sum(1 for terms in posts.values() if terms)
+    idf = get_idf(frequencies, frequencies[TOTAL])
+    postings = [(pk, term, weight) for pk, terms in posts.items() for term, weight in get_weights(terms, idf).items()]
+
+    TermFrequency.objects.all().delete()
+    TermFrequency.objects.bulk_create([
+        TermFrequency(term=term, post_count=count) for term, count in frequencies.items()
+    ], batch_size=batch_size)
+    PostTerm.objects.all().delete()
+    PostTerm.objects.bulk_create([
+        PostTerm(post_id=pk, term=term, count=count) for pk, terms in posts.items() for term, count in terms.items()
+    ], batch_size=batch_size)
+
+    categories = defaultdict(set)
+    for post_id, category_id in Post.category.through.objects.values_list('post_id', 'category_id').iterator():
+        categories[post_id].add(category_id)
+    index = SimilarityIndex(postings, categories, visible)
+    RelatedPost.objects.all().delete()
+    for batch in batches(posts, batch_size):
+        store(dict((pk, index.neighbours(pk)) for pk in batch), batch_size)
+
+
+@transaction.atomic
+def update(post_ids, listed_by=()):
+    """
+    Indexes the terms of the given posts, and recomputes their related
+    posts and the ones of their affected neighbours: the posts that listed
+    them, or that listed the given deleted posts (listed_by), and the posts
+    they now enter the top of.
+    """
+    post_ids = index_terms(set(post_ids))
+
+    # Posts that listed a changed post may have lost it, or it may have
+    # moved, so their whole row is recomputed.
+    listing = set(listed_by)
+    for batch in batches(post_ids):
+        listing.update(RelatedPost.objects.filter(related__in=batch).values_list('post', flat=True))
+    affected = set(post_ids)
+    for batch in batches(listing - post_ids):
+        affected.update(Post.objects.filter(pk__in=batch).values_list('pk', flat=True))
+    index = load_index(affected)
+    rows = dict((pk, index.neighbours(pk)) for pk in affected)
+
+    entering = defaultdict(list)
+    for pk in post_ids & index.visible:
+        for other, score in rows[pk]:
+            if other not in affected:
+                entering[other].append((pk, score))
+    current = defaultdict(list)
+    for batch in batches(entering):
+        for pk, related_pk, score in RelatedPost.objects.filter(post__in=batch).values_list('post', 'related', 'score'):
+            current[pk].append((related_pk, score))
+    for pk, scores in entering.items():
+        neighbours = top(current[pk] + scores)
+        if set(neighbours) != set(current[pk]):
+            rows[pk] = neighbours
+    store(rows)
+
+
+class PendingUpdate(object):
+    """
+    The posts to update once the current transaction commits.
+    """
+    def __init__(self):
+        self.post_ids = set()
+        self.listed_by = set()
+
+    def add(self, post_ids, listed_by):
+        self.post_ids.update(post_ids)
+        self.listed_by.update(listed_by)
+
+    def __call__(self):
+        update(self.post_ids, self.listed_by)
+
+
+def schedule(post_ids, listed_by=()):
+    """
+    Updates the related posts of the given posts once the current
+    transaction commits, with one update for all the posts scheduled in it.
+    Disabled when BLOGOLAND_RELATED_POSTS is 0.
+    """
+    if not RELATED_POSTS:
+        return
+    connection = transaction.get_connection()
+    pending = getattr(connection, PENDING_ATTR, None)
+    # The callback is dropped when its transaction or savepoint rolls back,
+    # and popped when it runs.
+    if pending is not None and any(callback is pending for savepoint_ids, callback in connection.run_on_commit):
+        pending.add(post_ids, listed_by)
+        return
+    pending = PendingUpdate()
+    pending.add(post_ids, listed_by)
+    setattr(connection, PENDING_ATTR, pending)
+    transaction.on_commit(pending)
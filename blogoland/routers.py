@@ -0,0 +1,147 @@
+# -*- coding:utf8 -*-
+"""
+Optional routing of the public blogoland reads to a read replica.
+
+ReplicaRouter sends the reads of the blogoland models to the
+BLOGOLAND_REPLICA_DB alias, but only inside ``replica_reads()``: the post
+list, post detail and category views of anonymous and non-staff users
+enter it while they run and render, and the template tags compute their
+results in it. Every other read, and every write, goes to the default
+database.
+
+The replica lags behind, so reads go back to the default database as soon
+as a blogoland model is written in the current block, and
+StickyPrimaryMiddleware pins a user to it for
+BLOGOLAND_REPLICA_STICKY_SECONDS after a request of theirs that wrote to
+one, so their own changes are visible right away. For the same time after
+a cache version bump, what a block read from the replica may predate it,
+so it is not cached under the new version, see has_read_replica.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router
+
+from blogoland.confs import DEFAULT_REPLICA_DB, DEFAULT_REPLICA_STICKY_SECONDS
+
+
+APP_LABEL = 'blogoland'
+
+STICKY_COOKIE = 'blogoland_primary'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_state = threading.local()
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+def has_written():
+    return getattr(_state, 'written', False)
+
+
+def in_replica_reads():
+    return getattr(_state, 'replica', False)
+
+
+def has_read_replica():
+    """
+    Returns whether the current replica_reads() block read from the replica.
+    """
+    return getattr(_state, 'replica_read', False)
+
+
+@contextmanager
+def replica_reads():
+    """
+    Lets the reads of the blogoland models in the enclosed code go to the
+    replica, until one of them is written.
+    """
+    replica, written, replica_read = in_replica_reads(), has_written(), has_read_replica()
+    # Reads and writes made before the outermost block don't matter to it.
+    _state.replica, _state.written = True, written if replica else False
+    _state.replica_read = replica_read if replica else False
+    try:
+        yield
+    finally:
+        _state.replica, _state.written = replica, written or has_written()
+        _state.replica_read = replica_read or has_read_replica()
+
+
+@contextmanager
+def pinned_to_primary(pinned=True):
+    """
+    Sends every read of the enclosed code to the default database when
+    pinned. Writes made meanwhile can be checked with has_written.
+    """
+    previous = is_pinned(), in_replica_reads(), has_written(), has_read_replica()
+    _state.pinned, _state.replica, _state.written, _state.replica_read = pinned, False, False, False
+    try:
+        yield
+    finally:
+        _state.pinned, _state.replica, _state.written, _state.replica_read = previous
+
+
+def get_read_db(model):
+    """
+    Returns the database the reads of the model go to inside
+    replica_reads(), for QuerySets evaluated after it exits.
+    """
+    with replica_reads():
+        return router.db_for_read(model)
+
+
+class ReplicaRouter(object):
+    """
+    Routes the reads of the blogoland models inside replica_reads() to
+    BLOGOLAND_REPLICA_DB and their writes to the default database. The
+    replica must have the same tables, so migrations run on both.
+    """
+    def __init__(self):
+        self.replica = getattr(settings, 'BLOGOLAND_REPLICA_DB', DEFAULT_REPLICA_DB)
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if self.replica and in_replica_reads() and not is_pinned() and not has_written():
+            _state.replica_read = True
+            return self.replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        _state.written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = (DEFAULT_DB_ALIAS, self.replica)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class StickyPrimaryMiddleware(object):
+    """
+    Pins the requests that write, and the requests of the users who wrote
+    a blogoland model in the last BLOGOLAND_REPLICA_STICKY_SECONDS, to the
+    default database.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'BLOGOLAND_REPLICA_STICKY_SECONDS', DEFAULT_REPLICA_STICKY_SECONDS)
+
+    def __call__(self, request):
+        unsafe = request.method not in SAFE_METHODS
+        with pinned_to_primary(unsafe or STICKY_COOKIE in request.COOKIES):
+            response = self.get_response(request)
+            written = has_written()
+        if unsafe and written:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=self.sticky_seconds, httponly=True)
+        return response
@@ -0,0 +1,145 @@
+# -*- coding:utf8 -*-
+"""
+Full-text search of posts.
+
+Each post stores a search document built from its title, its plain text
+content and the titles of its categories. On PostgreSQL the document is
+indexed by a GIN index over its ``tsvector``; on SQLite it is copied to an
+FTS5 table. Other databases fall back to ``icontains`` lookups. The
+documents are updated in batches, with one UPDATE per batch.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Case, Q, TextField, Value, When, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+
+from blogoland.confs import DEFAULT_SEARCH_CONFIG
+from blogoland.models import Post
+
+SEARCH_CONFIG = getattr(settings, 'BLOGOLAND_SEARCH_CONFIG', DEFAULT_SEARCH_CONFIG)
+
+FTS_TABLE = 'blogoland_post_fts'
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# Each post takes three query parameters in the UPDATE of its batch, within
+# the 999 parameters of older SQLite versions.
+BATCH_SIZE = 300
+
+
+def get_vendor():
+    return connections[router.db_for_write(Post)].vendor
+
+
+def build_document(title, content, category_titles):
+    """
+    Returns the text indexed for a post.
+    """
+    return '\n'.join([title or '', ' '.join(category_titles), content or ''])
+
+
+def batches(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def update_index(post_ids):
+    """
+    Rebuilds the search document of the given posts, one batch at a time.
+    """
+    for batch in batches(post_ids, BATCH_SIZE):
+        update_batch(batch)
+
+
+def update_batch(post_ids):
+    """
+    Rebuilds the search documents of a batch of posts with one UPDATE.
+    """
+    categories = {}
+    through = Post.category.through.objects.filter(post_id__in=post_ids)
+    for post_id, title in through.values_list('post_id', 'category__title'):
+        categories.setdefault(post_id, []).append(title)
+
+    documents = []
+    posts = Post.objects.filter(pk__in=post_ids).values_list('pk', 'title', 'plain_content', 'content')
+    for pk, title, plain_content, content in posts:
+        if plain_content is None:
+            plain_content = strip_tags(content or '')
+        documents.append((pk, build_document(title, plain_content, categories.get(pk, []))))
+    if not documents:
+        return
+    Post.objects.filter(pk__in=[pk for pk, document in documents]).update(search_document=Case(
+        *[When(pk=pk, then=Value(document)) for pk, document in documents], output_field=TextField()))
+    index_documents(documents)
+
+
+def schedule_category(category_pk):
+    """
+    Rebuilds the search document of the posts of the given category once
+    the current transaction commits.
+    """
+    def run():
+        update_index(Post.objects.filter(category=category_pk).values_list('pk', flat=True))
+    transaction.on_commit(run)
+
+
+def index_documents(documents):
+    """
+    Copies the given (pk, document) pairs, already stored on the posts, to
+    the SQLite FTS table. PostgreSQL indexes the posts by itself.
+    """
+    if documents and get_vendor() == 'sqlite':
+        with connections[router.db_for_write(Post)].cursor() as cursor:
+            cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [(pk,) for pk, _ in documents])
+            cursor.executemany('INSERT INTO %s (rowid, document) VALUES (%%s, %%s)' % FTS_TABLE, documents)
+
+
+def remove_from_index(post_ids):
+    """
+    Removes the given posts from the SQLite FTS table. PostgreSQL keeps its
+    index by itself.
+    """
+    if get_vendor() == 'sqlite':
+        with connections[router.db_for_write(Post)].cursor() as cursor:
+            cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [(pk,) for pk in post_ids])
+
+
+def search(queryset, query):
+    """
+    Filters the given Post QuerySet by the search query and annotates it
+    with a 'search_rank', ordering the best matches first.
+    """
+    terms = TERM_RE.findall(query or '')
+    if not terms:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    table = Post._meta.db_table
+    if vendor == 'postgresql':
+        vector = 'to_tsvector(%%s::regconfig, "%s"."search_document")' % table
+        tsquery = 'plainto_tsquery(%s::regconfig, %s)'
+        params = (SEARCH_CONFIG, SEARCH_CONFIG, ' '.join(terms))
+        queryset = queryset.extra(where=['%s @@ %s' % (vector, tsquery)], params=params)
+        rank = RawSQL('ts_rank(%s, %s)' % (vector, tsquery), params, output_field=FloatField())
+    elif vendor == 'sqlite':
+        match = ' '.join('"%s"' % term for term in terms)
+        # Not a pk__in RawSQL lookup: SQLite reads "IN ((SELECT ...))" as a
+        # single value, the first match.
+        queryset = queryset.extra(
+            where=['"{1}"."id" IN (SELECT rowid FROM {0} WHERE {0} MATCH %s)'.format(FTS_TABLE, table)],
+            params=(match,))
+        rank = RawSQL(
+            '(SELECT -bm25({0}) FROM {0} WHERE {0} MATCH %s AND rowid = "{1}"."id")'.format(FTS_TABLE, table),
+            (match,), output_field=FloatField())
+    else:
+        lookups = Q()
+        for term in terms:
+            lookups &= Q(search_document__icontains=term)
+        queryset = queryset.filter(lookups)
+        rank = Value(0.0, output_field=FloatField())
+    ordering = ['-search_rank'] + list(Post._meta.ordering)
+    return queryset.annotate(search_rank=rank).order_by(*ordering)
@@ -0,0 +1,308 @@
+# -*- coding:utf8 -*-
+"""
+Signal handlers that keep the blogoland caches, modification dates, post
+counts, archive index, related posts and search index up to date. They are
+connected when the app is ready.
+"""
+import datetime
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from blogoland import archive, cache, images, popular, related, search
+from blogoland.models import Post, PostImage, Category, PopularPost, RelatedPost
+
+
+def bump_post(post, category_slugs=()):
+    """
+    Invalidates the pages showing the given post.
+    """
+    names = [cache.LIST_VERSION, cache.post_version(post.slug)]
+    old_slug = getattr(post, '_blogoland_old_slug', None)
+    if old_slug:
+        names.append(cache.post_version(old_slug))
+    names.extend(cache.category_version(slug) for slug in category_slugs)
+    cache.bump_versions(names)
+
+
+def forget_next_publication():
+    """
+    Drops the memoized next publication change, see
+    PostManager.get_next_publication_change.
+    """
+    cache.get_cache().delete(cache.next_publication_key(datetime.date.today()))
+
+
+def bump_category(category, post_slugs=()):
+    """
+    Invalidates the pages showing the given category.
+    """
+    names = [cache.LIST_VERSION, cache.category_version(category.slug)]
+    old_slug = getattr(category, '_blogoland_old_slug', None)
+    if old_slug:
+        names.append(cache.category_version(old_slug))
+    names.extend(cache.post_version(slug) for slug in post_slugs)
+    cache.bump_versions(names)
+
+
+def touch_posts(**lookups):
+    """
+    Updates the modification date of the posts matching the given lookups
+    without triggering their save signals.
+    """
+    Post.objects.filter(**lookups).update(modification_date=timezone.now())
+
+
+def touch_post_categories(post):
+    """
+    Updates the posts modification date of the categories of the given
+    post, which the category pages use for their Last-Modified header.
+    """
+    Category.objects.filter(post=post).update(posts_modification_date=timezone.now())
+
+
+def get_category_slugs(post):
+    return list(post.category.values_list('slug', flat=True))
+
+
+def get_post_slugs(category):
+    return list(category.post_set.values_list('slug', flat=True))
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Category)
+def remember_old_values(sender, instance, raw=False, **kwargs):
+    """
+    Keeps the slug stored in the database, so the pages cached under it are
+    invalidated when it changes, the publication date of posts, so their
+    former archive month is recounted, and the title of categories, so
+    their posts are only indexed again when it changes.
+    """
+    if raw or instance.pk is None:
+        return
+    fields = ['slug', 'publication_date'] if sender is Post else ['slug', 'title']
+    old = sender.objects.filter(pk=instance.pk).values(*fields).first() or {}
+    instance._blogoland_old_slug = old.get('slug')
+    instance._blogoland_old_publication_date = old.get('publication_date')
+    instance._blogoland_old_title = old.get('title')
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, raw=False, **kwargs):
+    bump_post(instance, get_category_slugs(instance))
+    forget_next_publication()
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    # The categories are read before the through rows are deleted.
+    bump_post(instance, get_category_slugs(instance))
+    forget_next_publication()
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, raw=False, **kwargs):
+    bump_category(instance, get_post_slugs(instance))
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    bump_category(instance, get_post_slugs(instance))
+    touch_posts(category=instance)
+
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+def post_image_changed(sender, instance, **kwargs):
+    try:
+        post = instance.post
+    except Post.DoesNotExist:
+        return
+    bump_post(post, get_category_slugs(post))
+    touch_posts(pk=post.pk)
+    touch_post_categories(post)
+
+
+@receiver(m2m_changed, sender=Post.category.through)
+def post_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        if action == 'pre_clear':
+            slugs = get_category_slugs(instance)
+        else:
+            slugs = Category.objects.filter(pk__in=pk_set).values_list('slug', flat=True)
+        bump_post(instance, slugs)
+        touch_posts(pk=instance.pk)
+    else:
+        if action == 'pre_clear':
+            slugs = get_post_slugs(instance)
+            touch_posts(category=instance)
+        else:
+            slugs = Post.objects.filter(pk__in=pk_set).values_list('slug', flat=True)
+            touch_posts(pk__in=pk_set)
+        bump_category(instance, slugs)
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, raw=False, **kwargs):
+    search.update_index([instance.pk])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.remove_from_index([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def index_category_posts(sender, instance, created=False, raw=False, **kwargs):
+    if not created and getattr(instance, '_blogoland_old_title', None) != instance.title:
+        search.schedule_category(instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_posts(sender, instance, **kwargs):
+    instance._blogoland_post_ids = list(instance.post_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def index_former_category_posts(sender, instance, **kwargs):
+    search.update_index(getattr(instance, '_blogoland_post_ids', []))
+
+
+@receiver(m2m_changed, sender=Post.category.through)
+def index_post_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._blogoland_post_ids = list(instance.post_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            search.update_index([instance.pk])
+        elif action == 'post_clear':
+            search.update_index(getattr(instance, '_blogoland_post_ids', []))
+        else:
+            search.update_index(pk_set)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created=False, raw=False, **kwargs):
+    # New posts have no categories yet.
+    if not created:
+        Category.objects.filter(post=instance).update_post_counts()
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_categories(sender, instance, **kwargs):
+    instance._blogoland_category_ids = list(instance.category.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    Category.objects.filter(pk__in=getattr(instance, '_blogoland_category_ids', [])).update_post_counts()
+
+
+@receiver(m2m_changed, sender=Post.category.through)
+def count_category_posts(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._blogoland_category_ids = list(instance.category.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            pks = [instance.pk]
+        elif action == 'post_clear':
+            pks = getattr(instance, '_blogoland_category_ids', [])
+        else:
+            pks = pk_set
+        Category.objects.filter(pk__in=pks).update_post_counts()
+
+
+def get_archive_months(post):
+    months = set([(post.publication_date.year, post.publication_date.month)])
+    old_date = getattr(post, '_blogoland_old_publication_date', None)
+    if old_date:
+        months.add((old_date.year, old_date.month))
+    return months
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def archive_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        archive.recount(get_archive_months(instance))
+
+
+@receiver(m2m_changed, sender=Post.category.through)
+def archive_post_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        archive.recount(get_archive_months(instance))
+    elif action == 'post_clear':
+        archive.recount(instance.archive_months.values_list('year', 'month'))
+    else:
+        archive.recount(archive.get_post_months(Post.objects.filter(pk__in=pk_set)))
+
+
+@receiver(post_save, sender=Post)
+def relate_saved_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        related.schedule([instance.pk])
+
+
+@receiver(pre_delete, sender=Post)
+def remember_listing_posts(sender, instance, **kwargs):
+    # The rows listing the post are deleted with it.
+    instance._blogoland_listed_by = list(RelatedPost.objects.filter(related=instance).values_list('post', flat=True))
+    # So are its terms.
+    related.forget_terms([instance.pk])
+
+
+@receiver(post_delete, sender=Post)
+def relate_deleted_post(sender, instance, **kwargs):
+    related.schedule([], getattr(instance, '_blogoland_listed_by', []))
+
+
+@receiver(m2m_changed, sender=Post.category.through)
+def relate_post_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        related.schedule([instance.pk])
+    elif action == 'post_clear':
+        # Remembered by index_post_categories.
+        related.schedule(getattr(instance, '_blogoland_post_ids', []))
+    else:
+        related.schedule(pk_set)
+
+
+def get_popular_lists(post):
+    return list(PopularPost.objects.filter(post=post).values_list('category', flat=True))
+
+
+@receiver(post_save, sender=Post)
+def unlist_hidden_post(sender, instance, raw=False, **kwargs):
+    # Hidden and scheduled posts leave the popular lists they were in.
+    public = instance.is_visible and instance.publication_date <= datetime.date.today()
+    if not raw and not public:
+        popular.refill(get_popular_lists(instance))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_popular_lists(sender, instance, **kwargs):
+    # The rows of the post are deleted with it.
+    instance._blogoland_popular_lists = get_popular_lists(instance)
+
+
+@receiver(post_delete, sender=Post)
+def refill_popular_lists(sender, instance, **kwargs):
+    popular.refill(getattr(instance, '_blogoland_popular_lists', []))
+
+
+@receiver(post_save, sender=PostImage)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw and images.needs_derivatives(instance):
+        images.schedule(instance)
+
+
+@receiver(post_delete, sender=PostImage)
+def delete_image_derivatives(sender, instance, **kwargs):
+    images.schedule_deletion(instance)
@@ -0,0 +1,151 @@
+# -*- coding:utf8 -*-
+"""
+Chunked sitemaps for large post archives.
+
+The public posts are split in fixed-size chunks walking the Post ordering
+backwards, so the oldest posts fill the first chunk and new posts only
+change the last one. The chunk boundaries are kept in a small index that
+is rebuilt with one streamed query after the posts change. Each chunk is
+streamed from a QuerySet iterator and cached under its boundaries and its
+newest modification date, so only the chunks holding edited posts are
+rendered again.
+"""
+import hashlib
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.encoding import force_bytes
+from django.views.generic import View
+
+from blogoland import cache
+from blogoland.confs import DEFAULT_SITEMAP_CHUNK_SIZE
+from blogoland.models import Post, Category
+from blogoland.paginators import CursorPaginator
+
+
+SITEMAP_CHUNK_SIZE = getattr(settings, 'BLOGOLAND_SITEMAP_CHUNK_SIZE', DEFAULT_SITEMAP_CHUNK_SIZE)
+
+XML_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n'
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def get_paginator():
+    return CursorPaginator(Post.objects.get_public_posts(), SITEMAP_CHUNK_SIZE)
+
+
+def get_reversed_ordering(paginator):
+    return [name[1:] if name.startswith('-') else '-' + name for name in paginator.ordering]
+
+
+def build_chunk_index():
+    """
+    Returns a list with a (after, lastmod, count) tuple for each chunk.
+    'after' holds the ordering values of the last post of the previous chunk.
+    """
+    paginator = get_paginator()
+    fields = [name.lstrip('-') for name in paginator.ordering]
+    rows = paginator.queryset.order_by(*get_reversed_ordering(paginator)).values_list(
+        'modification_date', *fields).iterator()
+
+    chunks = []
+    after = last = lastmod = None
+    count = 0
+    for row in rows:
+        if count == paginator.per_page:
+            chunks.append((after, lastmod, count))
+            after, lastmod, count = last, None, 0
+        modified, last = row[0], row[1:]
+        if lastmod is None or modified > lastmod:
+            lastmod = modified
+        count += 1
+    if count:
+        chunks.append((after, lastmod, count))
+    return chunks
+
+
+def get_chunk_index():
+    """
+    Returns the chunk index, cached until the posts change.
+    """
+    key = cache.make_key('sitemap_index', [cache.LIST_VERSION], '')
+    chunks = cache.get_cache().get(key)
+    if chunks is None:
+        chunks = build_chunk_index()
+        cache.get_cache().set(key, chunks, cache.get_timeout(Post.objects.get_next_publication_change()))
+    return chunks
+
+
+class SitemapIndexView(View):
+    """
+    Lists the post chunks and the categories sitemap.
+    """
+    def get(self, request, *args, **kwargs):
+        parts = [XML_HEADER, '<sitemapindex xmlns="%s">' % SITEMAP_NS]
+        for number, (after, lastmod, count) in enumerate(get_chunk_index()):
+            loc = request.build_absolute_uri(reverse('blogoland:sitemap_posts', kwargs={'chunk': number}))
+            parts.append('<sitemap><loc>%s</loc><lastmod>%s</lastmod></sitemap>' % (
+                escape(loc), lastmod.isoformat()))
+        loc = request.build_absolute_uri(reverse('blogoland:sitemap_categories'))
+        parts.append('<sitemap><loc>%s</loc></sitemap>' % escape(loc))
+        parts.append('</sitemapindex>')
+        return HttpResponse(''.join(parts), content_type='application/xml; charset=utf-8')
+
+
+class PostSitemapView(View):
+    """
+    Streams the URLs of one chunk of public posts.
+    """
+    def get(self, request, *args, **kwargs):
+        chunks = get_chunk_index()
+        number = int(self.kwargs['chunk'])
+        if number >= len(chunks):
+            raise Http404()
+        after, lastmod, count = chunks[number]
+
+        key = '%s:sitemap_chunk:%s' % (cache.KEY_PREFIX, hashlib.md5(force_bytes(
+            repr((request.build_absolute_uri('/'), after, lastmod.isoformat(), count)))).hexdigest())
+        content = cache.get_cache().get(key)
+        if content is not None:
+            return HttpResponse(content, content_type='application/xml; charset=utf-8')
+        return StreamingHttpResponse(self.stream(key, after, count),
+                                     content_type='application/xml; charset=utf-8')
+
+    def stream(self, key, after, count):
+        """
+        Yields the chunk XML and caches it once complete.
+        """
+        paginator = get_paginator()
+        queryset = paginator.queryset
+        if after is not None:
+            queryset = queryset.filter(paginator.seek_filter(after, reverse=True))
+        rows = queryset.order_by(*get_reversed_ordering(paginator)).values_list(
+            'slug', 'modification_date')[:count].iterator()
+
+        parts = [XML_HEADER + '<urlset xmlns="%s">' % SITEMAP_NS]
+        yield parts[0]
+        for slug, modified in rows:
+            loc = self.request.build_absolute_uri(reverse('blogoland:post_detail', kwargs={'post_slug': slug}))
+            part = '<url><loc>%s</loc><lastmod>%s</lastmod></url>' % (escape(loc), modified.isoformat())
+            parts.append(part)
+            yield part
+        parts.append('</urlset>')
+        yield parts[-1]
+        cache.get_cache().set(key, ''.join(parts), cache.CACHE_TIMEOUT)
+
+
+class CategorySitemapView(View):
+    """
+    Streams the URLs of the categories.
+    """
+    def get(self, request, *args, **kwargs):
+        return StreamingHttpResponse(self.stream(), content_type='application/xml; charset=utf-8')
+
+    def stream(self):
+        yield XML_HEADER + '<urlset xmlns="%s">' % SITEMAP_NS
+        for category in Category.objects.order_by('pk').only('slug', 'modification_date').iterator():
+            loc = self.request.build_absolute_uri(category.get_absolute_url())
+            yield '<url><loc>%s</loc><lastmod>%s</lastmod></url>' % (
+                escape(loc), category.modification_date.isoformat())
+        yield '</urlset>'
@@ -0,0 +1,62 @@
+# -*- coding:utf8 -*-
+"""
+Social media (Open Graph and Twitter Card) metadata of posts.
+"""
+from django.contrib.sites.models import Site
+from django.contrib.sites.shortcuts import get_current_site
+from django.utils.functional import cached_property
+
+from blogoland.instrumentation import timer
+
+
+class SocialMeta(object):
+    """
+    Absolute URLs and texts used by the social media tags of a post. It is
+    built once per post and request, see get_social_meta.
+    """
+    def __init__(self, post, request=None):
+        self.post = post
+        with timer('site'):
+            if request is not None:
+                self.site = get_current_site(request)
+                self.scheme = request.scheme
+            else:
+                self.site = Site.objects.get_current()
+                self.scheme = 'http'
+        self.title = post.seo_title or post.title
+        self.description = post.seo_description or ''
+        self.url = self.build_absolute_url(post.get_absolute_url())
+
+    @cached_property
+    def image(self):
+        return self.post.image_set.get_last_img_type('thumbnail')
+
+    @cached_property
+    def image_url(self):
+        return self.build_absolute_url(self.image.image.url) if self.image else None
+
+    def build_absolute_url(self, path):
+        """
+        Returns the absolute URL of the given path on the current site. URLs
+        that are already absolute, like files on a CDN, are returned as is.
+        """
+        if path.startswith(('http://', 'https://')):
+            return path
+        if path.startswith('//'):
+            return '{0}:{1}'.format(self.scheme, path)
+        return '{0}://{1}{2}'.format(self.scheme, self.site.domain, path)
+
+
+def get_social_meta(context, post):
+    """
+    Returns the SocialMeta of the given post, memoized on the request or on
+    the current render when there's no request in the context.
+    """
+    request = context.get('request')
+    if request is not None:
+        memo = request.__dict__.setdefault('_blogoland_social_meta', {})
+    else:
+        memo = context.render_context.setdefault('_blogoland_social_meta', {})
+    if post.pk not in memo:
+        memo[post.pk] = SocialMeta(post, request)
+    return memo[post.pk]
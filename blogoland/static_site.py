@@ -0,0 +1,291 @@
+# -*- coding:utf8 -*-
+"""
+Static export of the blogoland pages.
+
+The post list, post detail and category pages are rendered by their views,
+with the same templates and tags, as an anonymous request, and written to
+an output directory as '<path>/index.html'. Page N of a list is written to
+'<path>/page/N/index.html', and the paginators link there. The pages are
+rendered on a process pool.
+
+Each page is rendered from inputs that change with the content it shows:
+the modification dates of its posts and their categories, its related
+posts, for category pages the validators of their ETags, and the sidebar
+widgets shared by every page. A manifest in the output directory keeps a hash of the inputs of every page
+and of the templates, so later runs only render the pages whose inputs
+changed and remove the pages that are gone.
+"""
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+
+import django
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.db.models import Max
+from django.template import engines
+from django.test import RequestFactory
+from django.utils.encoding import force_bytes
+
+from blogoland.models import Post, Category, PopularPost, RelatedPost
+from blogoland.overrides import get_loader_dirs
+from blogoland.views import PostListView, PostDetailView, CategoryPostListView, PAGINATION
+
+
+MANIFEST_NAME = '.blogoland-manifest.json'
+
+VIEWS = {
+    'post_list': PostListView,
+    'post_detail': PostDetailView,
+    'category_post_list': CategoryPostListView,
+}
+# The options passed to as_view() for each view: it rejects the attributes
+# a view doesn't have. Lists are exported by page number, and exports are
+# not counted as views.
+VIEW_OPTIONS = {
+    'post_list': {'pagination_mode': 'page', 'page_paths': True},
+    'post_detail': {'count_views': False},
+    'category_post_list': {'pagination_mode': 'page', 'page_paths': True},
+}
+
+
+class Page(object):
+    """
+    A page to export: the view that renders it, its URL arguments and page
+    number, and the hash of its inputs.
+    """
+    def __init__(self, view_name, kwargs, number, inputs):
+        self.view_name = view_name
+        self.kwargs = kwargs
+        self.number = number
+        self.inputs = inputs
+
+    @property
+    def path(self):
+        path = reverse('blogoland:%s' % self.view_name, kwargs=self.kwargs)
+        if self.number > 1:
+            path = '%spage/%s/' % (path, self.number)
+        return path
+
+    @property
+    def file_name(self):
+        return self.path.lstrip('/') + 'index.html'
+
+    def get_job(self):
+        return (self.view_name, self.kwargs, self.number, self.file_name)
+
+
+def hash_inputs(*values):
+    return hashlib.md5(force_bytes(repr(values))).hexdigest()
+
+
+def get_templates_hash():
+    """
+    Returns a hash of the modification times of every template file, so a
+    template change renders every page again.
+    """
+    mtimes = []
+    for engine in engines.all():
+        loaders = getattr(getattr(engine, 'engine', None), 'template_loaders', None) or []
+        for directory in get_loader_dirs(loaders) or []:
+            for root, dirs, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    mtimes.append((path, os.path.getmtime(path)))
+    return hash_inputs(*sorted(mtimes))
+
+
+def get_view(view_name, kwargs, number=1):
+    """
+    Returns the view instance of the given page, set up for an anonymous
+    request.
+    """
+    params = {'page': number} if number > 1 else {}
+    request = RequestFactory().get(reverse('blogoland:%s' % view_name, kwargs=kwargs), params)
+    request.user = AnonymousUser()
+    view = VIEWS[view_name](**VIEW_OPTIONS[view_name])
+    view.request, view.args, view.kwargs = request, (), kwargs
+    return view
+
+
+def get_sidebar_inputs():
+    """
+    Returns the inputs of the sidebar widgets shown on every page: the
+    latest posts, the categories and their counts, and the archive months
+    follow the posts and categories, the popular posts follow their lists.
+    """
+    return hash_inputs(
+        Post.objects.aggregate(modified=Max('modification_date')),
+        Post.objects.count(),
+        Post.objects.get_public_posts().count(),
+        Category.objects.aggregate(modified=Max('modification_date'), posts_modified=Max('posts_modification_date')),
+        list(PopularPost.objects.order_by('category', '-view_count', 'post').values_list('category', 'post')),
+    )
+
+
+def get_related_posts():
+    """
+    Returns the pks of the related posts of each post, best first.
+    """
+    related = {}
+    for post_id, related_id in RelatedPost.objects.order_by('post', '-score').values_list(
+            'post', 'related').iterator():
+        related.setdefault(post_id, []).append(related_id)
+    return related
+
+
+def get_list_pages(view_name, kwargs, count, sidebar=None):
+    """
+    Returns the Pages of a paginated list of the given length. The pages
+    only differ by their query string, so the validators are read once.
+    """
+    validators = get_view(view_name, kwargs).get_validators()
+    pages = []
+    for number in range(1, max(1, int(math.ceil(count / float(PAGINATION)))) + 1):
+        validators['query'] = get_view(view_name, kwargs, number).request.GET.urlencode()
+        pages.append(Page(view_name, kwargs, number, hash_inputs(sorted(validators.items()), sidebar)))
+    return pages
+
+
+def get_post_pages(sidebar=None):
+    """
+    Returns the Pages of the public posts and of the post list, from one
+    query in the list order. A page of the list depends on the posts it
+    shows and on the number of pages.
+    """
+    pages, chunks, chunk = [], [], []
+    related = get_related_posts()
+    # Same validators as PostDetailView.get_validators.
+    rows = Post.objects.get_public_posts().order_by(*Post._meta.ordering).values('pk', 'slug').annotate(
+        category_modified=Max('category__modification_date')).values_list(
+        'pk', 'slug', 'modification_date', 'category_modified')
+    for pk, slug, modified, category_modified in rows.iterator():
+        pages.append(Page('post_detail', {'post_slug': slug}, 1,
+                          hash_inputs(modified, category_modified, related.get(pk), sidebar)))
+        chunk.append((slug, modified, category_modified))
+        if len(chunk) == PAGINATION:
+            chunks.append(hash_inputs(chunk))
+            chunk = []
+    if chunk or not chunks:
+        chunks.append(hash_inputs(chunk))
+    for number, chunk_hash in enumerate(chunks, 1):
+        pages.append(Page('post_list', {}, number, hash_inputs(chunk_hash, len(chunks), sidebar)))
+    return pages
+
+
+def get_pages():
+    """
+    Returns every Page to export.
+    """
+    sidebar = get_sidebar_inputs()
+    pages = get_post_pages(sidebar)
+    for category in Category.objects.order_by('pk'):
+        total, public_count = category.get_post_counts()
+        pages.extend(get_list_pages('category_post_list', {'category_slug': category.slug}, public_count, sidebar))
+    return pages
+
+
+def init_worker():
+    django.setup()
+
+
+def render_in_worker(args):
+    """
+    Renders the page of a job returned by Page.get_job and writes it to the
+    output directory. Returns the file name and an error, if any.
+    """
+    view_name, kwargs, number, file_name, output_dir, host, secure = args
+    try:
+        params = {'page': number} if number > 1 else {}
+        request = RequestFactory().get(
+            reverse('blogoland:%s' % view_name, kwargs=kwargs), params, HTTP_HOST=host, secure=secure)
+        request.user = AnonymousUser()
+        response = VIEWS[view_name].as_view(**VIEW_OPTIONS[view_name])(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        if response.status_code != 200:
+            return file_name, 'status %s' % response.status_code
+        path = os.path.join(output_dir, file_name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.tmp', 'wb') as output:
+            output.write(response.content)
+        os.rename(path + '.tmp', path)
+        return file_name, None
+    except Exception as error:
+        return file_name, repr(error)
+
+
+def read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as manifest:
+            return json.load(manifest)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as output:
+        json.dump(manifest, output, indent=0, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def build(output_dir, workers=None, full=False, scheme='https', host=None, log=None):
+    """
+    Renders the changed pages into output_dir and removes the pages that
+    are gone. With one worker the pages are rendered in this process.
+    Returns the number of rendered, removed and failed pages.
+    """
+    log = log or (lambda message: None)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    host = host or Site.objects.get_current().domain
+
+    manifest = read_manifest(output_dir)
+    old_pages = manifest.get('pages', {})
+    templates_hash = get_templates_hash()
+    render_all = full or manifest.get('templates') != templates_hash
+
+    pages = get_pages()
+    new_pages = dict((page.file_name, page.inputs) for page in pages)
+    jobs = [page.get_job() + (output_dir, host, scheme == 'https')
+            for page in pages if render_all or old_pages.get(page.file_name) != page.inputs]
+    log('%s pages, %s to render.' % (len(pages), len(jobs)))
+
+    failed = []
+    pool = None
+    if jobs and workers != 1:
+        # The workers open their own database connections.
+        connections.close_all()
+        pool = multiprocessing.Pool(processes=workers or multiprocessing.cpu_count(), initializer=init_worker)
+    try:
+        results = pool.imap_unordered(render_in_worker, jobs, 20) if pool else (render_in_worker(job) for job in jobs)
+        for done, (file_name, error) in enumerate(results, 1):
+            if error:
+                failed.append(file_name)
+                log('%s failed: %s' % (file_name, error))
+            if done % 500 == 0:
+                log('%s pages rendered.' % done)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    removed = 0
+    for file_name in set(old_pages) - set(new_pages):
+        try:
+            os.remove(os.path.join(output_dir, file_name))
+            removed += 1
+        except OSError:
+            pass
+
+    # Failed pages are rendered again on the next run.
+    for file_name in failed:
+        new_pages.pop(file_name, None)
+    write_manifest(output_dir, {'templates': templates_hash, 'pages': new_pages})
+    return len(jobs) - len(failed), removed, len(failed)
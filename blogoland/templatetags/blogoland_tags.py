@@ -1,12 +1,16 @@
 # *-* coding=utf-8 *-*
 from django import template
+from django.core.urlresolvers import reverse
 from django.conf import settings
-from django.contrib.sites.models import Site
 from django.utils.html import format_html, mark_safe, strip_tags
 from django.utils.text import capfirst, Truncator
 
 from blogoland.confs import DEFAULT_DATE_FORMAT
-from blogoland.models import Post, Category
+from blogoland.images import IMAGE_SIZES
+from blogoland.instrumentation import instrument_library
+from blogoland import routers, widgets
+from blogoland.models import Post, EXCERPT_WORDS
+from blogoland.social import get_social_meta
 
 register = template.Library()
 
@@ -16,11 +20,34 @@ DATE_FORMAT = getattr(settings, 'BLOGOLAND_DATE_FORMAT', DEFAULT_DATE_FORMAT)
 # Helper function
 def build_img_tag(img):
     """
-    Build a HTML Img TAG with the given img object.
+    Build a HTML Img TAG with the given img object. When the resized
+    derivatives of the image are available the tag gets srcset, sizes,
+    width and height attributes, and a WebP source inside a picture tag.
     """
-
-    img_tag = '<img src="{0}" alt="{1}" />'.format(img.image.url, img.title)
-    return mark_safe(img_tag)
+    derivatives = img.get_derivatives().get('derivatives')
+    if not derivatives:
+        img_tag = '<img src="{0}" alt="{1}" />'.format(img.image.url, img.title)
+        return mark_safe(img_tag)
+
+    storage = img.image.storage
+    sizes = IMAGE_SIZES.get(img.img_type) or IMAGE_SIZES.get('default', '100vw')
+    webp = [d for d in derivatives if d['format'] == 'webp']
+    fallback = [d for d in derivatives if d['format'] != 'webp'] or webp
+    largest = fallback[-1]
+
+    def srcset(items):
+        return ', '.join('{0} {1}w'.format(storage.url(d['name']), d['width']) for d in items)
+
+    img_tag = format_html(
+        '<img src="{0}" srcset="{1}" sizes="{2}" width="{3}" height="{4}" alt="{5}" />',
+        storage.url(largest['name']), srcset(fallback), sizes, largest['width'], largest['height'], img.title,
+    )
+    if webp and fallback is not webp:
+        img_tag = format_html(
+            '<picture><source type="image/webp" srcset="{0}" sizes="{1}" />{2}</picture>',
+            srcset(webp), sizes, img_tag,
+        )
+    return img_tag
 
 
 @register.simple_tag(takes_context=True)
@@ -52,24 +79,31 @@ def post_date(context):
 def post_content(context):
     """
     Check if the given instance wrapped in the context is a Post one. Then 
-    parse the content of the post to HTML.
+    returns the content of the post parsed to HTML on save.
     """
     try:
         post = context['object']
         if isinstance(post, Post):
+            if post.rendered_content is not None:
+                return mark_safe(post.rendered_content)
             return format_html(post.content)
     except:
         return ''
 
 
 @register.simple_tag(takes_context=True)
-def post_excerpt(context, word_limit=10):
+def post_excerpt(context, word_limit=EXCERPT_WORDS):
     """
-    Returns the excerpt of the post. Strips the HTML tags and truncate the
-    words by the given limit.
+    Returns the excerpt of the post. Uses the excerpt stored on save when
+    the limit matches, otherwise truncates the stored plain text by the given
+    limit.
     """
     post = context['object']
-    return Truncator(strip_tags(post.content)).words(word_limit)
+    if post.plain_content is None:
+        return Truncator(strip_tags(post.content)).words(word_limit)
+    if word_limit == EXCERPT_WORDS:
+        return post.excerpt
+    return Truncator(post.plain_content).words(word_limit)
 
 
 @register.simple_tag(takes_context=True)
@@ -115,17 +149,82 @@ def get_post_gallery_images(context):
 @register.simple_tag
 def get_latest_posts(post_limit=None):
     """
-    Returns a Qs of the latest public post sliced by limit.
+    Returns the latest public posts sliced by limit, as read-only snapshots
+    cached in process memory.
     """
-    return Post.objects.get_public_posts()[:post_limit]
+    return widgets.get_latest_posts(post_limit)
 
 
 @register.simple_tag
 def get_category_list(cat_limit=None):
     """
-    Return a QuerySet of Category object and can be sliced by limit.
+    Returns the categories sliced by limit, as read-only snapshots cached
+    in process memory.
+    """
+    return widgets.get_category_list(cat_limit)
+
+
+@register.simple_tag
+def get_category_list_with_counts(cat_limit=None):
+    """
+    Returns the categories sliced by limit with their post_count and
+    public_post_count, from the counts stored on each category.
+    """
+    return widgets.get_category_list_with_counts(cat_limit)
+
+
+@register.simple_tag
+def get_related_posts(post, limit=5):
+    """
+    Returns a QuerySet of the public posts most related to the given post,
+    best first, from the precomputed related posts.
+    """
+    return Post.objects.db_manager(routers.get_read_db(Post)).get_public_posts().filter(
+        related_to_set__post=post).order_by('-related_to_set__score')[:limit]
+
+
+@register.simple_tag
+def get_popular_posts(category=None, limit=5):
+    """
+    Returns a QuerySet of the most viewed public posts, overall or in the
+    given category (or category pk), from the precomputed popular posts.
+    """
+    queryset = Post.objects.db_manager(routers.get_read_db(Post)).get_public_posts()
+    if category is None:
+        queryset = queryset.filter(popular_set__isnull=False, popular_set__category__isnull=True)
+    else:
+        # Posts removed from the category stay in its list until rebuilt.
+        category = getattr(category, 'pk', category)
+        queryset = queryset.filter(popular_set__category=category, category=category)
+    return queryset.order_by('-popular_set__view_count', 'pk')[:limit]
+
+
+@register.inclusion_tag('blogoland/snippets/archive_list.html', takes_context=True)
+def archive_list(context, category=None):
     """
-    return Category.objects.all()[:cat_limit]
+    Renders the months with posts grouped by year, newest first, from the
+    archive index. Given a category, its archive is listed.
+    """
+    user = getattr(context.get('request'), 'user', None)
+    staff = user is not None and user.is_staff
+    kwargs = {'category_slug': category.slug} if category is not None else {}
+    prefix = 'blogoland:category_archive' if category is not None else 'blogoland:archive'
+    years = []
+    for date, count in widgets.get_archive_months(category, staff):
+        if not years or years[-1]['year'] != date.year:
+            years.append({
+                'year': date.year,
+                'count': 0,
+                'url': reverse(prefix + '_year', kwargs=dict(kwargs, year='%04d' % date.year)),
+                'months': [],
+            })
+        years[-1]['count'] += count
+        years[-1]['months'].append({
+            'date': date,
+            'count': count,
+            'url': reverse(prefix + '_month', kwargs=dict(kwargs, year='%04d' % date.year, month='%02d' % date.month)),
+        })
+    return {'archive_years': years, 'category': category}
 
 
 @register.simple_tag(takes_context=True)
@@ -133,11 +232,9 @@ def social_media_image_url(context):
     """
     Returns the thumbnail URL built to be used in Open Graph tags.
     """
-    site = Site.objects.get_current()
     try:
         post = context['object']
-        img = post.image_set.get_last_img_type('thumbnail')
-        return 'http://{0}{1}'.format(site.domain, img.image.url)
+        return get_social_meta(context, post).image_url
     except:
         return
 
@@ -147,18 +244,45 @@ def social_media_post_url(context):
     """
     Returns the post's URL built to be used on Open Graph and Twitter Card.
     """
-    site = Site.objects.get_current()
     try:
         post = context['object']
-        return 'http://{0}{1}'.format(site.domain, post.get_absolute_url())
+        return get_social_meta(context, post).url
     except:
         return
 
 
+@register.inclusion_tag('blogoland/snippets/social_meta.html', takes_context=True)
+def post_social_meta(context):
+    """
+    Renders the Open Graph and Twitter Card meta tags of the post in one pass.
+    """
+    post = context.get('object')
+    if not isinstance(post, Post):
+        return {'meta': None}
+    return {'meta': get_social_meta(context, post)}
+
+
+@register.simple_tag(takes_context=True)
+def page_url(context, number):
+    """
+    Returns the link to the given page number of a list: '?page=N', or
+    '<path>page/N/' when the list is rendered for the static export.
+    """
+    path = context.get('blogoland_page_path')
+    if not path:
+        return '?page=%s' % number
+    return path if number == 1 else '%spage/%s/' % (path, number)
+
+
 @register.inclusion_tag('blogoland/snippets/paginator.html', takes_context=True)
 def paginator(context):
     """
     Template tag to easy including the pagination in template. This tag, only
-    pass the context to the default template.
+    pass the context to the default template, which renders page numbers or
+    cursor links depending on the 'blogoland_pagination_mode'.
     """
     return context
+
+
+# Must stay at the bottom, once every tag is registered.
+instrument_library(register)
@@ -0,0 +1,66 @@
+# -*- coding:utf8 -*-
+"""
+Settings to run the blogoland tests:
+
+    DJANGO_SETTINGS_MODULE=blogoland.test_settings django-admin test blogoland
+
+They serve the benchmark URLs and templates, which the query budget tests
+measure. The second SQLite database enables the replica routing tests, and
+the benchmarks count the queries of both.
+"""
+import os
+import tempfile
+
+BASE_DIR = tempfile.gettempdir()
+
+SECRET_KEY = 'blogoland-tests'
+DEBUG = False
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.sites',
+    'django_summernote',
+    'blogoland',
+]
+
+MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'blogoland-default.sqlite3'),
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'blogoland-replica.sqlite3'),
+    },
+}
+
+# The benchmark URLs and templates serve the views under test.
+ROOT_URLCONF = 'blogoland.benchmark'
+
+SITE_ID = 1
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+MEDIA_ROOT = os.path.join(BASE_DIR, 'blogoland-media')
@@ -1,3 +1,1444 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import logging.handlers
+import os
+import re
+import shutil
+import tempfile
+import time
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import site
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sites.models import Site
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models.signals import post_delete
+from django.http import Http404, HttpResponse
+from django.template import RequestContext, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date
+from PIL import Image
+
+from blogoland import (
+    archive, benchmark, cache, feeds, images, instrumentation, overrides, popular, related, routers, search, sitemaps,
+    static_site, widgets,
+)
+from blogoland.admin import PostAdmin, PostChangeList
+from blogoland.templatetags.blogoland_tags import build_img_tag, get_popular_posts
+from blogoland.models import ArchiveMonth, Post, PostImage, Category, PopularPost, RelatedPost, TermFrequency
+from blogoland.paginators import CursorPaginator, InvalidCursor
+from blogoland.views import PAGINATION, PostDetailView, PostListView
+
+
+def explain(queryset):
+    """
+    Returns the query plan of the given QuerySet as a single string. On
+    PostgreSQL sorts and sequential scans are discouraged so the tiny test
+    tables don't hide a missing index.
+    """
+    sql, params = queryset.query.sql_with_params()
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+        cursor.execute(prefix + sql, params)
+        return '\n'.join(' '.join(str(col) for col in row) for row in cursor.fetchall())
+
+
+def is_sorting(plan):
+    """
+    Checks if the query plan sorts the rows instead of reading them in
+    index order.
+    """
+    if connection.vendor == 'sqlite':
+        return 'TEMP B-TREE' in plan
+    return 'Sort' in plan
+
+
+class QueryPlanTests(TestCase):
+    """
+    The list queries must be served in index order, without a sort step.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Category', slug='category')
+        today = datetime.date.today()
+        for i in range(30):
+            post = Post.objects.create(
+                title='Post %s' % i,
+                slug='post-%s' % i,
+                content='<p>Content %s</p>' % i,
+                publication_date=today - datetime.timedelta(days=i),
+                is_visible=bool(i % 3),
+            )
+            post.category.add(category)
+        cls.category = category
+
+    def test_public_posts_are_not_sorted(self):
+        plan = explain(Post.objects.get_public_posts()[:15])
+        self.assertFalse(is_sorting(plan), plan)
+
+    def test_all_posts_are_not_sorted(self):
+        plan = explain(Post.objects.all()[:15])
+        self.assertFalse(is_sorting(plan), plan)
+
+    def test_category_posts_are_not_sorted(self):
+        plan = explain(Post.objects.get_public_posts().filter(category=self.category)[:15])
+        self.assertFalse(is_sorting(plan), plan)
+
+    def test_last_img_type_uses_index(self):
+        post = Post.objects.first()
+        plan = explain(PostImage.objects.filter(post=post, img_type='detail').order_by('-pk')[:1])
+        self.assertFalse(is_sorting(plan), plan)
+
+
+@override_settings(**benchmark.BENCHMARK_SETTINGS)
+class QueryBudgetTests(TestCase):
+    """
+    Every benchmarked view, paginator and tag must stay within its query
+    budget, so N+1 queries fail the build.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        benchmark.seed(posts=60, categories=4, images_per_post=3)
+
+    def test_every_scenario_has_a_budget(self):
+        names = [name for name, func in benchmark.get_scenarios()]
+        self.assertEqual(sorted(names), sorted(benchmark.BUDGETS))
+
+    def test_query_budgets(self):
+        for name, func in benchmark.get_scenarios():
+            result = benchmark.measure(func)
+            self.assertLessEqual(
+                result['queries'], benchmark.BUDGETS[name],
+                '%s ran %s queries, budget is %s' % (name, result['queries'], benchmark.BUDGETS[name]))
+
+
+class WidgetCacheTests(TestCase):
+    """
+    The sidebar tags are served from process memory until a post or a
+    category changes.
+    """
+    def setUp(self):
+        widgets.local_cache.clear()
+        self.post = Post.objects.create(title='Cached', slug='cached', content='<p>Cached</p>')
+
+    def test_latest_posts_are_cached(self):
+        self.assertEqual([post.slug for post in widgets.get_latest_posts(5)], ['cached'])
+        with self.assertNumQueries(0):
+            self.assertEqual([post.title for post in widgets.get_latest_posts(5)], ['Cached'])
+
+    def test_saving_a_post_invalidates_the_latest_posts(self):
+        widgets.get_latest_posts(5)
+        self.post.title = 'Edited'
+        self.post.save()
+        self.assertEqual([post.title for post in widgets.get_latest_posts(5)], ['Edited'])
+
+    def test_saving_a_category_invalidates_the_category_list(self):
+        self.assertEqual(widgets.get_category_list(), ())
+        Category.objects.create(title='News', slug='news')
+        self.assertEqual([category.slug for category in widgets.get_category_list()], ['news'])
+
+    def test_least_recently_used_entry_is_evicted(self):
+        local_cache = cache.LocalCache(2)
+        local_cache.set('a', 1, 'A', 60)
+        local_cache.set('b', 1, 'B', 60)
+        local_cache.get('a', 1)
+        local_cache.set('c', 1, 'C', 60)
+        self.assertEqual(local_cache.get('a', 1), 'A')
+        self.assertIsNone(local_cache.get('b', 1))
+        self.assertIsNone(local_cache.get('a', 2))
+
+
+class TemplateOverrideTests(TestCase):
+    """
+    Per-slug templates are only tried when they exist.
+    """
+    def tearDown(self):
+        overrides.reset()
+
+    @override_settings(**benchmark.BENCHMARK_SETTINGS)
+    def test_missing_override_is_skipped(self):
+        self.assertEqual(overrides.select_templates('blogoland/post_missing.html', 'blogoland/post_detail.html'),
+                         ['blogoland/post_detail.html'])
+
+    @override_settings(TEMPLATES=[{
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'OPTIONS': {'loaders': [('django.template.loaders.locmem.Loader', {})]},
+    }])
+    def test_unlisted_loaders_try_every_override(self):
+        self.assertEqual(overrides.select_templates('blogoland/post_missing.html', 'blogoland/post_detail.html'),
+                         ['blogoland/post_missing.html', 'blogoland/post_detail.html'])
+
+
+class CategoryPostCountTests(TestCase):
+    """
+    The post counts stored on the categories follow the posts.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(title='News', slug='news')
+        self.post = Post.objects.create(title='Public', slug='public', content='<p>Public</p>')
+        self.scheduled = Post.objects.create(title='Scheduled', slug='scheduled', content='<p>Scheduled</p>',
+                                             publication_date=datetime.date.today() + datetime.timedelta(days=1))
+
+    def get_counts(self):
+        return Category.objects.get(pk=self.category.pk).get_post_counts()
+
+    def test_adding_and_removing_posts(self):
+        self.category.post_set.add(self.post, self.scheduled)
+        self.assertEqual(self.get_counts(), (2, 1))
+        self.post.category.remove(self.category)
+        self.assertEqual(self.get_counts(), (1, 0))
+        self.scheduled.category.clear()
+        self.assertEqual(self.get_counts(), (0, 0))
+
+    def test_hiding_and_deleting_posts(self):
+        self.post.category.add(self.category)
+        self.post.is_visible = False
+        self.post.save()
+        self.assertEqual(self.get_counts(), (1, 0))
+        self.post.delete()
+        self.assertEqual(self.get_counts(), (0, 0))
+
+    def test_stored_counts_are_used(self):
+        self.post.category.add(self.category)
+        category = Category.objects.get(pk=self.category.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(category.get_post_counts(), (1, 1))
+
+    def test_counts_of_another_day_are_recounted(self):
+        self.post.category.add(self.category)
+        Category.objects.update(public_post_count=5, post_count_date=datetime.date.today() - datetime.timedelta(days=1))
+        self.assertEqual(self.get_counts(), (1, 1))
+
+    def test_counts_are_stored_with_one_update(self):
+        self.category.post_set.add(self.post, self.scheduled)
+        empty = Category.objects.create(title='Empty', slug='empty')
+        Category.objects.update(post_count=5, public_post_count=5, post_count_date=None)
+        with self.assertNumQueries(1):
+            self.assertEqual(Category.objects.update_post_counts(), 2)
+        self.assertEqual(Category.objects.get(pk=self.category.pk).get_post_counts(), (2, 1))
+        self.assertEqual(Category.objects.get(pk=empty.pk).get_post_counts(), (0, 0))
+
+    def test_saving_a_category_stores_its_counts(self):
+        self.category.post_set.add(self.post, self.scheduled)
+        Category.objects.update(post_count=5, public_post_count=5, post_count_date=None)
+        category = Category.objects.get(pk=self.category.pk)
+        category.title = 'Updates'
+        category.save()
+        self.assertEqual(Category.objects.values_list('post_count', 'public_post_count', 'post_count_date').get(),
+                         (2, 1, datetime.date.today()))
+
+    @override_settings(**benchmark.BENCHMARK_SETTINGS)
+    def test_first_read_of_a_day_stores_the_counts(self):
+        self.post.category.add(self.category)
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        Category.objects.update(public_post_count=5, post_count_date=yesterday)
+        widgets.local_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_counts(), (1, 1))
+        self.assertEqual(len([query for query in context.captured_queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(Category.objects.values_list('public_post_count', 'post_count_date').get(),
+                         (1, datetime.date.today()))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_counts(), (1, 1))
+            self.assertEqual([category.public_post_count for category in widgets.get_category_list_with_counts()],
+                             [1])
+            self.assertContains(self.client.get('/api/categories/news/', {'fields': 'post_count'}),
+                                '{"post_count": 1}')
+            self.assertContains(self.client.get('/category/news/'), 'Public')
+        self.assertFalse([query for query in context.captured_queries if not query['sql'].startswith('SELECT')])
+
+    def test_widget_and_api_store_stale_counts(self):
+        self.post.category.add(self.category)
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        Category.objects.update(public_post_count=5, post_count_date=yesterday)
+        widgets.local_cache.clear()
+        self.assertEqual([category.public_post_count for category in widgets.get_category_list_with_counts()], [1])
+        self.assertEqual(Category.objects.values_list('post_count_date', flat=True).get(), datetime.date.today())
+        Category.objects.update(public_post_count=5, post_count_date=yesterday)
+        self.assertContains(self.client.get('/api/categories/', {'fields': 'slug,post_count'}), '"post_count":1')
+        self.assertEqual(Category.objects.values_list('public_post_count', 'post_count_date').get(),
+                         (1, datetime.date.today()))
+
+
+class ArchiveIndexTests(TestCase):
+    """
+    The archive index follows the posts and their categories.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(title='News', slug='news')
+        self.post = Post.objects.create(title='Old', slug='old', content='<p>Old</p>',
+                                        publication_date=datetime.date(2016, 8, 30))
+
+    def test_saved_posts_are_counted(self):
+        self.assertEqual(archive.get_months(), [(datetime.date(2016, 8, 1), 1)])
+        self.post.category.add(self.category)
+        self.assertEqual(archive.get_months(self.category), [(datetime.date(2016, 8, 1), 1)])
+
+    def test_moved_and_deleted_posts_are_recounted(self):
+        self.post.category.add(self.category)
+        self.post.publication_date = datetime.date(2017, 1, 2)
+        self.post.save()
+        self.assertEqual(archive.get_months(self.category), [(datetime.date(2017, 1, 1), 1)])
+        self.post.delete()
+        self.assertEqual(archive.get_months(), [])
+
+    def test_scheduled_posts_are_only_counted_for_staff(self):
+        Post.objects.create(title='Scheduled', slug='scheduled', content='<p>Scheduled</p>',
+                            publication_date=datetime.date.today() + datetime.timedelta(days=40))
+        self.assertEqual(len(archive.get_months()), 1)
+        self.assertEqual(len(archive.get_months(staff=True)), 2)
+
+    def test_archive_is_read_without_posts(self):
+        archive.get_months()
+        with self.assertNumQueries(1):
+            self.assertEqual(archive.get_post_count(2016, 8), 1)
+
+    def test_stale_months_are_counted_without_writes(self):
+        today = datetime.date.today()
+        post = Post.objects.create(title='Scheduled', slug='scheduled', content='<p>Scheduled</p>',
+                                   publication_date=today)
+        post.category.add(self.category)
+        # As counted yesterday, when the post was still scheduled.
+        month = datetime.date(today.year, today.month, 1)
+        ArchiveMonth.objects.filter(year=month.year, month=month.month).update(
+            public_post_count=0, count_date=today - datetime.timedelta(days=1))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(archive.get_months(), [(month, 1), (datetime.date(2016, 8, 1), 1)])
+            self.assertEqual(archive.get_months(self.category), [(month, 1)])
+        self.assertFalse([query for query in context.captured_queries if not query['sql'].startswith('SELECT')])
+        self.assertEqual(ArchiveMonth.objects.filter(public_post_count=0).count(), 2)
+        self.assertEqual(archive.recount_stale(), 1)
+        self.assertFalse(ArchiveMonth.objects.filter(public_post_count=0).exists())
+
+
+class RelatedPostTests(TestCase):
+    """
+    Related posts are ranked by shared terms and categories.
+    """
+    def setUp(self):
+        self.django = Post.objects.create(title='Django caching', slug='django-caching',
+                                          content='<p>Caching django views and querysets</p>')
+        self.orm = Post.objects.create(title='Django querysets', slug='django-querysets',
+                                       content='<p>Prefetching querysets in django views</p>')
+        self.pasta = Post.objects.create(title='Pasta', slug='pasta', content='<p>Boiling water for the pasta</p>')
+
+    def get_related(self, post):
+        return list(RelatedPost.objects.filter(post=post).order_by('-score').values_list('related', flat=True))
+
+    def test_rebuild(self):
+        related.rebuild()
+        self.assertEqual(self.get_related(self.django), [self.orm.pk])
+        self.assertEqual(self.get_related(self.pasta), [])
+
+    def test_update_recomputes_the_neighbours(self):
+        related.rebuild()
+        self.pasta.title = 'Caching pasta'
+        self.pasta.save()
+        related.update([self.pasta.pk])
+        self.assertIn(self.pasta.pk, self.get_related(self.django))
+        self.assertIn(self.django.pk, self.get_related(self.pasta))
+
+    def test_hidden_posts_are_not_related(self):
+        self.orm.is_visible = False
+        self.orm.save()
+        related.rebuild()
+        self.assertEqual(self.get_related(self.django), [])
+
+    def get_frequency(self, term):
+        return TermFrequency.objects.get(term=term).post_count
+
+    def test_update_counts_the_terms(self):
+        related.rebuild()
+        self.assertEqual(self.get_frequency('querysets'), 2)
+        self.assertEqual(self.get_frequency(related.TOTAL), 3)
+        self.pasta.title = 'Pasta querysets'
+        self.pasta.save()
+        related.update([self.pasta.pk])
+        self.assertEqual(self.get_frequency('querysets'), 3)
+        self.pasta.delete()
+        self.assertEqual(self.get_frequency('querysets'), 2)
+        self.assertEqual(self.get_frequency(related.TOTAL), 2)
+
+    def test_update_only_loads_the_posts_sharing_terms(self):
+        related.rebuild()
+        index = related.load_index([self.django.pk])
+        self.assertEqual(index.visible, set([self.django.pk, self.orm.pk]))
+
+    def test_schedule_runs_one_update_per_transaction(self):
+        def get_pending():
+            return [callback for savepoint_ids, callback in connection.run_on_commit
+                    if isinstance(callback, related.PendingUpdate)]
+
+        related.rebuild()
+        # Leaves the update scheduled by setUp alone.
+        setattr(connection, related.PENDING_ATTR, None)
+        try:
+            with transaction.atomic():
+                self.orm.save()
+                rolled_back = getattr(connection, related.PENDING_ATTR)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertNotIn(rolled_back, get_pending())
+
+        with transaction.atomic():
+            self.pasta.save()
+            self.pasta.category.add(Category.objects.create(title='Food', slug='food'))
+            self.orm.delete()
+        pending = getattr(connection, related.PENDING_ATTR)
+        self.assertEqual(get_pending().count(pending), 1)
+        self.assertEqual(pending.post_ids, set([self.pasta.pk]))
+        self.assertEqual(pending.listed_by, set([self.django.pk]))
+
+
+class PopularPostTests(TestCase):
+    """
+    Post views are buffered, written in batches and merged into the popular
+    lists.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(title='News', slug='news')
+        self.first = Post.objects.create(title='First', slug='first', content='<p>First</p>')
+        self.second = Post.objects.create(title='Second', slug='second', content='<p>Second</p>')
+        self.first.category.add(self.category)
+        self.buffer = popular.ViewBuffer(60)
+
+    def get_popular(self, category=None):
+        return [post.slug for post in get_popular_posts(category)]
+
+    def test_views_are_buffered(self):
+        with self.assertNumQueries(0):
+            for slug in ('first', 'first', 'second'):
+                self.buffer.hit(slug)
+        self.buffer.flush()
+        self.assertEqual(dict(Post.objects.values_list('slug', 'view_count')), {'first': 2, 'second': 1})
+        self.assertEqual(self.get_popular(), ['first', 'second'])
+        self.assertEqual(self.get_popular(self.category), ['first'])
+
+    def test_later_views_are_merged(self):
+        self.buffer.hit('first')
+        self.buffer.flush()
+        for _ in range(3):
+            self.buffer.hit('second')
+        self.buffer.flush()
+        self.assertEqual(self.get_popular(), ['second', 'first'])
+
+    def test_hidden_and_deleted_posts_are_replaced(self):
+        self.addCleanup(setattr, popular, 'POPULAR_POSTS', popular.POPULAR_POSTS)
+        popular.POPULAR_POSTS = 2
+        Post.objects.create(title='Third', slug='third', content='<p>Third</p>')
+        Post.objects.create(title='Fourth', slug='fourth', content='<p>Fourth</p>')
+        for slug, views in (('first', 4), ('second', 3), ('third', 2), ('fourth', 1)):
+            for _ in range(views):
+                self.buffer.hit(slug)
+        self.buffer.flush()
+        self.assertEqual(self.get_popular(), ['first', 'second'])
+        self.first.is_visible = False
+        self.first.save()
+        self.buffer.hit('fourth')
+        self.buffer.flush()
+        self.assertEqual(self.get_popular(), ['second', 'third'])
+        self.second.delete()
+        self.assertEqual(self.get_popular(), ['third', 'fourth'])
+
+    def test_rebuild(self):
+        Post.objects.filter(pk=self.second.pk).update(view_count=5)
+        popular.rebuild()
+        self.assertEqual(self.get_popular(), ['second'])
+        self.assertEqual(self.get_popular(self.category), [])
+
+
+@override_settings(**benchmark.BENCHMARK_SETTINGS)
+class StaticSiteTests(TestCase):
+    """
+    The static export only renders the pages whose inputs changed.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(title='News', slug='news')
+        self.post = Post.objects.create(title='First', slug='first', content='<p>First</p>')
+        self.other = Post.objects.create(title='Other', slug='other', content='<p>Other</p>')
+        self.post.category.add(self.category)
+
+    def get_inputs(self):
+        return dict((page.file_name, page.inputs) for page in static_site.get_pages())
+
+    def test_pages(self):
+        self.assertEqual(sorted(self.get_inputs()), ['category/news/index.html', 'first/index.html',
+                                                     'index.html', 'other/index.html'])
+
+    def get_changed(self, before):
+        after = self.get_inputs()
+        return sorted(name for name in after if after[name] != before.get(name))
+
+    def test_only_changed_pages_get_new_inputs(self):
+        before = self.get_inputs()
+        RelatedPost.objects.create(post=self.post, related=self.other, score=1)
+        self.assertEqual(self.get_changed(before), ['first/index.html'])
+
+    def test_sidebar_changes_change_every_page(self):
+        before = self.get_inputs()
+        self.other.title = 'Edited'
+        self.other.save()
+        self.assertEqual(len(self.get_changed(before)), 4)
+        before = self.get_inputs()
+        PopularPost.objects.create(post=self.other, view_count=1)
+        self.assertEqual(len(self.get_changed(before)), 4)
+
+    def test_post_pages_read_the_posts_once(self):
+        for number in range(PAGINATION):
+            Post.objects.create(title='Post %s' % number, slug='post-%s' % number, content='<p>Post</p>')
+        with CaptureQueriesContext(connection) as queries:
+            pages = [page for page in static_site.get_post_pages() if page.view_name == 'post_list']
+        self.assertEqual([page.file_name for page in pages], ['index.html', 'page/2/index.html'])
+        self.assertNotEqual(pages[0].inputs, pages[1].inputs)
+        # The posts and their related posts.
+        self.assertEqual(len(queries), 2)
+
+    def test_post_list_pages_follow_their_posts(self):
+        for number in range(PAGINATION):
+            Post.objects.create(title='Post %s' % number, slug='post-%s' % number, content='<p>Post</p>',
+                                publication_date=datetime.date.today() - datetime.timedelta(days=1))
+        before = dict((page.file_name, page.inputs) for page in static_site.get_post_pages())
+        self.post.is_visible = False
+        self.post.save()
+        after = dict((page.file_name, page.inputs) for page in static_site.get_post_pages())
+        # A post of the second page moves up to the first one.
+        self.assertNotEqual(after['index.html'], before['index.html'])
+        self.assertNotEqual(after['page/2/index.html'], before['page/2/index.html'])
+        self.assertNotIn('first/index.html', after)
+
+    def test_build(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        self.assertEqual(static_site.build(output_dir, workers=1, host='testserver'), (4, 0, 0))
+        for file_name in ('index.html', 'first/index.html', 'category/news/index.html'):
+            self.assertTrue(os.path.isfile(os.path.join(output_dir, file_name)))
+        self.assertEqual(static_site.build(output_dir, workers=1, host='testserver'), (0, 0, 0))
+
+    def test_paginators_link_the_exported_pages(self):
+        for number in range(PAGINATION):
+            Post.objects.create(title='Post %s' % number, slug='post-%s' % number, content='<p>Post</p>')
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        static_site.build(output_dir, workers=1, host='testserver')
+        with open(os.path.join(output_dir, 'index.html')) as first_page:
+            self.assertIn('href="/page/2/"', first_page.read())
+        with open(os.path.join(output_dir, 'page', '2', 'index.html')) as second_page:
+            content = second_page.read()
+        self.assertIn('href="/"', content)
+        self.assertNotIn('?page=', content)
+        self.assertContains(self.client.get('/'), 'href="?page=2"')
+
+
+@override_settings(**benchmark.BENCHMARK_SETTINGS)
+class ApiTests(TestCase):
+    """
+    The JSON API returns the requested fields and answers conditional
+    requests.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(title='News', slug='news')
+        for number in range(3):
+            post = Post.objects.create(title='Post %s' % number, slug='post-%s' % number,
+                                       content='<p>Content %s</p>' % number,
+                                       publication_date=datetime.date(2018, 1, number + 1))
+            post.category.add(self.category)
+        Post.objects.create(title='Hidden', slug='hidden', content='<p>Hidden</p>', is_visible=False)
+
+    def get_json(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content).decode('utf-8') if response.streaming
+                          else response.content.decode('utf-8'))
+
+    def test_fields(self):
+        data = self.get_json('/api/posts/', fields='slug,categories')
+        self.assertEqual(data['results'][0], {'slug': 'post-2', 'categories': [
+            {'slug': 'news', 'title': 'News', 'url': 'http://testserver/category/news/'}]})
+
+    def test_unknown_fields(self):
+        self.assertEqual(self.client.get('/api/posts/', {'fields': 'password'}).status_code, 400)
+
+    def test_cursor_pagination(self):
+        first = self.get_json('/api/posts/', fields='slug', limit=2)
+        self.assertEqual([post['slug'] for post in first['results']], ['post-2', 'post-1'])
+        second = self.get_json(first['next'])
+        self.assertEqual([post['slug'] for post in second['results']], ['post-0'])
+        self.assertIsNone(second['next'])
+
+    def test_hidden_post(self):
+        self.assertEqual(self.client.get('/api/posts/hidden/').status_code, 404)
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/posts/post-0/')
+        response = self.client.get('/api/posts/post-0/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_category_post_count(self):
+        self.assertEqual(self.get_json('/api/categories/news/', fields='post_count'), {'post_count': 3})
+
+
+class PostAdminTests(TestCase):
+    """
+    The Post changelist runs the same queries whatever the number of posts.
+    """
+    def setUp(self):
+        self.model_admin = PostAdmin(Post, site)
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.category = Category.objects.create(title='News', slug='news')
+        self.add_posts(2)
+
+    def add_posts(self, count):
+        start = Post.objects.count()
+        for number in range(start, start + count):
+            post = Post.objects.create(title='Post %s' % number, slug='post-%s' % number,
+                                       content='<p>Post %s</p>' % number, is_visible=bool(number % 2))
+            post.category.add(self.category)
+
+    def get_rows(self, **params):
+        request = RequestFactory().get('/admin/blogoland/post/', params)
+        request.user = self.user
+        model_admin = self.model_admin
+        list_display = model_admin.get_list_display(request)
+        changelist = PostChangeList(
+            request, Post, list_display, model_admin.get_list_display_links(request, list_display),
+            model_admin.get_list_filter(request), model_admin.date_hierarchy, model_admin.get_search_fields(request),
+            model_admin.list_select_related, model_admin.list_per_page, model_admin.list_max_show_all,
+            model_admin.list_editable, model_admin,
+        )
+        return [(post.slug, model_admin.get_is_public(post), model_admin.get_post_categories(post))
+                for post in changelist.result_list]
+
+    def count_queries(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            self.get_rows(**params)
+        return len(context)
+
+    def test_public_status_and_categories(self):
+        self.assertEqual(sorted(self.get_rows()), [('post-0', False, 'News'), ('post-1', True, 'News')])
+
+    def test_queries_do_not_grow_with_the_posts(self):
+        queries = self.count_queries()
+        self.add_posts(10)
+        self.assertEqual(self.count_queries(), queries)
+        self.assertEqual(self.count_queries(is_visible__exact='1'), queries)
+
+
+@skipUnless('replica' in settings.DATABASES, "Needs a 'replica' database, e.g. a second SQLite file.")
+@override_settings(
+    DATABASE_ROUTERS=['blogoland.routers.ReplicaRouter'],
+    BLOGOLAND_REPLICA_DB='replica',
+    MIDDLEWARE=[
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'blogoland.routers.StickyPrimaryMiddleware',
+    ],
+    **benchmark.BENCHMARK_SETTINGS
+)
+class ReplicaRoutingTests(TestCase):
+    """
+    Public reads go to the replica, unless the user just wrote.
+    """
+    multi_db = True
+
+    def setUp(self):
+        widgets.local_cache.clear()
+        self.post = Post.objects.create(title='Primary', slug='post', content='<p>Post</p>')
+        # The test databases don't replicate, so the replica has its own copy.
+        Post.objects.using('replica').create(title='Replica', slug='post', content='<p>Post</p>')
+
+    def test_public_pages_read_the_replica(self):
+        response = self.client.get('/post/')
+        self.assertContains(response, 'Replica')
+        self.assertNotContains(response, 'Primary')
+
+    def test_template_tags_read_the_replica(self):
+        self.assertEqual([post.title for post in widgets.get_latest_posts(5)], ['Replica'])
+
+    def test_staff_reads_the_primary(self):
+        self.client.force_login(User.objects.create_user('staff', password='staff', is_staff=True))
+        self.assertContains(self.client.get('/post/'), 'Primary')
+
+    def test_sticky_cookie_reads_the_primary(self):
+        self.client.cookies[routers.STICKY_COOKIE] = '1'
+        self.assertContains(self.client.get('/post/'), 'Primary')
+
+    def test_writes_go_to_the_primary(self):
+        with routers.replica_reads():
+            self.assertEqual(Post.objects.get(slug='post').title, 'Replica')
+            self.post.title = 'Edited'
+            self.post.save()
+            self.assertEqual(Post.objects.get(slug='post').title, 'Edited')
+        self.assertEqual(Post.objects.using('replica').get(slug='post').title, 'Replica')
+
+    def test_benchmarks_count_the_replica_queries(self):
+        def read():
+            with routers.replica_reads():
+                list(Post.objects.all())
+        self.assertEqual(benchmark.measure(read)['queries'], 1)
+
+    def test_writes_set_the_sticky_cookie(self):
+        def save(request):
+            self.post.save()
+            return HttpResponse()
+        middleware = routers.StickyPrimaryMiddleware(save)
+        self.assertIn(routers.STICKY_COOKIE, middleware(RequestFactory().post('/')).cookies)
+        middleware = routers.StickyPrimaryMiddleware(lambda request: HttpResponse())
+        self.assertNotIn(routers.STICKY_COOKIE, middleware(RequestFactory().post('/')).cookies)
+
+    def enable_cache(self):
+        cache.get_cache().clear()
+        self.addCleanup(setattr, cache, 'CACHE_ENABLED', cache.CACHE_ENABLED)
+        cache.CACHE_ENABLED = True
+
+    def test_replica_pages_are_not_cached_right_after_a_bump(self):
+        self.enable_cache()
+        cache.bump_versions([cache.post_version('post')])
+        self.assertContains(self.client.get('/post/'), 'Replica')
+        Post.objects.using('replica').filter(slug='post').update(title='Replicated')
+        self.assertContains(self.client.get('/post/'), 'Replicated')
+
+    def test_replica_pages_are_cached_once_settled(self):
+        self.enable_cache()
+        self.client.get('/post/')
+        Post.objects.using('replica').filter(slug='post').update(title='Replicated')
+        self.assertNotContains(self.client.get('/post/'), 'Replicated')
+
+    def test_replica_snapshots_are_not_kept_right_after_a_bump(self):
+        cache.bump_versions([cache.LIST_VERSION])
+        widgets.get_latest_posts(5)
+        self.assertEqual(len(widgets.local_cache.entries), 0)
+        cache.get_cache().clear()
+        widgets.get_latest_posts(5)
+        self.assertEqual(len(widgets.local_cache.entries), 1)
+
+
+class PrefetchedImageTests(TestCase):
+    """
+    The thumbnail and detail images of a list of posts are loaded with one
+    query.
+    """
+    def setUp(self):
+        for number in range(3):
+            post = Post.objects.create(title='Post %s' % number, slug='post-%s' % number,
+                                       content='<p>Post %s</p>' % number)
+            PostImage.objects.bulk_create([
+                PostImage(post=post, title='Old', img_type='thumbnail', image='old-%s.jpg' % number),
+                PostImage(post=post, title='Thumbnail', img_type='thumbnail', image='thumbnail-%s.jpg' % number),
+                PostImage(post=post, title='Detail', img_type='detail', image='detail-%s.jpg' % number),
+            ])
+
+    def test_last_images_are_prefetched(self):
+        with self.assertNumQueries(2):
+            images = [(post.slug,
+                       post.image_set.get_last_img_type('thumbnail').image.name,
+                       post.image_set.get_last_img_type('detail').image.name)
+                      for post in Post.objects.all().prefetch_last_images()]
+        self.assertEqual(sorted(images), [('post-%s' % number, 'thumbnail-%s.jpg' % number, 'detail-%s.jpg' % number)
+                                          for number in range(3)])
+
+    def test_other_types_are_queried(self):
+        post = Post.objects.all().prefetch_last_images()[0]
+        with self.assertNumQueries(1):
+            self.assertIsNone(post.image_set.get_last_img_type('gallery'))
+
+
+@override_settings(**benchmark.BENCHMARK_SETTINGS)
+class CursorPaginationTests(TestCase):
+    """
+    Cursor pages seek on the Post ordering in both directions.
+    """
+    def setUp(self):
+        for number in range(5):
+            Post.objects.create(title='Post %s' % number, slug='post-%s' % number, content='<p>Post %s</p>' % number,
+                                publication_date=datetime.date(2018, 1, 1) + datetime.timedelta(days=number // 2))
+        self.paginator = CursorPaginator(Post.objects.all(), 2)
+
+    def get_slugs(self, page):
+        return [post.slug for post in page]
+
+    def test_round_trip(self):
+        first = self.paginator.page()
+        self.assertEqual(self.get_slugs(first), ['post-4', 'post-3'])
+        self.assertFalse(first.has_previous())
+        second = self.paginator.page(first.next_cursor)
+        self.assertEqual(self.get_slugs(second), ['post-2', 'post-1'])
+        last = self.paginator.page(second.next_cursor)
+        self.assertEqual(self.get_slugs(last), ['post-0'])
+        self.assertFalse(last.has_next())
+        self.assertEqual(self.get_slugs(self.paginator.page(last.previous_cursor)), ['post-2', 'post-1'])
+        self.assertEqual(self.get_slugs(self.paginator.page(second.previous_cursor)), ['post-4', 'post-3'])
+
+    def test_invalid_cursors(self):
+        valid = self.paginator.page().next_cursor
+        for cursor in ('garbage', valid[:-4], 'WyJ4IiwxXQ', 'WyJuIl0'):
+            with self.assertRaises(InvalidCursor):
+                self.paginator.page(cursor)
+
+    def test_invalid_cursor_is_not_found(self):
+        with self.assertRaises(Http404):
+            PostListView.as_view(pagination_mode='cursor')(benchmark.get_request(cursor='garbage'))
+
+
+class PublicationTimeoutTests(TestCase):
+    """
+    Cached pages expire when the next scheduled post goes public.
+    """
+    def setUp(self):
+        cache.get_cache().clear()
+        self.tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        Post.objects.create(title='Public', slug='public', content='<p>Public</p>')
+
+    def get_timeout(self):
+        return cache.get_timeout(Post.objects.get_next_publication_change(), 60 * 60 * 24 * 7)
+
+    def test_timeout_without_scheduled_posts(self):
+        self.assertIsNone(Post.objects.get_next_publication_change())
+        self.assertEqual(self.get_timeout(), 60 * 60 * 24 * 7)
+
+    def test_timeout_is_capped_at_the_next_publication(self):
+        self.get_timeout()
+        next_day = self.tomorrow + datetime.timedelta(days=1)
+        Post.objects.create(title='Later', slug='later', content='<p>Later</p>',
+                            publication_date=next_day + datetime.timedelta(days=1))
+        Post.objects.create(title='Next', slug='next', content='<p>Next</p>', publication_date=next_day)
+        Post.objects.create(title='Hidden', slug='hidden', content='<p>Hidden</p>', is_visible=False,
+                            publication_date=self.tomorrow)
+        next_change = datetime.datetime.combine(next_day, datetime.time.min)
+        self.assertEqual(Post.objects.get_next_publication_change(), next_change)
+        seconds = (next_change - datetime.datetime.now()).total_seconds()
+        self.assertTrue(seconds <= self.get_timeout() <= seconds + 1)
+
+    def test_next_publication_is_memoized(self):
+        Post.objects.get_next_publication_change()
+        with self.assertNumQueries(0):
+            Post.objects.get_next_publication_change()
+
+
+@override_settings(**benchmark.BENCHMARK_SETTINGS)
+class SitemapTests(TestCase):
+    """
+    The post sitemaps are split in chunks from the oldest post, so new
+    posts only change the last chunk.
+    """
+    def setUp(self):
+        cache.get_cache().clear()
+        chunk_size = sitemaps.SITEMAP_CHUNK_SIZE
+        self.addCleanup(setattr, sitemaps, 'SITEMAP_CHUNK_SIZE', chunk_size)
+        sitemaps.SITEMAP_CHUNK_SIZE = 2
+        for number in range(5):
+            self.add_post(number)
+
+    def add_post(self, number):
+        Post.objects.create(title='Post %s' % number, slug='post-%s' % number, content='<p>Post %s</p>' % number,
+                            publication_date=datetime.date(2018, 1, 1) + datetime.timedelta(days=number))
+
+    def get_chunk(self, number):
+        response = self.client.get('/sitemap-posts-%s.xml' % number)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return re.findall(r'<loc>http://testserver/([-\w]+)/</loc>', content.decode('utf-8'))
+
+    def test_chunk_boundaries(self):
+        self.assertEqual([count for after, lastmod, count in sitemaps.get_chunk_index()], [2, 2, 1])
+        self.assertEqual([self.get_chunk(number) for number in range(3)],
+                         [['post-0', 'post-1'], ['post-2', 'post-3'], ['post-4']])
+        self.assertEqual(self.client.get('/sitemap-posts-3.xml').status_code, 404)
+        self.assertContains(self.client.get('/sitemap.xml'), '<sitemap>', count=4)
+
+    def test_new_posts_only_change_the_last_chunk(self):
+        before = sitemaps.get_chunk_index()
+        self.add_post(5)
+        after = sitemaps.get_chunk_index()
+        self.assertEqual(after[:2], before[:2])
+        self.assertEqual(self.get_chunk(2), ['post-4', 'post-5'])
+
+    def test_cached_chunk(self):
+        self.get_chunk(1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_chunk(1), ['post-2', 'post-3'])
+
+
+@override_settings(**benchmark.BENCHMARK_SETTINGS)
+class InstrumentationTests(TestCase):
+    """
+    Instrumented views send their phase timings in a Server-Timing header.
+    """
+    def setUp(self):
+        Post.objects.create(title='Post', slug='post', content='<p>Post</p>')
+
+    def enable(self):
+        self.addCleanup(setattr, instrumentation, 'ENABLED', instrumentation.ENABLED)
+        instrumentation.ENABLED = True
+
+    def test_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/'))
+
+    def test_server_timing_header(self):
+        self.enable()
+        timings = []
+
+        def receiver(sender, **kwargs):
+            timings.extend(kwargs['timings'])
+        instrumentation.request_timed.connect(receiver, dispatch_uid='test_server_timing')
+        self.addCleanup(instrumentation.request_timed.disconnect, dispatch_uid='test_server_timing')
+        header = self.client.get('/')['Server-Timing']
+        names = re.findall(r'(\w+);dur=[\d.]+;desc="\d+ queries, \d+ calls"', header)
+        self.assertEqual(names, [timing['name'] for timing in timings])
+        self.assertEqual(sorted(names), ['get_context_data', 'get_queryset', 'render', 'view'])
+
+
+class PostContentTests(TestCase):
+    """
+    The plain text, excerpt and rendered HTML of a post are stored on save.
+    """
+    def test_content_fields(self):
+        post = Post.objects.create(title='Post', slug='post', content=(
+            '<p>One <strong>two</strong> three four five six seven eight nine ten eleven twelve</p>'))
+        post = Post.objects.get(pk=post.pk)
+        self.assertEqual(post.plain_content, 'One two three four five six seven eight nine ten eleven twelve')
+        self.assertEqual(post.excerpt, 'One two three four five six seven eight nine ten...')
+        self.assertEqual(post.rendered_content, post.content)
+
+    def test_content_fields_follow_the_content(self):
+        post = Post.objects.create(title='Post', slug='post', content='<p>Before</p>')
+        post.content = '<p>After</p>'
+        post.save()
+        self.assertEqual(Post.objects.values_list('plain_content', 'rendered_content').get(),
+                         ('After', '<p>After</p>'))
+
+    def test_empty_and_unparseable_content(self):
+        post = Post.objects.create(title='Post', slug='post', content=None)
+        self.assertEqual((post.plain_content, post.excerpt, post.rendered_content), ('', '', ''))
+        for content in ('<p>{}</p>', '<p>{name}</p>', '<p>{</p>'):
+            post.content = content
+            post.save()
+            self.assertEqual(post.rendered_content, '')
+
+
+@override_settings(ALLOWED_HOSTS=['testserver', 'other.example'], **benchmark.BENCHMARK_SETTINGS)
+class PageCacheTests(TestCase):
+    """
+    Anonymous pages are cached per URL until a version they depend on is
+    bumped.
+    """
+    def setUp(self):
+        cache.get_cache().clear()
+        self.addCleanup(setattr, cache, 'CACHE_ENABLED', cache.CACHE_ENABLED)
+        cache.CACHE_ENABLED = True
+        self.category = Category.objects.create(title='News', slug='news')
+        self.post = Post.objects.create(title='Cached', slug='cached', content='<p>Cached</p>')
+        self.post.category.add(self.category)
+        self.other = Post.objects.create(title='Other', slug='other', content='<p>Other</p>')
+
+    def get_stats(self):
+        return cache.get_stats(['post_list', 'post_detail'])
+
+    def test_pages_are_cached(self):
+        self.client.get('/cached/')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get('/cached/'), 'Cached')
+        self.assertEqual(self.get_stats()['post_detail'], {'hit': 1, 'miss': 1})
+
+    def test_headers_are_restored_on_hits(self):
+        class LanguageView(PostDetailView):
+            def render_to_response(self, context, **kwargs):
+                response = super(LanguageView, self).render_to_response(context, **kwargs)
+                response['Content-Language'] = 'es'
+                return response
+
+        def get():
+            request = RequestFactory().get('/cached/')
+            request.user = AnonymousUser()
+            return LanguageView.as_view()(request, post_slug='cached')
+
+        get()
+        response = get()
+        self.assertEqual(self.get_stats()['post_detail'], {'hit': 1, 'miss': 1})
+        self.assertEqual((response['Content-Language'], response['Content-Type']), ('es', 'text/html; charset=utf-8'))
+
+    def test_hosts_and_schemes_are_cached_apart(self):
+        self.client.get('/')
+        self.client.get('/', HTTP_HOST='other.example')
+        self.client.get('/', secure=True)
+        self.assertEqual(self.get_stats()['post_list'], {'hit': 0, 'miss': 3})
+
+    def test_saving_a_post_invalidates_its_pages(self):
+        self.client.get('/')
+        self.client.get('/cached/')
+        self.client.get('/other/')
+        self.post.title = 'Edited'
+        self.post.save()
+        self.assertContains(self.client.get('/'), 'Edited')
+        self.assertContains(self.client.get('/cached/'), 'Edited')
+        self.client.get('/other/')
+        self.assertEqual(self.get_stats(), {'post_list': {'hit': 0, 'miss': 2},
+                                            'post_detail': {'hit': 1, 'miss': 3}})
+
+    def test_saving_a_category_invalidates_its_pages(self):
+        self.client.get('/category/news/')
+        self.category.title = 'Edited'
+        self.category.save()
+        self.assertContains(self.client.get('/category/news/'), 'Edited')
+
+    def test_staff_bypasses_the_cache(self):
+        self.client.get('/cached/')
+        self.client.force_login(User.objects.create_user('staff', password='staff', is_staff=True))
+        Post.objects.filter(pk=self.post.pk).update(title='Edited')
+        self.assertContains(self.client.get('/cached/'), 'Edited')
+
+
+@override_settings(**benchmark.BENCHMARK_SETTINGS)
+class ConditionalGetTests(TestCase):
+    """
+    The HTML views answer conditional GET requests with '304 Not Modified'.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(title='News', slug='news')
+        self.post = Post.objects.create(title='Post', slug='post', content='<p>Post</p>')
+        self.post.category.add(self.category)
+
+    def assertNotModified(self, path, **headers):
+        self.assertEqual(self.client.get(path, **headers).status_code, 304)
+
+    def test_etag(self):
+        for path in ('/post/', '/category/news/', '/archive/%s/' % datetime.date.today().year):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotModified(path, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_if_modified_since(self):
+        for path in ('/post/', '/category/news/'):
+            response = self.client.get(path)
+            self.assertNotModified(path, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(self.client.get(path, HTTP_IF_MODIFIED_SINCE=http_date(
+                parse_http_date(response['Last-Modified']) - 1)).status_code, 200)
+
+    def test_changes_are_modified(self):
+        paths = ('/post/', '/category/news/', '/archive/%s/' % datetime.date.today().year)
+        etags = dict((path, self.client.get(path)['ETag']) for path in paths)
+        self.post.title = 'Edited'
+        self.post.save()
+        for path, etag in etags.items():
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_post_list_is_not_conditional(self):
+        self.assertFalse(self.client.get('/').has_header('ETag'))
+
+    def test_category_validators_do_not_query_posts(self):
+        self.addCleanup(setattr, cache, 'CACHE_ENABLED', cache.CACHE_ENABLED)
+        cache.CACHE_ENABLED = False
+        etag = self.client.get('/category/news/')['ETag']
+        with CaptureQueriesContext(connection) as context:
+            self.assertNotModified('/category/news/', HTTP_IF_NONE_MATCH=etag)
+        self.assertFalse([query for query in context.captured_queries if 'blogoland_post' in query['sql']])
+
+    def get_old_last_modified(self, path):
+        hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        Category.objects.update(modification_date=hour_ago, posts_modification_date=hour_ago)
+        cache.bump_versions([cache.category_version('news')])
+        return self.client.get(path)['Last-Modified']
+
+    def test_hiding_a_post_advances_last_modified(self):
+        last_modified = self.get_old_last_modified('/category/news/')
+        self.post.is_visible = False
+        self.post.save()
+        self.assertEqual(self.client.get('/category/news/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_deleting_a_post_advances_last_modified(self):
+        last_modified = self.get_old_last_modified('/category/news/')
+        self.post.delete()
+        self.assertEqual(self.client.get('/category/news/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    @override_settings(USE_TZ=False, TIME_ZONE='America/New_York')
+    def test_naive_last_modified(self):
+        Post.objects.filter(pk=self.post.pk).update(modification_date=datetime.datetime.now())
+        last_modified = parse_http_date(self.client.get('/post/')['Last-Modified'])
+        self.assertLess(abs(last_modified - time.time()), 60)
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Needs the SQLite FTS5 or the PostgreSQL search index.')
+@override_settings(**benchmark.BENCHMARK_SETTINGS)
+class SearchTests(TestCase):
+    """
+    Search results are ranked by relevance and only show public posts to
+    non-staff users.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(title='Recipes', slug='recipes')
+        self.best = Post.objects.create(title='Caching querysets', slug='best',
+                                        content='<p>Caching querysets and caching views.</p>')
+        self.other = Post.objects.create(title='Django views', slug='other',
+                                         content='<p>Writing views, with a word on caching.</p>')
+        self.hidden = Post.objects.create(title='Hidden caching', slug='hidden', content='<p>Caching</p>',
+                                          is_visible=False)
+        self.pasta = Post.objects.create(title='Pasta', slug='pasta', content='<p>Boiling water</p>')
+        self.pasta.category.add(self.category)
+
+    def get_slugs(self, query, queryset=None):
+        queryset = Post.objects.get_public_posts() if queryset is None else queryset
+        return [post.slug for post in search.search(queryset, query)]
+
+    def test_ranking(self):
+        self.assertEqual(self.get_slugs('caching'), ['best', 'other'])
+        self.assertEqual(self.get_slugs('views caching'), ['best', 'other'])
+        self.assertEqual(self.get_slugs('writing caching'), ['other'])
+        self.assertEqual(self.get_slugs('recipes'), ['pasta'])
+        self.assertEqual(self.get_slugs('?!'), [])
+
+    def test_edits_are_indexed(self):
+        self.other.content = '<p>Writing views.</p>'
+        self.other.save()
+        self.assertEqual(self.get_slugs('caching'), ['best'])
+        callbacks = len(connection.run_on_commit)
+        self.category.save()
+        self.assertEqual(len(connection.run_on_commit), callbacks)
+        self.category.title = 'Caching recipes'
+        self.category.save()
+        for savepoint_ids, callback in connection.run_on_commit[callbacks:]:
+            callback()
+        self.assertEqual(self.get_slugs('caching'), ['best', 'pasta'])
+
+    def test_documents_are_updated_in_batches(self):
+        self.addCleanup(setattr, search, 'BATCH_SIZE', search.BATCH_SIZE)
+        search.BATCH_SIZE = 2
+        Post.objects.update(search_document='')
+        with CaptureQueriesContext(connection) as context:
+            search.update_index(Post.objects.values_list('pk', flat=True))
+        self.assertEqual(len([query for query in context.captured_queries
+                              if query['sql'].startswith('UPDATE')]), 2)
+        self.assertEqual(self.get_slugs('caching'), ['best', 'other'])
+
+    def test_staff_and_public_results(self):
+        response = self.client.get('/search/', {'q': 'caching'})
+        self.assertEqual([post.slug for post in response.context['object_list']], ['best', 'other'])
+        self.client.force_login(User.objects.create_user('staff', password='staff', is_staff=True))
+        response = self.client.get('/search/', {'q': 'caching'})
+        self.assertEqual(sorted(post.slug for post in response.context['object_list']), ['best', 'hidden', 'other'])
+
+    def test_search_slug_is_reserved(self):
+        post = Post(title='Search', slug='search', content='<p>Search</p>')
+        with self.assertRaises(ValidationError):
+            post.full_clean()
+
+
+@override_settings(**benchmark.BENCHMARK_SETTINGS)
+class FeedTests(TestCase):
+    """
+    The feeds list the latest public posts and answer conditional requests.
+    """
+    def setUp(self):
+        cache.get_cache().clear()
+        self.category = Category.objects.create(title='News', slug='news')
+        for number in range(3):
+            post = Post.objects.create(title='Post %s' % number, slug='post-%s' % number,
+                                       content='<p>Post %s</p>' % number,
+                                       publication_date=datetime.date(2018, 1, number + 1))
+            if number:
+                post.category.add(self.category)
+        Post.objects.create(title='Hidden', slug='hidden', content='<p>Hidden</p>', is_visible=False)
+
+    def get_feed(self, path, **headers):
+        response = self.client.get(path, **headers)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_rss(self):
+        response, content = self.get_feed('/feed/rss/')
+        self.assertEqual(response['Content-Type'], 'application/rss+xml; charset=utf-8')
+        self.assertEqual(re.findall(r'<guid isPermaLink="true">http://testserver/([-\w]+)/</guid>', content),
+                         ['post-2', 'post-1', 'post-0'])
+        self.assertTrue(content.endswith('</channel></rss>'))
+
+    def test_atom(self):
+        response, content = self.get_feed('/feed/atom/')
+        self.assertEqual(response['Content-Type'], 'application/atom+xml; charset=utf-8')
+        self.assertEqual(re.findall(r'<id>http://testserver/([-\w]+)/</id>', content), ['post-2', 'post-1', 'post-0'])
+
+    def test_category_feed(self):
+        response, content = self.get_feed('/category/news/feed/rss/')
+        self.assertIn('<title>example.com - News</title>', content)
+        self.assertEqual(re.findall(r'<guid isPermaLink="true">http://testserver/([-\w]+)/</guid>', content),
+                         ['post-2', 'post-1'])
+        self.assertEqual(self.client.get('/category/missing/feed/rss/').status_code, 404)
+
+    def test_items_are_cached(self):
+        content = self.get_feed('/feed/rss/')[1]
+        Post.objects.filter(slug='post-1').update(title='Edited')
+        self.assertEqual(self.get_feed('/feed/rss/')[1], content)
+        Post.objects.get(slug='post-1').save()
+        self.assertIn('<title>Edited</title>', self.get_feed('/feed/rss/')[1])
+
+    def test_conditional_get(self):
+        response = self.get_feed('/feed/rss/')[0]
+        self.assertEqual(self.client.get('/feed/rss/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Post.objects.filter(slug='post-0').update(is_visible=False)
+        self.assertEqual(self.client.get('/feed/rss/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_validators_only_read_the_listed_posts(self):
+        view = feeds.PostFeedView(items=2, request=benchmark.get_request('/feed/rss/'))
+        with self.assertNumQueries(1):
+            validators = view.get_validators()
+        self.assertEqual(validators, {
+            'modified': Post.objects.get(slug='post-2').modification_date,
+            'items': '%s,%s' % (Post.objects.get(slug='post-2').pk, Post.objects.get(slug='post-1').pk),
+        })
+
+
+class ImageDerivativeTests(TestCase):
+    """
+    Post images are resized to the widths of their type, in WebP and a
+    fallback format, and rendered with a srcset.
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.storage = FileSystemStorage(location=directory, base_url='/media/')
+
+    def save_image(self, size, mode='RGB'):
+        buffer = io.BytesIO()
+        Image.new(mode, size).save(buffer, 'PNG')
+        return self.storage.save('blogoland/post/1/photo.png', ContentFile(buffer.getvalue()))
+
+    def get_derivatives(self, metadata):
+        return [(derivative['width'], derivative['height'], derivative['format'])
+                for derivative in metadata['derivatives']]
+
+    def test_derivatives(self):
+        name = self.save_image((800, 600))
+        metadata = images.generate_derivatives(name, 'thumbnail', storage=self.storage)
+        self.assertEqual((metadata['source'], metadata['width'], metadata['height']), (name, 800, 600))
+        self.assertEqual(self.get_derivatives(metadata),
+                         [(320, 240, 'webp'), (320, 240, 'jpeg'), (640, 480, 'webp'), (640, 480, 'jpeg')])
+        for derivative in metadata['derivatives']:
+            self.assertTrue(derivative['name'].startswith('blogoland/post/1/derivatives/photo-'))
+            with self.storage.open(derivative['name']) as image_file:
+                self.assertEqual(Image.open(image_file).size, (derivative['width'], derivative['height']))
+
+    def test_widths_are_capped_at_the_original(self):
+        metadata = images.generate_derivatives(self.save_image((1000, 500)), 'detail', storage=self.storage)
+        self.assertEqual(sorted(set(width for width, height, image_format in self.get_derivatives(metadata))),
+                         [768, 1000])
+
+    def test_transparent_images_fall_back_to_png(self):
+        metadata = images.generate_derivatives(self.save_image((400, 400), 'RGBA'), 'gallery', storage=self.storage)
+        self.assertEqual(self.get_derivatives(metadata), [(400, 400, 'webp'), (400, 400, 'png')])
+
+    def get_names(self, metadata):
+        return [derivative['name'] for derivative in metadata['derivatives']]
+
+    def create_image(self, name, metadata=None):
+        post = Post.objects.create(title='Post', slug='post', content='<p>Post</p>')
+        PostImage.objects.bulk_create([PostImage(post=post, title='Photo', image=name,
+                                                 derivatives=json.dumps(metadata) if metadata else None)])
+        return PostImage.objects.get()
+
+    def test_old_derivatives_are_deleted_once_replaced(self):
+        name = self.save_image((800, 600))
+        old_names = self.get_names(images.generate_derivatives(name, 'thumbnail', storage=self.storage))
+        new = images.generate_derivatives(name, 'gallery', storage=self.storage)
+        self.assertTrue(all(self.storage.exists(old_name) for old_name in old_names))
+        images.save_metadata(self.create_image(name).pk, new, old_names, storage=self.storage)
+        self.assertFalse(any(self.storage.exists(old_name) for old_name in old_names))
+        self.assertTrue(all(self.storage.exists(new_name) for new_name in self.get_names(new)))
+
+    def test_derivatives_of_a_changed_image_are_discarded(self):
+        name = self.save_image((800, 600))
+        old_names = self.get_names(images.generate_derivatives(name, 'thumbnail', storage=self.storage))
+        new = images.generate_derivatives(name, 'gallery', storage=self.storage)
+        images.save_metadata(self.create_image('blogoland/post/1/other.png').pk, new, old_names, storage=self.storage)
+        self.assertTrue(all(self.storage.exists(old_name) for old_name in old_names))
+        self.assertFalse(any(self.storage.exists(new_name) for new_name in self.get_names(new)))
+
+    def test_derivatives_are_deleted_with_their_image(self):
+        name = self.save_image((800, 600))
+        metadata = images.generate_derivatives(name, 'thumbnail', storage=self.storage)
+        image = self.create_image(name, metadata)
+        callbacks = len(connection.run_on_commit)
+        with override_settings(MEDIA_ROOT=self.storage.location):
+            image.delete()
+            for savepoint_ids, callback in connection.run_on_commit[callbacks:]:
+                callback()
+        self.assertFalse(any(self.storage.exists(derivative) for derivative in self.get_names(metadata)))
+
+    def test_worker_callback_errors_are_logged(self):
+        closed = []
+        self.addCleanup(delattr, connection, 'close')
+        connection.close = lambda: closed.append(True)
+        handler = logging.handlers.BufferingHandler(10)
+        images.logger.addHandler(handler)
+        self.addCleanup(images.logger.removeHandler, handler)
+        self.addCleanup(setattr, images.logger, 'propagate', images.logger.propagate)
+        images.logger.propagate = False
+        # Metadata without derivatives can't be saved.
+        images._save_from_worker((self.create_image('blogoland/post/1/photo.png').pk,
+                                  {'source': 'blogoland/post/1/photo.png'}, []))
+        self.assertEqual([record.levelname for record in handler.buffer], ['ERROR'])
+        self.assertEqual(closed, [True])
+
+    def test_metadata_is_only_saved_for_the_current_file(self):
+        post = Post.objects.create(title='Post', slug='post', content='<p>Post</p>')
+        PostImage.objects.bulk_create([PostImage(post=post, title='Photo', image='blogoland/post/1/photo.png')])
+        image = PostImage.objects.get()
+        self.assertTrue(images.needs_derivatives(image))
+        images.save_metadata(image.pk, {'source': 'blogoland/post/1/other.png', 'derivatives': []})
+        self.assertTrue(images.needs_derivatives(PostImage.objects.get()))
+        images.save_metadata(image.pk, {'source': 'blogoland/post/1/photo.png', 'derivatives': []})
+        self.assertFalse(images.needs_derivatives(PostImage.objects.get()))
+
+    @override_settings(MEDIA_URL='/media/')
+    def test_img_tag(self):
+        image = PostImage(title='Photo', img_type='thumbnail', image='blogoland/post/1/photo.jpg')
+        self.assertEqual(build_img_tag(image), '<img src="/media/blogoland/post/1/photo.jpg" alt="Photo" />')
+        image.derivatives = json.dumps({'source': image.image.name, 'width': 800, 'height': 600, 'derivatives': [
+            {'name': 'p-%s.%s' % (width, extension), 'width': width, 'height': width * 3 // 4, 'format': image_format}
+            for width in (320, 640) for image_format, extension in (('webp', 'webp'), ('jpeg', 'jpg'))
+        ]})
+        self.assertEqual(build_img_tag(image), (
+            '<picture><source type="image/webp" srcset="/media/p-320.webp 320w, /media/p-640.webp 640w" '
+            'sizes="(max-width: 640px) 100vw, 320px" />'
+            '<img src="/media/p-640.jpg" srcset="/media/p-320.jpg 320w, /media/p-640.jpg 640w" '
+            'sizes="(max-width: 640px) 100vw, 320px" width="640" height="480" alt="Photo" /></picture>'))
+
+
+class ImportExportTests(TestCase):
+    """
+    blogoland_import reads back what blogoland_export writes, upserting by
+    slug.
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = directory + '/blog.jsonl'
+        news = Category.objects.create(title='News', slug='news', seo_keywords='news')
+        Category.objects.create(title='Empty', slug='empty')
+        post = Post.objects.create(title='First', slug='first', content='<p>First {post}</p>',
+                                   publication_date=datetime.date(2018, 1, 2))
+        post.category.add(news)
+        PostImage.objects.bulk_create([
+            PostImage(post=post, title='Thumbnail', img_type='thumbnail', image='blogoland/post/1/thumbnail.jpg'),
+            PostImage(post=post, title='Gallery', img_type='gallery', image='blogoland/post/1/gallery.jpg'),
+        ])
+        Post.objects.create(title='Hidden', slug='hidden', content='<p>Hidden</p>', is_visible=False,
+                            seo_description='Custom')
+
+    def export(self):
+        call_command('blogoland_export', self.path)
+        with io.open(self.path, encoding='utf-8') as source:
+            return [json.loads(line) for line in source]
+
+    def run_import(self, lines=None):
+        if lines is not None:
+            with io.open(self.path, 'w', encoding='utf-8') as output:
+                output.write(u''.join(u'%s\n' % json.dumps(line) for line in lines))
+        output = io.StringIO()
+        call_command('blogoland_import', self.path, stdout=output)
+        return output.getvalue()
+
+    def test_round_trip(self):
+        lines = self.export()
+        Post.objects.all().delete()
+        Category.objects.all().delete()
+        self.assertIn('Done. 4 created, 0 updated.', self.run_import())
+        self.assertEqual(self.export(), lines)
+        post = Post.objects.get(slug='first')
+        self.assertEqual((post.plain_content, post.seo_title), ('First {post}', 'First'))
+        self.assertEqual(Category.objects.get(slug='news').get_post_counts(), (1, 1))
+
+    def test_reimport_updates_in_place(self):
+        lines = self.export()
+        self.assertIn('Done. 0 created, 4 updated.', self.run_import())
+        self.assertEqual(self.export(), lines)
+        self.assertEqual(PostImage.objects.count(), 2)
+
+    def test_duplicate_slugs(self):
+        lines = self.export()
+        copy = dict(lines[-1], title='Hidden again')
+        self.assertIn('Done. 0 created, 4 updated.', self.run_import(lines + [copy, lines[2]]))
+        self.assertEqual(Post.objects.get(slug='hidden').title, 'Hidden again')
+        Post.objects.all().delete()
+        self.assertIn('Done. 2 created, 2 updated.', self.run_import(lines + [copy]))
+
+    def test_image_deletes_send_no_signals(self):
+        deleted = []
+
+        def receiver(sender, **kwargs):
+            deleted.append(kwargs['instance'])
+        post_delete.connect(receiver, sender=PostImage, dispatch_uid='test_import_deletes')
+        self.addCleanup(post_delete.disconnect, sender=PostImage, dispatch_uid='test_import_deletes')
+        self.export()
+        self.run_import()
+        self.assertEqual(deleted, [])
+
+    def test_reserved_slug(self):
+        with self.assertRaises(CommandError):
+            self.run_import([{'model': 'post', 'slug': 'search', 'title': 'Search'}])
+
+
+@override_settings(MEDIA_URL='/media/')
+class SocialMetaTests(TestCase):
+    """
+    The Open Graph and Twitter Card tags of a post use absolute URLs and are
+    computed once per request.
+    """
+    def setUp(self):
+        Site.objects.filter(pk=settings.SITE_ID).update(domain='blog.example', name='Blog')
+        Site.objects.clear_cache()
+        self.addCleanup(Site.objects.clear_cache)
+        self.post = Post.objects.create(title='Post', slug='post', content='<p>Post</p>',
+                                        seo_title='SEO title', seo_description='SEO description')
+
+    def render(self, source, request=None):
+        request = request or RequestFactory().get('/post/', secure=True)
+        return Template('{% load blogoland_tags %}' + source).render(
+            RequestContext(request, {'object': self.post}))
+
+    def add_image(self):
+        PostImage.objects.bulk_create([PostImage(post=self.post, title='Photo', img_type='thumbnail',
+                                                 image='blogoland/post/1/photo.jpg')])
+
+    def test_tags(self):
+        self.add_image()
+        html = self.render('{% post_social_meta %}')
+        for tag in ('<meta property="og:title" content="SEO title" />',
+                    '<meta property="og:description" content="SEO description" />',
+                    '<meta property="og:url" content="https://blog.example/post/" />',
+                    '<meta property="og:site_name" content="Blog" />',
+                    '<meta property="og:image" content="https://blog.example/media/blogoland/post/1/photo.jpg" />',
+                    '<meta name="twitter:card" content="summary_large_image" />',
+                    '<meta name="twitter:title" content="SEO title" />',
+                    '<meta name="twitter:image" content="https://blog.example/media/blogoland/post/1/photo.jpg" />'):
+            self.assertIn(tag, html)
+
+    def test_post_without_image(self):
+        self.post.seo_title = None
+        html = self.render('{% post_social_meta %}')
+        self.assertIn('<meta property="og:title" content="Post" />', html)
+        self.assertIn('<meta name="twitter:card" content="summary" />', html)
+        self.assertNotIn('og:image', html)
+        self.assertNotIn('twitter:image', html)
+        self.assertEqual(self.render('{% social_media_image_url %}'), 'None')
+
+    def test_plain_http(self):
+        self.assertEqual(self.render('{% social_media_post_url %}', RequestFactory().get('/post/')),
+                         'http://blog.example/post/')
+
+    def test_computed_once_per_request(self):
+        self.add_image()
+        request = RequestFactory().get('/post/', secure=True)
+        self.render('{% post_social_meta %}', request)
+        with self.assertNumQueries(0):
+            html = self.render('{% social_media_post_url %} {% social_media_image_url %}', request)
+        self.assertEqual(html, 'https://blog.example/post/ https://blog.example/media/blogoland/post/1/photo.jpg')
+        self.assertEqual(list(request._blogoland_social_meta), [self.post.pk])
@@ -2,11 +2,33 @@
 
 from django.conf.urls import url, include
 
-from blogoland.views import PostListView, PostDetailView, CategoryPostListView
+from blogoland.api import (
+    PostApiListView, PostApiDetailView, PostImageApiListView, CategoryApiListView, CategoryApiDetailView,
+)
+from blogoland.feeds import PostFeedView, CategoryPostFeedView
+from blogoland.sitemaps import SitemapIndexView, PostSitemapView, CategorySitemapView
+from blogoland.views import PostListView, PostDetailView, CategoryPostListView, PostSearchView, PostArchiveView
 
 app_name = 'blogoland'
 urlpatterns = [
     url(r'^$', PostListView.as_view(), name='post_list'),
+    url(r'^search/$', PostSearchView.as_view(), name='post_search'),
+    url(r'^feed/rss/$', PostFeedView.as_view(feed_type='rss'), name='post_feed_rss'),
+    url(r'^feed/atom/$', PostFeedView.as_view(feed_type='atom'), name='post_feed_atom'),
+    url(r'^archive/(?P<year>\d{4})/$', PostArchiveView.as_view(), name='archive_year'),
+    url(r'^archive/(?P<year>\d{4})/(?P<month>\d{2})/$', PostArchiveView.as_view(), name='archive_month'),
+    url(r'^api/posts/$', PostApiListView.as_view(), name='api_post_list'),
+    url(r'^api/posts/(?P<post_slug>[-\w]+)/$', PostApiDetailView.as_view(), name='api_post_detail'),
+    url(r'^api/posts/(?P<post_slug>[-\w]+)/images/$', PostImageApiListView.as_view(), name='api_post_images'),
+    url(r'^api/categories/$', CategoryApiListView.as_view(), name='api_category_list'),
+    url(r'^api/categories/(?P<category_slug>[-\w]+)/$', CategoryApiDetailView.as_view(), name='api_category_detail'),
+    url(r'^sitemap\.xml$', SitemapIndexView.as_view(), name='sitemap_index'),
+    url(r'^sitemap-posts-(?P<chunk>\d+)\.xml$', PostSitemapView.as_view(), name='sitemap_posts'),
+    url(r'^sitemap-categories\.xml$', CategorySitemapView.as_view(), name='sitemap_categories'),
     url(r'^(?P<post_slug>[-\w]+)/$', PostDetailView.as_view(), name='post_detail'),
     url(r'^category/(?P<category_slug>[-\w]+)/$', CategoryPostListView.as_view(), name='category_post_list'),
+    url(r'^category/(?P<category_slug>[-\w]+)/archive/(?P<year>\d{4})/$', PostArchiveView.as_view(), name='category_archive_year'),
+    url(r'^category/(?P<category_slug>[-\w]+)/archive/(?P<year>\d{4})/(?P<month>\d{2})/$', PostArchiveView.as_view(), name='category_archive_month'),
+    url(r'^category/(?P<category_slug>[-\w]+)/feed/rss/$', CategoryPostFeedView.as_view(feed_type='rss'), name='category_feed_rss'),
+    url(r'^category/(?P<category_slug>[-\w]+)/feed/atom/$', CategoryPostFeedView.as_view(feed_type='atom'), name='category_feed_atom'),
 ]
\ No newline at end of file
@@ -1,13 +1,214 @@
 # -*- coding:utf8 -*-
+import calendar
+import datetime
+import hashlib
+
 from django.conf import settings
-from django.http import Http404
+from django.db.models import Max
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date
 from django.views.generic import DetailView, ListView
 
-from blogoland.confs import DEFAULT_PAGINATION
+from blogoland import archive, cache, overrides, popular, routers, search
+from blogoland.confs import DEFAULT_PAGINATION, DEFAULT_PAGINATION_MODE
+from blogoland.instrumentation import InstrumentedViewMixin
 from blogoland.models import Post, Category
+from blogoland.paginators import CountedPaginator, CursorPaginator, InvalidCursor
 
 
 PAGINATION = getattr(settings, 'BLOGOLAND_PAGINATION', DEFAULT_PAGINATION)
+PAGINATION_MODE = getattr(settings, 'BLOGOLAND_PAGINATION_MODE', DEFAULT_PAGINATION_MODE)
+
+
+def start_of_day(date):
+    """
+    Returns the datetime when the given date starts, aware if USE_TZ is on.
+    """
+    value = datetime.datetime.combine(date, datetime.time.min)
+    if settings.USE_TZ:
+        value = timezone.make_aware(value)
+    return value
+
+
+def get_timestamp(value):
+    """
+    Returns the POSIX timestamp of the given datetime. Naive datetimes are
+    in the current time zone.
+    """
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return calendar.timegm(value.utctimetuple())
+
+
+class ConditionalViewMixin(object):
+    """
+    Adds ETag and Last-Modified headers built from get_validators and
+    answers conditional GET requests with '304 Not Modified' without
+    rendering the page.
+    """
+    def get_validators(self):
+        """
+        Returns a dict with the values the page content depends on. Its
+        datetimes give the Last-Modified header and all of them the ETag.
+        """
+        return {}
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super(ConditionalViewMixin, self).dispatch(request, *args, **kwargs)
+
+        self.request, self.args, self.kwargs = request, args, kwargs
+        # Views using CachedViewMixin keep the validators of anonymous pages
+        # in the cache, so a cached page is validated without queries.
+        get_cached = getattr(self, 'get_cached', None)
+        validators = get_cached('validators', self.get_validators) if get_cached else self.get_validators()
+        if not validators:
+            return super(ConditionalViewMixin, self).dispatch(request, *args, **kwargs)
+
+        dates = [value for value in validators.values() if isinstance(value, datetime.datetime)]
+        last_modified = get_timestamp(max(dates)) if dates else None
+        source = '|'.join('%s=%s' % item for item in sorted(validators.items()))
+        etag = 'W/"%s"' % hashlib.md5(force_bytes(source)).hexdigest()
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super(ConditionalViewMixin, self).dispatch(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_version_validators(self, names):
+        """
+        Returns the validators of a list of posts without querying them: the
+        cache versions bumped by every change of its posts, and the date, as
+        scheduled posts go public. They only give an ETag.
+        """
+        return {
+            'versions': cache.get_versions(names),
+            'date': datetime.date.today(),
+            'staff': self.request.user.is_staff,
+            'query': self.request.GET.urlencode(),
+        }
+
+
+class CachedViewMixin(object):
+    """
+    Caches the rendered page for anonymous users under the versions returned
+    by get_cache_versions. Staff requests always bypass the cache.
+    """
+    cache_prefix = None
+
+    def get_cache_versions(self):
+        """
+        Returns the names of the versions the page depends on.
+        """
+        return [cache.LIST_VERSION]
+
+    def is_cacheable(self):
+        """
+        Only GET requests of anonymous users are cached.
+        """
+        return (cache.CACHE_ENABLED and self.request.method in ('GET', 'HEAD') and
+                not self.request.user.is_authenticated)
+
+    def get_cached(self, name, compute):
+        """
+        Returns the value of the given callable, cached under the page
+        versions when the request is cacheable.
+        """
+        if not self.is_cacheable():
+            return compute()
+        key = cache.make_key('%s:%s' % (self.cache_prefix, name), self.get_cache_versions(),
+                             self.request.build_absolute_uri())
+        value = cache.get_cache().get(key)
+        if value is None:
+            value = compute()
+            if self.can_store():
+                cache.get_cache().set(key, value, self.get_cache_timeout())
+        return value
+
+    def can_store(self):
+        """
+        What was read from the replica right after the page versions were
+        bumped may predate the change, so it is not stored under them.
+        """
+        return not (routers.has_read_replica() and cache.is_settling(self.get_cache_versions()))
+
+    def dispatch(self, request, *args, **kwargs):
+        self.request, self.args, self.kwargs = request, args, kwargs
+        if not self.is_cacheable():
+            return super(CachedViewMixin, self).dispatch(request, *args, **kwargs)
+
+        key = cache.make_key(self.cache_prefix, self.get_cache_versions(), request.build_absolute_uri())
+        cached = cache.get_cache().get(key)
+        if cached is not None:
+            cache.record(self.cache_prefix, 'hit')
+            response = HttpResponse(cached['content'], content_type=cached['content_type'])
+            for name, value in cached.get('headers', ()):
+                response[name] = value
+            return response
+
+        cache.record(self.cache_prefix, 'miss')
+        response = super(CachedViewMixin, self).dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+            response.add_post_render_callback(lambda response: self.set_cached_response(key, response))
+        return response
+
+    def get_cache_timeout(self):
+        """
+        Returns the page timeout, capped to expire when the next scheduled
+        post gets published.
+        """
+        return cache.get_timeout(Post.objects.get_next_publication_change())
+
+    def set_cached_response(self, key, response):
+        if not self.can_store():
+            return
+        # Server-Timing only describes the request that rendered the page.
+        headers = [(name, value) for name, value in response.items()
+                   if name.lower() not in ('content-type', 'server-timing')]
+        cached = {'content': response.content, 'content_type': response['Content-Type'], 'headers': headers}
+        cache.get_cache().set(key, cached, self.get_cache_timeout())
+
+
+class ReplicaViewMixin(object):
+    """
+    Reads from the replica database, when ReplicaRouter is installed, while
+    the page of a non-staff user is built and rendered.
+    """
+    def uses_replica(self):
+        return self.request.method in ('GET', 'HEAD') and not self.request.user.is_staff
+
+    def dispatch(self, request, *args, **kwargs):
+        self.request, self.args, self.kwargs = request, args, kwargs
+        if not self.uses_replica():
+            return super(ReplicaViewMixin, self).dispatch(request, *args, **kwargs)
+        with routers.replica_reads():
+            response = super(ReplicaViewMixin, self).dispatch(request, *args, **kwargs)
+            # The template tags read while rendering.
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
+
+
+class ViewCountMixin(object):
+    """
+    Counts the views of the page of a post, when BLOGOLAND_VIEW_COUNTS is
+    on, in the buffer of blogoland.popular. Staff views are not counted.
+    """
+    count_views = True
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super(ViewCountMixin, self).dispatch(request, *args, **kwargs)
+        if (popular.VIEW_COUNTS and self.count_views and request.method == 'GET' and
+                response.status_code in (200, 304) and not request.user.is_staff):
+            popular.view_buffer.hit(kwargs.get('post_slug'))
+        return response
 
 
 class PaginatedListView(ListView):
@@ -15,29 +216,50 @@ class PaginatedListView(ListView):
     Paginated base view
     """
     paginate_by = PAGINATION
+    pagination_mode = PAGINATION_MODE
+    cursor_kwarg = 'cursor'
+    # Links the pages as '<path>page/N/', as the static export writes them.
+    page_paths = False
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates the queryset by cursor when the 'cursor' pagination mode
+        is enabled, otherwise falls back to the offset pagination.
+        """
+        if self.pagination_mode != 'cursor':
+            return super(PaginatedListView, self).paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404()
+        return (paginator, page, page.object_list, page.has_other_pages())
 
     def get_context_data(self, **kwargs):
         """
-        Adds the category object to the context.
+        Adds the pagination settings to the context.
         """
         context = super(PaginatedListView, self).get_context_data(**kwargs)
         context['blogoland_pagination'] = self.paginate_by
+        context['blogoland_pagination_mode'] = self.pagination_mode
+        context['blogoland_page_path'] = self.request.path if self.page_paths else None
         return context
 
 
-class PostListView(PaginatedListView):
+class PostListView(ReplicaViewMixin, InstrumentedViewMixin, CachedViewMixin, PaginatedListView):
     """
     List the Post model.
     """
     model = Post
+    cache_prefix = 'post_list'
 
     def get_queryset(self, *args, **kwargs):
         """
         Returns QuerySet of Post
         """
         if self.request.user.is_staff:
-            return Post.objects.all()
-        return Post.objects.get_public_posts()
+            return Post.objects.all().prefetch_last_images()
+        return Post.objects.get_public_posts().prefetch_last_images()
 
     def get_template_names(self):
         """
@@ -48,19 +270,37 @@ class PostListView(PaginatedListView):
                 ]
 
 
-class PostDetailView(DetailView):
+class PostDetailView(ViewCountMixin, ReplicaViewMixin, InstrumentedViewMixin, ConditionalViewMixin, CachedViewMixin, DetailView):
     """
     Detail the Post model.
     """
     model = Post
+    cache_prefix = 'post_detail'
+
+    def get_cache_versions(self):
+        return [cache.post_version(self.kwargs.get('post_slug'))]
+
+    def get_validators(self):
+        """
+        Returns the modification dates of the post and its categories. Image
+        changes update the post modification date.
+        """
+        aggregate = self.get_queryset().filter(slug=self.kwargs.get('post_slug')).aggregate(
+            modified=Max('modification_date'),
+            category_modified=Max('category__modification_date'),
+        )
+        if aggregate['modified'] is None:
+            return {}
+        aggregate['staff'] = self.request.user.is_staff
+        return aggregate
 
     def get_queryset(self, *args, **kwargs):
         """
         Returns QuerySet of Post
         """
         if self.request.user.is_staff:
-            return Post.objects.all()
-        return Post.objects.get_public_posts()
+            return Post.objects.all().prefetch_last_images()
+        return Post.objects.get_public_posts().prefetch_last_images()
 
     def get_object(self):
         """
@@ -76,20 +316,39 @@ class PostDetailView(DetailView):
 
     def get_template_names(self):
         """
-        Returns template selection hierarchy.
+        Returns template selection hierarchy. The per-post template is only
+        tried when it exists.
         """
-        return [
+        return overrides.select_templates(
                 "blogoland/post_{0}.html".format(self.kwargs.get('post_slug')),
                 "blogoland/post_detail.html",
-                ]
+                )
 
 
-class CategoryPostListView(PaginatedListView):
+class CategoryPostListView(ReplicaViewMixin, InstrumentedViewMixin, ConditionalViewMixin, CachedViewMixin, PaginatedListView):
     """
     Returns the Detail of Category and the QuerySet of Posts related to
     Category and filter if user is or not logged in admin.
     """
     model = Post
+    cache_prefix = 'category_post_list'
+
+    def get_cache_versions(self):
+        return [cache.category_version(self.kwargs.get('category_slug'))]
+
+    def get_validators(self):
+        """
+        Returns the validators of the category from its stored values: its
+        modification date, the date its posts last changed and their counts.
+        """
+        category = self.get_object()
+        return {
+            'counts': category.get_post_counts(),
+            'modified': category.modification_date,
+            'posts_modified': category.posts_modification_date,
+            'staff': self.request.user.is_staff,
+            'query': self.request.GET.urlencode(),
+        }
 
     def get_queryset(self, *args, **kwargs):
         """
@@ -97,34 +356,195 @@ class CategoryPostListView(PaginatedListView):
         """
         category = self.get_object()
         if self.request.user.is_staff:
-            return Post.objects.filter(category=category)
-        return Post.objects.get_public_posts().filter(category=category)
+            return Post.objects.filter(category=category).prefetch_last_images()
+        return Post.objects.get_public_posts().filter(category=category).prefetch_last_images()
 
     def get_object(self):
         """
-        Get the category by the given slug or raise 404
+        Get the category by the given slug or raise 404. It is fetched once
+        per request.
         """
-        category_slug = self.kwargs.get('category_slug', None)
-        try:
-            category = Category.objects.get(slug=category_slug)
-        except:
-            raise Http404()
-        return category
+        if getattr(self, 'category', None) is None:
+            category_slug = self.kwargs.get('category_slug', None)
+            try:
+                self.category = Category.objects.get(slug=category_slug)
+            except:
+                raise Http404()
+        return self.category
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        """
+        Returns a paginator counting the posts from the counts stored on the
+        category.
+        """
+        total, public = self.get_object().get_post_counts()
+        return CountedPaginator(
+            queryset, per_page, count=total if self.request.user.is_staff else public,
+            orphans=orphans, allow_empty_first_page=allow_empty_first_page, **kwargs)
 
     def get_context_data(self, **kwargs):
         """
         Adds the category object to the context.
         """
         context = super(CategoryPostListView, self).get_context_data(**kwargs)
-        category = self.get_object()
-        context['object'] = category
+        context['object'] = self.get_object()
         return context
 
     def get_template_names(self):
         """
-        Returns template selection hierarchy.
+        Returns template selection hierarchy. The per-category template is
+        only tried when it exists.
         """
-        return [
+        return overrides.select_templates(
                 "blogoland/category_{0}_list.html".format(self.kwargs.get('category_slug')),
                 "blogoland/category_post_list.html",
+                )
+
+
+class PostArchiveView(InstrumentedViewMixin, ConditionalViewMixin, CachedViewMixin, PaginatedListView):
+    """
+    Lists the posts published in a year, or in a month of it, optionally
+    within a category. The posts are counted from the archive index.
+    """
+    model = Post
+    cache_prefix = 'post_archive'
+
+    def get_cache_versions(self):
+        names = [cache.LIST_VERSION]
+        if self.kwargs.get('category_slug'):
+            names.append(cache.category_version(self.kwargs['category_slug']))
+        return names
+
+    def get_validators(self):
+        return self.get_version_validators(self.get_cache_versions())
+
+    def get_category(self):
+        """
+        Returns the category of the archive, fetched once per request, or
+        None.
+        """
+        category_slug = self.kwargs.get('category_slug', None)
+        if category_slug is None:
+            return None
+        if getattr(self, 'category', None) is None:
+            try:
+                self.category = Category.objects.get(slug=category_slug)
+            except Category.DoesNotExist:
+                raise Http404()
+        return self.category
+
+    def get_month(self):
+        """
+        Returns the requested month number, or None for a whole year.
+        """
+        month = self.kwargs.get('month', None)
+        if month is None:
+            return None
+        if not 1 <= int(month) <= 12:
+            raise Http404()
+        return int(month)
+
+    def get_year(self):
+        year = int(self.kwargs['year'])
+        if year < 1:
+            raise Http404()
+        return year
+
+    def get_date_range(self):
+        """
+        Returns the first day of the archive and the first day after it.
+        """
+        year, month = self.get_year(), self.get_month()
+        if month is not None:
+            return archive.month_range(year, month)
+        return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+
+    def get_archive_count(self):
+        """
+        Returns the number of posts of the archive from the archive index.
+        """
+        if getattr(self, 'archive_count', None) is None:
+            self.archive_count = archive.get_post_count(
+                self.get_year(), self.get_month(), self.get_category(), self.request.user.is_staff)
+        return self.archive_count
+
+    def get_queryset(self, *args, **kwargs):
+        """
+        Returns the Post QuerySet published in the requested dates.
+        """
+        start, end = self.get_date_range()
+        if self.request.user.is_staff:
+            queryset = Post.objects.all()
+        else:
+            queryset = Post.objects.get_public_posts()
+        queryset = queryset.filter(publication_date__gte=start, publication_date__lt=end)
+        if self.get_category() is not None:
+            queryset = queryset.filter(category=self.get_category())
+        return queryset.prefetch_last_images()
+
+    def get(self, request, *args, **kwargs):
+        if not self.get_archive_count():
+            raise Http404()
+        return super(PostArchiveView, self).get(request, *args, **kwargs)
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        """
+        Returns a paginator counting the posts from the archive index.
+        """
+        return CountedPaginator(
+            queryset, per_page, count=self.get_archive_count(),
+            orphans=orphans, allow_empty_first_page=allow_empty_first_page, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        """
+        Adds the archive dates and the category, if any, to the context.
+        """
+        context = super(PostArchiveView, self).get_context_data(**kwargs)
+        context['archive_date'] = self.get_date_range()[0]
+        context['archive_month'] = self.get_month() is not None
+        context['object'] = self.get_category()
+        return context
+
+    def get_template_names(self):
+        """
+        Returns template selection hierarchy.
+        """
+        return [
+                "blogoland/post_archive.html",
+                ]
+
+
+class PostSearchView(InstrumentedViewMixin, PaginatedListView):
+    """
+    Full-text search of the Post model, ranked by relevance.
+    """
+    model = Post
+    # The results are ordered by rank, which can't be used as a cursor.
+    pagination_mode = 'page'
+    query_kwarg = 'q'
+
+    def get_queryset(self, *args, **kwargs):
+        """
+        Returns the QuerySet of Post matching the search query.
+        """
+        if self.request.user.is_staff:
+            queryset = Post.objects.all()
+        else:
+            queryset = Post.objects.get_public_posts()
+        return search.search(queryset, self.request.GET.get(self.query_kwarg)).prefetch_last_images()
+
+    def get_context_data(self, **kwargs):
+        """
+        Adds the search query to the context.
+        """
+        context = super(PostSearchView, self).get_context_data(**kwargs)
+        context['query'] = self.request.GET.get(self.query_kwarg, '')
+        return context
+
+    def get_template_names(self):
+        """
+        Returns template selection hierarchy.
+        """
+        return [
+                "blogoland/post_search.html",
                 ]
@@ -0,0 +1,140 @@
+# -*- coding:utf8 -*-
+"""
+Cached data of the sidebar template tags.
+
+The latest posts, the category list and the archive months are kept as
+compact immutable snapshots in a bounded in-process LRU. The entries are
+tied to the shared list version of ``blogoland.cache``, which the Post and
+Category signals bump, so every worker drops its snapshots on its next
+request after a change.
+"""
+import datetime
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+
+from blogoland import archive, cache, routers
+from blogoland.confs import DEFAULT_WIDGET_CACHE_SIZE, DEFAULT_WIDGET_CACHE_TIMEOUT
+from blogoland.models import Post, Category, TODAY
+
+
+WIDGET_CACHE_SIZE = getattr(settings, 'BLOGOLAND_WIDGET_CACHE_SIZE', DEFAULT_WIDGET_CACHE_SIZE)
+WIDGET_CACHE_TIMEOUT = getattr(settings, 'BLOGOLAND_WIDGET_CACHE_TIMEOUT', DEFAULT_WIDGET_CACHE_TIMEOUT)
+
+local_cache = cache.LocalCache(WIDGET_CACHE_SIZE)
+
+POST_SNAPSHOT_FIELDS = ('pk', 'title', 'slug', 'publication_date', 'is_visible', 'seo_description', 'excerpt')
+CATEGORY_SNAPSHOT_FIELDS = ('pk', 'title', 'slug')
+CATEGORY_COUNT_SNAPSHOT_FIELDS = CATEGORY_SNAPSHOT_FIELDS + ('post_count', 'public_post_count')
+
+
+class PostSnapshot(namedtuple('PostSnapshot', POST_SNAPSHOT_FIELDS)):
+    """
+    Read-only copy of the Post fields shown by the sidebar widgets.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return self.slug
+
+    def get_absolute_url(self):
+        return reverse('blogoland:post_detail', kwargs={'post_slug': self.slug})
+
+    def is_public(self):
+        return self.publication_date <= TODAY() and self.is_visible
+
+
+class CategorySnapshot(namedtuple('CategorySnapshot', CATEGORY_SNAPSHOT_FIELDS)):
+    """
+    Read-only copy of the Category fields shown by the sidebar widgets.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return self.title
+
+    def get_absolute_url(self):
+        return reverse('blogoland:category_post_list', kwargs={'category_slug': self.slug})
+
+
+class CategoryCountSnapshot(namedtuple('CategoryCountSnapshot', CATEGORY_COUNT_SNAPSHOT_FIELDS)):
+    """
+    Read-only copy of a Category with its post counts.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return self.title
+
+    def get_absolute_url(self):
+        return reverse('blogoland:category_post_list', kwargs={'category_slug': self.slug})
+
+
+def get_cached(key, compute):
+    """
+    Returns the snapshots of the given key, computing them from the replica
+    database, if any, on a miss. Snapshots read from the replica are not
+    kept while the list version settles.
+    """
+    if not WIDGET_CACHE_TIMEOUT:
+        with routers.replica_reads():
+            return compute()
+    version = cache.get_versions([cache.LIST_VERSION])[0]
+    value = local_cache.get(key, version)
+    if value is None:
+        with routers.replica_reads():
+            value = compute()
+            # A lagging replica may not have the change of a recent bump yet.
+            if routers.has_read_replica() and cache.is_settling([cache.LIST_VERSION]):
+                return value
+        # Public posts only change at midnight without a save.
+        tomorrow = datetime.datetime.combine(TODAY() + datetime.timedelta(days=1), datetime.time.min)
+        timeout = cache.get_timeout(tomorrow, WIDGET_CACHE_TIMEOUT)
+        local_cache.set(key, version, value, timeout)
+    return value
+
+
+def get_latest_posts(post_limit=None):
+    """
+    Returns a tuple with snapshots of the latest public posts.
+    """
+    def compute():
+        rows = Post.objects.get_public_posts().values_list(*POST_SNAPSHOT_FIELDS)[:post_limit]
+        return tuple(PostSnapshot(*row) for row in rows)
+    return get_cached(('latest_posts', post_limit), compute)
+
+
+def get_category_list(cat_limit=None):
+    """
+    Returns a tuple with snapshots of the categories.
+    """
+    def compute():
+        rows = Category.objects.values_list(*CATEGORY_SNAPSHOT_FIELDS)[:cat_limit]
+        return tuple(CategorySnapshot(*row) for row in rows)
+    return get_cached(('category_list', cat_limit), compute)
+
+
+def get_category_list_with_counts(cat_limit=None):
+    """
+    Returns a tuple with snapshots of the categories and their post counts.
+    The counts not computed today are stored again first.
+    """
+    def compute():
+        queryset = Category.objects.values_list(*CATEGORY_COUNT_SNAPSHOT_FIELDS + ('post_count_date',))[:cat_limit]
+        rows = list(queryset)
+        stale = [row[0] for row in rows if row[-1] != TODAY()]
+        if stale:
+            Category.objects.filter(pk__in=stale).refresh_post_counts()
+            rows = list(queryset.all())
+        return tuple(CategoryCountSnapshot(*row[:-1]) for row in rows)
+    return get_cached(('category_list_with_counts', cat_limit), compute)
+
+
+def get_archive_months(category=None, staff=False):
+    """
+    Returns a tuple with the (first day, post count) of the months with
+    posts, from the archive index.
+    """
+    key = ('archive_months', category.pk if category is not None else None, staff)
+    return get_cached(key, lambda: tuple(archive.get_months(category, staff)))